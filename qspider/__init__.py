@@ -28,9 +28,55 @@ from .core import ThreadWorker
 from .core import ProcessManager
 from .core import ProcessTaskQueue
 from .core import ProcessWorker
+from .core import HybridManager
+from .core import HybridWorker
+from .core import AsyncManager
+from .core import AsyncWorker
 from .core import SharedCounter
+from .core import Follow
+from .core import Frontier
 from .core import genqspider
 
+from .autoscale import Autoscaler
+from .checkpoint import Checkpoint
+from .retry import RetryPolicy
+from .sessions import SessionPool
+from .httpcache import HTTPCache
+from .httpcache import CachingAdapter
+from .sinks import Sink
+from .sinks import JSONLSink
+from .sinks import CSVSink
+from .sinks import PickleSink
+from .sinks import CallbackSink
+from .transport import SharedMemoryTransport
+from .transport import SharedResult
+from .metrics import Histogram
+from .metrics import Metrics
+from .metrics import MetricsExporter
+from .tracing import Tracer
+from .errors import ErrorAggregator
+from .dedup import Filter
+from .dedup import SetFilter
+from .dedup import BloomFilter
+from .dedup import canonicalize_url
+from .dedup import url_fingerprint
+
+from .distributed import DistributedManager
+from .distributed import Broker
+from .distributed import run_worker
+
+from .pool import WorkerPool
+from .pool import Batch
+
+from .scheduler import PoliteTaskQueue
+from .scheduler import TokenBucket
+
+from .priority import PriorityTaskQueue
+from .priority import ProcessPriorityTaskQueue
+
+from .spill import SpillTaskQueue
+from .spill import ProcessSpillTaskQueue
+
 from .utils import INFO
 from .utils import INPUT
 from .utils import WARN
@@ -42,6 +88,15 @@ from .decorators import concurrent
 
 
 __all__ = ['QSpider', 'ThreadManager', 'ThreadTaskQueue', 'ThreadWorker', 'Task',
-           'ProcessManager', 'ProcessTaskQueue', 'ProcessWorker', 'genqspider',
-           'SharedCounter', 'display_progress', 'Timer', 'INFO', 'WARN', 'ERROR', 'INPUT',
+           'ProcessManager', 'ProcessTaskQueue', 'ProcessWorker', 'HybridManager', 'HybridWorker',
+           'AsyncManager', 'AsyncWorker', 'Follow', 'Frontier',
+           'genqspider', 'SharedCounter', 'Autoscaler', 'Checkpoint', 'RetryPolicy', 'SessionPool',
+           'HTTPCache', 'CachingAdapter',
+           'Sink', 'JSONLSink', 'CSVSink', 'PickleSink', 'CallbackSink',
+           'SharedMemoryTransport', 'SharedResult', 'Histogram', 'Metrics', 'MetricsExporter', 'Tracer',
+           'ErrorAggregator', 'Filter', 'SetFilter', 'BloomFilter', 'canonicalize_url', 'url_fingerprint',
+           'DistributedManager', 'Broker', 'run_worker',
+           'WorkerPool', 'Batch', 'PoliteTaskQueue', 'TokenBucket', 'PriorityTaskQueue', 'ProcessPriorityTaskQueue',
+           'SpillTaskQueue', 'ProcessSpillTaskQueue',
+           'display_progress', 'Timer', 'INFO', 'WARN', 'ERROR', 'INPUT',
            'concurrent']
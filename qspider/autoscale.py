@@ -0,0 +1,172 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import logging
+import threading as td
+from threading import Thread
+
+from .utils import INFO
+
+
+logger = logging.getLogger(__name__)
+
+
+class Autoscaler(Thread):
+    """An autoscaler thread which adds or retires the workers of a manager
+    according to the measured throughput (tasks done per second), error rate
+    and latency of tasks.
+    The number of workers is doubled while throughput keeps growing (slow
+    start), then climbs by steps of about a tenth and turns around when the
+    throughput drops (hill climbing). It is cut by a quarter when the error
+    rate or the latency climbs, where the latency of a task is estimated by
+    Little's law as workers / throughput.
+
+    Attributes
+        :param manager: (BaseManager) the manager whose workers are scaled.
+        :param min_workers: optional (int) the minimum number of workers. Default is 1.
+        :param max_workers: optional (int) the maximum number of workers. Default is 64.
+        :param interval: optional (float) seconds between scaling decisions. Default is 1.
+        :param tolerance: optional (float) the relative change of throughput taken
+            as noise. Default is 0.05.
+        :param max_error_rate: optional (float) the error rate which is always
+            tolerated. Default is 0.1.
+        :param max_latency_ratio: optional (float) the ratio of the latency to the
+            lowest latency seen, beyond which workers are cut. Default is 2.
+    """
+
+    decrease = 0.75
+    min_tasks = 10
+
+    def __init__(self, manager, min_workers=1, max_workers=64, interval=1.0, tolerance=0.05,
+                 max_error_rate=0.1, max_latency_ratio=2.0):
+        Thread.__init__(self, daemon=True)
+        self.manager = manager
+        self.min_workers = max(min_workers, 1)
+        self.max_workers = max(max_workers, self.min_workers)
+        self.interval = interval
+        self.tolerance = tolerance
+        self.max_error_rate = max_error_rate
+        self.max_latency_ratio = max_latency_ratio
+        self.workers = []
+        self.lock = td.Lock()
+        self.stopped = td.Event()
+        self.slow_start = True
+        self.direction = 1
+        self.last_throughput = None
+        self.min_latency = None
+        self.min_error_rate = None
+
+    @property
+    def num_workers(self):
+        """The number of workers which are not retired."""
+        return sum(1 for worker in self.workers if not worker.stopping.is_set())
+
+    def start_workers(self):
+        """Start min_workers workers and the autoscaler.
+        :rtype (list): the workers, which grows when workers are added.
+        """
+        self.scale_to(self.min_workers)
+        self.start()
+        return self.workers
+
+    def run(self):
+        task_queue = self.manager.task_queue
+        last_time = time.time()
+        last_done = task_queue.num_task_done.value
+        last_failed = task_queue.num_failed.value
+        while not self.stopped.wait(self.interval):
+            if task_queue.finished():
+                break
+            now = time.time()
+            num_done = task_queue.num_task_done.value - last_done
+            num_failed = task_queue.num_failed.value - last_failed
+            if num_done + num_failed < self.min_tasks and now - last_time < 10 * self.interval:
+                continue
+            throughput = num_done / (now - last_time)
+            error_rate = num_failed / max(num_done + num_failed, 1)
+            self.step(throughput, error_rate, starving=task_queue.empty())
+            last_time = now
+            last_done += num_done
+            last_failed += num_failed
+
+    def step(self, throughput, error_rate, starving=False):
+        """Make a scaling decision from the measurements of the last interval.
+        :param throughput: (float) tasks done per second.
+        :param error_rate: (float) the fraction of failed runs of tasks.
+        :param starving: optional (bool) whether workers are waiting for tasks,
+            when adding workers does not help.
+        """
+        num_workers = self.num_workers
+        latency = num_workers / throughput if throughput > 0 else float('inf')
+        self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+        self.min_error_rate = error_rate if self.min_error_rate is None else min(self.min_error_rate, error_rate)
+
+        error_climbing = error_rate > self.max_error_rate and error_rate > 2 * self.min_error_rate
+        latency_climbing = latency > self.max_latency_ratio * self.min_latency
+        improved = self.last_throughput is not None and throughput > self.last_throughput * (1 + self.tolerance)
+        dropped = self.last_throughput is not None and throughput < self.last_throughput * (1 - self.tolerance)
+        step = max(1, num_workers // 10)
+        if error_climbing or latency_climbing:
+            target = int(num_workers * self.decrease)
+            self.slow_start = False
+            self.direction = 1
+            reason = 'error rate climbs' if error_climbing else 'latency climbs'
+        elif starving:
+            target = num_workers
+            reason = 'waiting for tasks'
+        elif self.last_throughput is None or (self.slow_start and improved):
+            target = num_workers * 2
+            reason = 'slow start'
+        else:
+            self.slow_start = False
+            if dropped or not improved and self.direction > 0:
+                self.direction = -self.direction
+            target = num_workers + self.direction * step
+            reason = 'throughput %s' % ('dropped' if dropped else 'improved' if improved else 'flat')
+        self.last_throughput = throughput
+
+        target = max(self.min_workers, min(self.max_workers, target))
+        if target != num_workers:
+            logger.info("%s Autoscaler: %d -> %d workers, %s (%.1f tasks/s, error rate %.1f%%, latency %.3fs)" % (
+                INFO, num_workers, target, reason, throughput, error_rate * 100, latency))
+            self.scale_to(target)
+
+    def scale_to(self, num_workers):
+        """Add or retire workers until there are num_workers workers.
+        Retired workers quit after the tasks they are running.
+        :param num_workers: (int) the number of workers.
+        """
+        with self.lock:
+            active = [worker for worker in self.workers if not worker.stopping.is_set()]
+            for i in range(num_workers - len(active)):
+                worker = self.manager._make_worker()
+                worker.start()
+                self.workers.append(worker)
+            for worker in active[num_workers:][::-1]:
+                worker.stop()
+
+    def stop(self):
+        """Stop scaling workers."""
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
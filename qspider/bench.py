@@ -0,0 +1,360 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Benchmarks of the overhead of QSpider itself, which run offline.
+
+Run `python -m qspider.bench` to run all the suites and print the results,
+or pick suites and write the results as JSON to compare them across versions:
+
+    python -m qspider.bench queue overhead -o before.json
+    python -m qspider.bench queue overhead -o after.json --compare before.json
+
+Suites:
+    queue: put/get throughput of ThreadTaskQueue and ProcessTaskQueue.
+    overhead: per-task overhead of each manager with no-op tasks.
+    threads: tasks/sec of a ThreadManager for different numbers of workers,
+        with no-op tasks or tasks sleeping for --task-time seconds.
+    processes: tasks/sec of a ProcessManager for different numbers of workers.
+    http: crawl throughput against a local stub HTTP server answering after
+        --latency seconds.
+"""
+
+import os
+import json
+import time
+import socket
+import platform
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from .core import ThreadManager
+from .core import ThreadTaskQueue
+from .core import ProcessManager
+from .core import ProcessTaskQueue
+from .core import HybridManager
+from .core import AsyncManager
+
+
+def noop(task_source):
+    """A task function doing nothing, so only the framework overhead is measured."""
+    return task_source
+
+
+async def async_noop(task_source):
+    """A coroutine task function doing nothing."""
+    return task_source
+
+
+def sleep(task_source, seconds=0):
+    """A task function blocking for some seconds, like fast I/O."""
+    time.sleep(seconds)
+    return task_source
+
+
+def fetch(url, session=None):
+    """A task function fetching a page with the session of the worker."""
+    return len((session or requests).get(url).content)
+
+
+class _Sleep(object):
+    """A picklable task function sleeping for task_time seconds."""
+
+    def __init__(self, task_time):
+        self.task_time = task_time
+        self.__name__ = 'sleep'
+
+    def __call__(self, task_source):
+        return sleep(task_source, self.task_time)
+
+
+def _timed(func):
+    """Call func and return the seconds it took."""
+    start_time = time.perf_counter()
+    func()
+    return time.perf_counter() - start_time
+
+
+def bench_queue(num_tasks=100000, chunksizes=(1, 100)):
+    """Measure the put and get throughput of task queues in a single process.
+
+    :param num_tasks: optional (int) number of tasks put and got.
+    :param chunksizes: optional (iterable of int) chunk sizes of ProcessTaskQueue.
+    :rtype (list of dict): one record per queue.
+    """
+    records = []
+    queues = [('ThreadTaskQueue', lambda: ThreadTaskQueue(streaming=True))]
+    for chunksize in chunksizes:
+        queues.append(('ProcessTaskQueue(chunksize=%d)' % chunksize,
+                       lambda chunksize=chunksize: ProcessTaskQueue(streaming=True, chunksize=chunksize)))
+    for name, make_queue in queues:
+        queue = make_queue()
+        tasks = list(range(num_tasks))
+        put_time = _timed(lambda: [queue.put_many(tasks[i:i + 1000]) for i in range(0, num_tasks, 1000)])
+        queue.close()
+
+        def get_all():
+            num_got = 0
+            while num_got < num_tasks:
+                num_got += len(queue.get_chunk())
+        get_time = _timed(get_all)
+        records.append({'name': name, 'num_tasks': num_tasks,
+                        'puts_per_sec': num_tasks / put_time, 'gets_per_sec': num_tasks / get_time})
+    return records
+
+
+def bench_overhead(num_tasks=100000, num_workers=4):
+    """Measure the per-task overhead of each manager with no-op tasks.
+
+    :param num_tasks: optional (int) number of tasks of each run.
+    :param num_workers: optional (int) number of workers of each manager.
+    :rtype (list of dict): one record per manager.
+    """
+    managers = [
+        ('ThreadManager', lambda: ThreadManager(range(num_tasks), noop, num_workers=num_workers)),
+        ('ThreadManager(has_result)', lambda: ThreadManager(range(num_tasks), noop, has_result=True,
+                                                            num_workers=num_workers)),
+        ('AsyncManager', lambda: AsyncManager(range(num_tasks), async_noop, num_workers=100)),
+        ('ProcessManager(chunksize=1)', lambda: ProcessManager(range(num_tasks // 10), noop,
+                                                               num_workers=num_workers)),
+        ('ProcessManager(chunksize=auto)', lambda: ProcessManager(range(num_tasks), noop, num_workers=num_workers,
+                                                                  chunksize='auto')),
+        ('HybridManager', lambda: HybridManager(range(num_tasks // 10), noop, num_workers=num_workers,
+                                                num_threads=4)),
+    ]
+    records = []
+    for name, make_manager in managers:
+        manager = make_manager()
+        total = manager.task_queue.tot_size.value or len(manager.source)
+        elapsed = _timed(lambda: manager.run(silent=True))
+        records.append({'name': name, 'num_tasks': total, 'seconds': elapsed,
+                        'tasks_per_sec': total / elapsed, 'us_per_task': elapsed / total * 1e6})
+    return records
+
+
+def bench_thread_scaling(num_tasks=100000, workers=(1, 10, 100, 500, 1000), task_time=0, has_result=False):
+    """Measure tasks/sec of tasks run by a ThreadManager.
+
+    :param num_tasks: optional (int) number of tasks of each run.
+    :param workers: optional (iterable of int) numbers of thread workers to run with.
+    :param task_time: optional (float) seconds each task sleeps, 0 for no-op tasks.
+    :param has_result: optional (bool) whether results are collected as well.
+    :rtype (list of dict): one record per number of workers.
+    """
+    records = []
+    for num_workers in workers:
+        manager = ThreadManager(range(num_tasks), _Sleep(task_time) if task_time else noop,
+                                has_result=has_result, num_workers=num_workers)
+        elapsed = _timed(lambda: manager.run(silent=True))
+        records.append({'num_workers': num_workers, 'num_tasks': num_tasks,
+                        'seconds': elapsed, 'tasks_per_sec': num_tasks / elapsed})
+    return records
+
+
+def bench_process_scaling(num_tasks=20000, workers=None, task_time=0, chunksize='auto'):
+    """Measure tasks/sec of tasks run by a ProcessManager.
+
+    :param num_tasks: optional (int) number of tasks of each run.
+    :param workers: optional (iterable of int or None) numbers of worker processes
+        to run with. Default is powers of 2 up to the number of cpu cores.
+    :param task_time: optional (float) seconds each task sleeps, 0 for no-op tasks.
+    :param chunksize: optional (int or 'auto') the chunk size of the task queue.
+    :rtype (list of dict): one record per number of workers.
+    """
+    if workers is None:
+        cpu_count = os.cpu_count() or 1
+        workers = sorted({min(1 << i, cpu_count) for i in range(cpu_count.bit_length() + 1)})
+    records = []
+    for num_workers in workers:
+        manager = ProcessManager(range(num_tasks), _Sleep(task_time) if task_time else noop,
+                                 num_workers=num_workers, chunksize=chunksize)
+        elapsed = _timed(lambda: manager.run(silent=True))
+        records.append({'num_workers': num_workers, 'num_tasks': num_tasks,
+                        'seconds': elapsed, 'tasks_per_sec': num_tasks / elapsed})
+    return records
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """A handler of the stub server, which answers every GET request with a body
+    of body_size bytes after latency seconds, on keep-alive connections."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        body = self.server.body
+        # Write the header and the body at once, so that they go out in one
+        # segment instead of waiting for a delayed ACK.
+        header = ('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: %d\r\n\r\n' % len(body)).encode()
+        self.wfile.write(header + body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """A local HTTP server for benchmarks, serving in a daemon thread.
+
+    Attributes
+        :param latency: optional (float) seconds to wait before answering. Default is 0.01.
+        :param body_size: optional (int) size of the body in bytes. Default is 10 KiB.
+        :param port: optional (int) port to listen on, 0 for a free one. Default is 0.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency=0.01, body_size=10240, port=0):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', port), StubHandler)
+        self.latency = latency
+        self.body = b'x' * body_size
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/' % self.server_address[1]
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        ThreadingHTTPServer.server_bind(self)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.shutdown()
+        self.server_close()
+        return False
+
+
+def bench_http(num_tasks=2000, workers=(10, 50, 100), latency=0.01, body_size=10240):
+    """Measure pages/sec of crawling a local stub server by a ThreadManager with
+    pooled sessions.
+
+    :param num_tasks: optional (int) number of pages of each run.
+    :param workers: optional (iterable of int) numbers of thread workers to run with.
+    :param latency: optional (float) seconds the server waits before answering.
+    :param body_size: optional (int) size of each page in bytes.
+    :rtype (list of dict): one record per number of workers.
+    """
+    records = []
+    with StubServer(latency, body_size) as server:
+        urls = ['%s?page=%d' % (server.url, i) for i in range(num_tasks)]
+        for num_workers in workers:
+            manager = ThreadManager(urls, fetch, num_workers=num_workers, session=True)
+            elapsed = _timed(lambda: manager.run(silent=True))
+            records.append({'num_workers': num_workers, 'num_tasks': num_tasks, 'latency': latency,
+                            'seconds': elapsed, 'pages_per_sec': num_tasks / elapsed})
+    return records
+
+
+def environment():
+    """Return the versions and the machine the benchmarks run on."""
+    try:
+        from importlib.metadata import version
+        qspider_version = version('qspider')
+    except Exception:
+        qspider_version = 'unknown'
+    return {'qspider': qspider_version, 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'time': time.time()}
+
+
+def compare(results, baseline):
+    """Print the change of the throughput of each record against a baseline.
+
+    :param results: (dict) results of the suites, as written by main.
+    :param baseline: (dict) results of a previous run.
+    """
+    print("\n%-12s %-36s %12s %12s %8s" % ('suite', 'case', 'baseline', 'current', 'change'))
+    for suite, records in results['suites'].items():
+        old_records = {_case(record): record for record in baseline.get('suites', {}).get(suite, [])}
+        for record in records:
+            old = old_records.get(_case(record))
+            if old is None:
+                continue
+            key = _throughput_key(record)
+            change = record[key] / old[key] - 1 if old[key] else 0
+            print("%-12s %-36s %12.0f %12.0f %+7.1f%%" % (suite, _case(record), old[key], record[key], change * 100))
+
+
+def _case(record):
+    return str(record.get('name', record.get('num_workers')))
+
+
+def _throughput_key(record):
+    return next(key for key in ('tasks_per_sec', 'pages_per_sec', 'gets_per_sec') if key in record)
+
+
+def _print_records(suite, records):
+    print("\n[%s]" % suite)
+    keys = list(records[0])
+    print(' '.join('%16s' % key for key in keys))
+    for record in records:
+        print(' '.join('%16.2f' % value if isinstance(value, float) else '%16s' % value for value in record.values()))
+
+
+def main():
+    suites = ['queue', 'overhead', 'threads', 'processes', 'http']
+    parser = argparse.ArgumentParser("Benchmark the overhead of QSpider")
+    parser.add_argument('suites', nargs='*', metavar='suite',
+                        help="Suites to run out of %s, all of them by default" % ', '.join(suites))
+    parser.add_argument('-n', '--num-tasks', type=int, default=100000, help="Number of tasks of each run")
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 10, 100, 500, 1000],
+                        help="Numbers of thread workers to run with")
+    parser.add_argument('-p', '--processes', type=int, nargs='+', default=None,
+                        help="Numbers of worker processes to run with")
+    parser.add_argument('-t', '--task-time', type=float, default=0, help="Seconds each task sleeps")
+    parser.add_argument('-l', '--latency', type=float, default=0.01, help="Seconds the stub server waits")
+    parser.add_argument('-o', '--output', help="Path of a JSON file to write the results into")
+    parser.add_argument('-c', '--compare', help="Path of a JSON file of a previous run to compare with")
+    args = parser.parse_args()
+    for suite in args.suites:
+        if suite not in suites:
+            parser.error("unknown suite %r, choose from %s" % (suite, ', '.join(suites)))
+
+    num_tasks = args.num_tasks
+    runs = {
+        'queue': lambda: bench_queue(num_tasks),
+        'overhead': lambda: bench_overhead(num_tasks),
+        'threads': lambda: bench_thread_scaling(num_tasks, args.workers, args.task_time),
+        'processes': lambda: bench_process_scaling(max(num_tasks // 5, 1), args.processes, args.task_time),
+        'http': lambda: bench_http(max(num_tasks // 50, 1), [w for w in args.workers if w <= 200] or [10],
+                                   args.latency),
+    }
+    results = {'environment': environment(), 'suites': {}}
+    for suite in args.suites or suites:
+        records = runs[suite]()
+        results['suites'][suite] = records
+        _print_records(suite, records)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import time
+import threading as td
+from array import array
+from collections import deque
+
+
+class Checkpoint(object):
+    """A crash-safe checkpoint of a run, which journals the indices of the
+    source items whose tasks succeeded, so that a resumed run skips them.
+    Each process appends the indices to its own journal file in the checkpoint
+    directory in batches, and syncs the file to disk at most every sync_interval
+    seconds, so a crash loses at most the last sync_interval seconds of records,
+    whose tasks are run again after resuming.
+
+    Attributes
+        :param path: (str) the directory of the journal files, created if it
+            does not exist.
+        :param batch_size: optional (int) the number of indices buffered before
+            they are written. Default is 4096.
+        :param sync_interval: optional (float) the maximum seconds between
+            writing and syncing buffered indices. Default is 1.
+    """
+
+    # Journals hold index + 1 as 8-byte integers, so that zeros left by a crash
+    # in the middle of a write are never taken as index 0.
+    typecode = 'q'
+    read_size = 1 << 20
+
+    def __init__(self, path, batch_size=4096, sync_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.pending = deque()
+        self.lock = td.Lock()
+        self.fd = None
+        self.pid = None
+        self.last_sync = time.time()
+        self.done = bytearray()
+
+    def record(self, index):
+        """Record that the task of a source item succeeded.
+        :param index: (int) the index of the source item in the source.
+        """
+        self.pending.append(index)
+        if len(self.pending) >= self.batch_size or time.time() - self.last_sync >= self.sync_interval:
+            self.flush()
+
+    def flush(self, sync=False):
+        """Write the buffered indices into the journal of this process.
+        :param sync: optional (bool) whether to sync the journal to disk even
+            if the last sync is less than sync_interval seconds ago.
+        """
+        with self.lock:
+            num_indices = len(self.pending)
+            if num_indices:
+                values = array(self.typecode, (self.pending.popleft() + 1 for i in range(num_indices)))
+                os.write(self._journal(), values.tobytes())
+            now = time.time()
+            if self.fd is not None and (sync or now - self.last_sync >= self.sync_interval):
+                os.fsync(self.fd)
+                self.last_sync = now
+
+    def close(self):
+        """Write and sync the buffered indices, and close the journal."""
+        self.flush(sync=True)
+        with self.lock:
+            if self.fd is not None and self.pid == os.getpid():
+                os.close(self.fd)
+            self.fd = None
+
+    def load(self):
+        """Read all the journals into a bitmap of the succeeded indices.
+        :rtype (int): the number of succeeded indices.
+        """
+        done = bytearray()
+        num_done = 0
+        for path in self._journals():
+            with open(path, 'rb') as f:
+                rest = b''
+                while True:
+                    data = f.read(self.read_size)
+                    if not data:
+                        break
+                    data = rest + data
+                    end = len(data) - len(data) % 8
+                    rest = data[end:]
+                    values = array(self.typecode)
+                    values.frombytes(data[:end])
+                    for value in values:
+                        if value <= 0:
+                            continue
+                        index = value - 1
+                        byte = index >> 3
+                        if byte >= len(done):
+                            done.extend(bytes(max(byte + 1, 2 * len(done)) - len(done)))
+                        bit = 1 << (index & 7)
+                        if not done[byte] & bit:
+                            done[byte] |= bit
+                            num_done += 1
+        self.done = done
+        return num_done
+
+    def is_done(self, index):
+        """Return if the task of a source item succeeded in the loaded journals.
+        :param index: (int) the index of the source item in the source.
+        :rtype (bool): whether the task succeeded.
+        """
+        byte = index >> 3
+        return byte < len(self.done) and bool(self.done[byte] >> (index & 7) & 1)
+
+    def clear(self):
+        """Remove all the journals, to start a new run."""
+        self.close()
+        for path in self._journals():
+            os.remove(path)
+        self.done = bytearray()
+
+    def _journal(self):
+        """Return the file descriptor of the journal of this process."""
+        pid = os.getpid()
+        if self.fd is None or self.pid != pid:
+            os.makedirs(self.path, exist_ok=True)
+            self.fd = os.open(os.path.join(self.path, 'done.%d.log' % pid),
+                              os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            self.pid = pid
+        return self.fd
+
+    def _journals(self):
+        if not os.path.isdir(self.path):
+            return []
+        return [os.path.join(self.path, name) for name in sorted(os.listdir(self.path))
+                if name.startswith('done.') and name.endswith('.log')]
+
+    def __getstate__(self):
+        # The buffer, the lock and the journal belong to the process which created them.
+        state = self.__dict__.copy()
+        state['pending'] = deque()
+        state['fd'] = None
+        state['pid'] = None
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = td.Lock()
@@ -21,13 +21,20 @@
 # SOFTWARE.
 
 import os
+import sys
+import time
+import heapq
+import asyncio
 import shutil
 import argparse
 import inspect
 import logging
+import functools
+import itertools
 import threading as td
 import multiprocessing as mp
-from queue import Queue
+from queue import Queue, Empty
+from collections import deque
 from abc import ABC, abstractmethod
 
 from .utils import INFO
@@ -38,6 +45,24 @@ from .utils import Timer
 from .utils import Thread
 from .utils import get_resource_path
 from .utils import format_class_name
+from .sessions import SessionPool
+from .sessions import accepts_session
+from .retry import RetryPolicy
+from .checkpoint import Checkpoint
+from .sinks import SinkWriter
+from .autoscale import Autoscaler
+from .transport import SharedMemoryTransport
+from .metrics import Metrics
+from .metrics import MetricsExporter
+from .profiling import profile_call
+from .profiling import make_profile_dir
+from .profiling import merge_profiles
+from .tracing import Tracer
+from .tracing import thread_id
+from .errors import ErrorAggregator
+from .dedup import Filter
+from .dedup import SetFilter
+from .dedup import url_fingerprint
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -62,12 +87,16 @@ class SharedCounter:
 
     def __init__(self, n=0, counter_type='thread'):
         self.counter_type = counter_type
-        self.count = n if self.counter_type == 'thread' else mp.Value('i', n)
+        if self.counter_type == 'thread':
+            self.count = n
+            self.lock = td.Lock()
+        else:
+            self.count = mp.Value('i', n)
 
     def increment(self, n=1):
         """Increment the counter by n (default = 1)."""
         if self.counter_type == 'thread':
-            with td.Lock():
+            with self.lock:
                 self.count += n
         else:
             with self.count.get_lock():
@@ -82,6 +111,51 @@ class SharedCounter:
             return self.count.value
 
 
+class ShardedCounter:
+    """A thread-safe counter without any lock on increment.
+    Each thread increments its own shard, and the shards are summed up
+    when the value is read, so increments never contend with each other.
+    It fits counters which are written far more often than read.
+
+    Attributes
+        :param n: optional (int) the initial value of the counter.
+    """
+
+    def __init__(self, n=0):
+        self.base = n
+        self.shards = []
+        self.local = td.local()
+        self.lock = td.Lock()
+
+    def increment(self, n=1):
+        """Increment the counter by n (default = 1)."""
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            shard = self.local.shard = [0]
+            with self.lock:
+                self.shards.append(shard)
+        shard[0] += n
+
+    @property
+    def value(self):
+        """Return the value of the counter."""
+        with self.lock:
+            shards = list(self.shards)
+        return self.base + sum(shard[0] for shard in shards)
+
+
+class _Length:
+    """A read-only counter whose value is the total length of containers."""
+
+    def __init__(self, *containers):
+        self.containers = containers
+
+    @property
+    def value(self):
+        return sum(len(container) for container in self.containers)
+
+
 class BaseQueue(ABC):
     """An abstract base queue based on multiple queue classes.
     This BaseQueue could be a FIFO/LIFO queue when passing different
@@ -96,49 +170,155 @@ class BaseQueue(ABC):
         
         :param lock_cls: (Lock class or its subclass) could be thread-lock
             or process-lock based on different needs.
+
+        :param event_cls: (Event class or its subclass) could be thread-event
+            or process-event based on different needs.
         
         :param tasks: optional (iterable) the initial tasks, could be any
             iterable types. Elements the tasks should be instances of the
             subclass of Task class, which has a run method.
+
+        :param maxsize: optional (int) the maximum number of pending tasks a
+            TaskFeeder keeps in the queue. 0 means unbounded. Default is 0.
+
+        :param streaming: optional (bool) whether tasks are fed lazily by a
+            TaskFeeder. A streaming queue stays open until close is called, and
+            workers wait for new tasks instead of quitting when it is empty.
+            Default is False.
     """
 
-    def __init__(self, counter_type, queue_cls, lock_cls, tasks=None):
+    poll_interval = 0.05
+
+    def __init__(self, counter_type, queue_cls, lock_cls, event_cls, tasks=None, maxsize=0, streaming=False):
         if tasks is None:
             tasks = []
         self.counter_type = counter_type
         self.queue = queue_cls()
         self.lock = lock_cls()
-        self.qsize = SharedCounter(0, self.counter_type)
+        self.closed = event_cls()
+        self.maxsize = maxsize
+        # Heap of (due time, sequence, task) of tasks waiting to be retried.
+        self.delayed = []
+        self.delay_seq = 0
+        self.qsize = self._make_counter()
+        self.tot_size = self._make_counter()
+        self.num_task_done = self._make_counter()
+        self.num_failed = self._make_counter()
         for task_source in tasks:
             self.put(task_source)
-        self.num_task_done = SharedCounter(0, self.counter_type)
-        self.tot_size = self.qsize
+        if not streaming:
+            self.close()
 
     def put(self, task):
-        """Put a Task instance into the queue.
+        """Put a new Task instance into the queue.
         :param task: (Task or its subclass) a Task instance
         """
         with self.lock:
+            self.qsize.increment(1)
+            self.tot_size.increment(1)
             self.queue.put(task)
+
+    def put_many(self, tasks):
+        """Put a list of new Task instances into the queue.
+        :param tasks: (list) Task instances
+        """
+        for task in tasks:
+            self.put(task)
+
+    def requeue(self, task, delay=0):
+        """Put a Task instance got from this queue back into the queue.
+        Unlike put, the task is not counted into tot_size again.
+        :param task: (Task or its subclass) a Task instance
+        :param delay: optional (float) seconds to wait before the task could be
+            got again. Default is 0.
+        """
+        with self.lock:
             self.qsize.increment(1)
+            if delay > 0:
+                self._push_delayed(task, delay)
+            else:
+                self.queue.put(task)
 
     def get(self):
-        """Get a Task instance out of the queue
-        :rtype (Task or its subclass): 
+        """Get a Task instance out of the queue.
+        If the queue is empty but still open, wait for new tasks.
+        :rtype (Task or its subclass or None): None if there are no tasks left.
+        """
+        while True:
+            if self.delayed:
+                with self.lock:
+                    due = self._pop_due(1)
+                if due:
+                    self.qsize.increment(-1)
+                    return due[0]
+            try:
+                task = self.queue.get(timeout=self._poll_time())
+            except Empty:
+                if self.finished():
+                    return None
+                continue
+            self.qsize.increment(-1)
+            return task
+
+    def get_chunk(self):
+        """Get a chunk of Task instances out of the queue.
+        Workers get tasks chunk by chunk, and acknowledge a chunk with a
+        single task_done call.
+        :rtype (list): Task instances, empty if there are no tasks left.
+        """
+        task = self.get()
+        return [] if task is None else [task]
+
+    def take_dropped(self):
+        """Take the tasks the queue dropped instead of letting workers get them,
+        e.g. tasks past their deadline, which are counted as done.
+        :rtype (list): Task instances.
+        """
+        return []
+
+    def release(self, task):
+        """Mark that a task got from the queue has finished running, whether
+        it succeeded or not. Schedulers use this to track running tasks.
+        :param task: (Task or its subclass) a Task instance
         """
-        task = None
-        with self.lock:
-            if self.qsize.value > 0:
-                task = self.queue.get()
-                self.qsize.increment(-1)
-        return task
 
-    def task_done(self):
+    def task_done(self, n=1):
         """Increase the num_task_done if task_done is called.
         This should be called every time the Task is done.
+        :param n: optional (int) the number of tasks done. Default is 1.
+        """
+        self.num_task_done.increment(n)
+
+    def chunk_size(self):
+        """Return the number of tasks to put into a chunk."""
+        return 1
+
+    def record_time(self, seconds, num_tasks):
+        """Record the time spent on running a chunk of tasks.
+        :param seconds: (float) time spent on the chunk.
+        :param num_tasks: (int) the number of tasks in the chunk.
         """
-        with self.lock:
-            self.num_task_done.increment(1)
+
+    def hand_back(self):
+        """Put the tasks held by this process back into the queue for the other
+        processes, when the process stops getting tasks."""
+
+    def drain(self):
+        """Take the tasks left in the queue shared with other processes without
+        running them, when the run is aborted.
+        :rtype (list): Task instances.
+        """
+        return []
+
+    def feed_from(self, feeder):
+        """Start feeding tasks from a TaskFeeder.
+        :param feeder: (TaskFeeder) the feeder of this streaming queue.
+        """
+        feeder.start()
+
+    def close(self):
+        """Mark that no new tasks will be fed into the queue."""
+        self.closed.set()
 
     def empty(self):
         """Return if the queue is empty.
@@ -146,6 +326,148 @@ class BaseQueue(ABC):
         """
         return self.qsize.value == 0
 
+    def finished(self):
+        """Return if the queue is closed and all the tasks put into it are done.
+        A queue which is empty is not finished while tasks got from it are still
+        running, since they may put follow-up tasks into it, see Frontier.
+        :rtype (bool): whether workers could quit.
+        """
+        if not self.closed.is_set():
+            return False
+        # Read the tasks done first: a task puts its follow-up tasks before it
+        # is done, so tot_size is never read older than num_task_done.
+        num_done = self.num_task_done.value
+        return num_done >= self.tot_size.value
+
+    def full(self):
+        """Return if the queue holds maxsize pending tasks.
+        :rtype (bool): whether the queue is full
+        """
+        return 0 < self.maxsize <= self.qsize.value
+
+    def _make_counter(self):
+        """Return a counter shared by all the workers."""
+        return SharedCounter(0, self.counter_type)
+
+    def _push_delayed(self, task, delay):
+        """Push a task which could be got after delay seconds into the heap."""
+        self.delay_seq += 1
+        heapq.heappush(self.delayed, (time.time() + delay, self.delay_seq, task))
+
+    def _pop_due(self, max_items=None):
+        """Pop the tasks which are due out of the heap.
+        :rtype (list): Task instances.
+        """
+        tasks = []
+        now = time.time()
+        while self.delayed and self.delayed[0][0] <= now and (max_items is None or len(tasks) < max_items):
+            tasks.append(heapq.heappop(self.delayed)[2])
+        return tasks
+
+    def _next_due(self):
+        """Return the time the next delayed task is due, inf if there is none.
+        Safe without the lock, while other threads pop the heap.
+        """
+        try:
+            return self.delayed[0][0]
+        except IndexError:
+            return float('inf')
+
+    def _poll_time(self):
+        """Return how long to wait for new tasks, until the next delayed task is due."""
+        return max(min(self.poll_interval, self._next_due() - time.time()), 0.001)
+
+
+def call_task(task, session=None):
+    """Call the task function or the run method of the task.
+    If session is given, it is passed as the session argument of task functions
+    which have one, or set as the session attribute of task instances.
+    """
+    if type(task) == dict and 'caller' in task and 'source' in task:
+        if session is not None and accepts_session(task['caller']):
+            return task['caller'](task['source'], session=session)
+        return task['caller'](task['source'])
+    if session is not None:
+        task.session = session
+    return task.run()
+
+
+def task_source(task):
+    """Return the source item of a task, or None if it is unknown."""
+    if type(task) == dict and 'caller' in task and 'source' in task:
+        return task['source']
+    return getattr(task, 'task_source', None)
+
+
+def task_name(task):
+    """Return the name of the task function or the task class of a task."""
+    if type(task) == dict and 'caller' in task:
+        return getattr(task['caller'], '__name__', 'task')
+    return type(task).__name__
+
+
+def task_meta(task):
+    """Return the metadata dict attached to a task by QSpider, e.g. the index
+    of its source item in the source. Tasks which can not hold attributes get
+    a fresh empty dict.
+
+    :param task: (Task, dict or any class with a run method) a task.
+    :rtype (dict): the metadata of the task.
+    """
+    if type(task) == dict:
+        return task.setdefault('meta', {})
+    try:
+        return task.__dict__.setdefault('_qspider_meta', {})
+    except AttributeError:
+        return {}
+
+
+def make_task(task_cls, src_item, index=None, queued=False):
+    """Turn a source item into a task of a task class, or a task dict of a task function.
+
+    :param task_cls: (subclass of Task or any class with a run method, function, method)
+        task class to instantiate tasks or task function/ task method.
+    :param src_item: the source item of the task.
+    :param index: optional (int or None) the index of the source item in the source.
+    :param queued: optional (bool or float) whether to record the time the task is
+        queued at, now if True, or the time itself.
+    :rtype (Task, dict or any class with a run method): the task.
+    """
+    if inspect.isfunction(task_cls) or inspect.ismethod(task_cls):
+        task = {'caller': task_cls, 'source': src_item, 'meta': {'index': index}}
+    else:
+        task = task_cls(src_item)
+        if index is not None:
+            task_meta(task)['index'] = index
+    if queued:
+        task_meta(task)['queued'] = time.time() if queued is True else queued
+    return task
+
+
+class Follow(object):
+    """The value returned by a task which discovered follow-up sources, e.g. the
+    links of a crawled page. The follow-up sources are turned into new tasks of
+    the same run by the Frontier of the manager, and result is kept as the
+    result of the task.
+
+    Example:
+        >>> def crawl(url, session):
+        ...     page = session.get(url)
+        ...     return Follow(extract_links(page), result=page.status_code)
+
+    Attributes
+        :param sources: optional (iterable or str) the follow-up source items. A str
+            is taken as a single source item.
+        :param result: optional the result of the task. Default is None.
+    """
+
+    def __init__(self, sources=(), result=None):
+        self.sources = [sources] if isinstance(sources, (str, bytes)) else sources
+        self.result = result
+
+    def __repr__(self):
+        return "Follow{result=%r}" % (self.result,)
+
 
 class Task(ABC):
     """An abstract task class with a run method.
@@ -157,7 +479,10 @@ class Task(ABC):
     Attributes
         :param task_source: (object) the source that the task needs when 
             then task run. task_source could be any type.
+        :param session: (requests.Session or None) the HTTP session of the
+            worker running the task, if the manager has a session pool.
     """
+    session = None
 
     def __init__(self, task_source):
         self.task_source = task_source
@@ -175,10 +500,14 @@ class BaseWorker(ABC):
     model, which the instance could be a Thread or a Process instance. 
     Each worker gets a Task instance from the task queue, runs the task, and
     put the results of the task (if there are results returned by task) into the 
-    results queue. 
+    results queue. Tasks are got chunk by chunk, and the results of a chunk are put
+    as one list of (index, ok, result) tuples, where index is the index of the task
+    source in the source and ok is False for tasks put into the failed queue.
     If there are exceptions exist when the worker run the task, the worker will
-    put the task back into the task queue if failed_queue argument is None, else
-    it will put the task into the failed queue.
+    put the task back into the task queue to retry it after a backoff as long as
+    the retry policy allows, else it will put the task into the failed queue.
+    Without a retry policy, failed tasks are retried at once if failed_queue
+    argument is None.
     BaseWorker is an abstract class, which means it must be inherited
     before it can be instantiated.
     
@@ -188,37 +517,429 @@ class BaseWorker(ABC):
             returned by the task.run method.
         :param failed_queue: optional (subclass of BaseQueue) failed queue contains failed 
             task instances.
+        :param session_pool: optional (SessionPool) the pool to get the HTTP session
+            of the worker from, which is passed to all the tasks the worker runs.
+        :param retry: optional (RetryPolicy) the retry policy of failed tasks.
+        :param checkpoint: optional (Checkpoint) the checkpoint to record succeeded tasks in.
+        :param sink: optional (Sink) the sink to write results into a shard of, by a
+            writer thread of the worker, in place of the results queue.
+        :param transport: optional (SharedMemoryTransport) the transport to pass large
+            results to the manager through shared memory instead of the results queue.
+        :param metrics: optional (Metrics) the metrics of the manager, to record the run
+            time, queue wait time and errors of tasks and the busy and idle time of
+            the worker in.
+        :param profile_dir: optional (str) the directory to dump the cProfile profile
+            of the worker into, see profiling.merge_profiles.
+        :param tracer: optional (Tracer) the tracer to record the start and end time,
+            attempt number and outcome of tasks into a ring of the worker.
+        :param errors: optional (ErrorAggregator) the aggregator to report errors of
+            tasks to, instead of logging every error from the worker.
+        :param frontier: optional (Frontier) the frontier to put the follow-up tasks
+            discovered by tasks into the task queue by.
     """
 
-    def __init__(self, task_queue, res_queue=None, failed_queue=None):
+    # Whether the metrics of the worker are kept in shared memory for the manager.
+    shared_metrics = False
+
+    def __init__(self, task_queue, res_queue=None, failed_queue=None, session_pool=None, retry=None,
+                 checkpoint=None, sink=None, transport=None, metrics=None,
+                 profile_dir=None, tracer=None, errors=None, frontier=None):
         self.task_queue = task_queue
         self.res_queue = res_queue
         self.failed_queue = failed_queue
+        self.session_pool = session_pool
+        self.retry = retry
+        self.checkpoint = checkpoint
+        self.sink = sink
+        self.transport = transport
+        self.metrics = metrics.worker(self.shared_metrics) if metrics is not None else None
+        self.profile_dir = profile_dir
+        self.tracer = tracer
+        self.trace_events = None
+        self.errors = errors
+        self.frontier = frontier
+        self.session = None
+        self.stopping = td.Event()
 
     def _run(self):
         """Run tasks in the task queue until the queue is empty."""
-        while True:
-            task = self.task_queue.get()
-            if not task:
+        self._open()
+        try:
+            if self.profile_dir is None:
+                self._run_tasks()
+            else:
+                profile_call(self.profile_dir, self._run_tasks)
+        finally:
+            self._close()
+
+    def _open(self):
+        """Prepare the session and the sink writer of the worker."""
+        if self.metrics is not None:
+            self.metrics.start()
+        if self.tracer is not None:
+            self.trace_events = self.tracer.ring()
+        self._open_session()
+        if self.sink is not None:
+            self.res_queue = SinkWriter(self.sink.shard(os.getpid()), checkpoint=self.checkpoint)
+            self.res_queue.start()
+
+    def _close(self):
+        """Close the session and the sink writer, and flush the checkpoint."""
+        self._close_session()
+        if self.sink is not None:
+            self.res_queue.close()
+        if self.checkpoint is not None:
+            self.checkpoint.flush(sync=True)
+        if self.metrics is not None:
+            self.metrics.stop()
+        if self.trace_events is not None:
+            self.tracer.dump(self.trace_events, "%s %d" % (type(self).__name__, thread_id()))
+            self.trace_events = None
+
+    def stop(self):
+        """Let the worker quit after the tasks it is running."""
+        self.stopping.set()
+
+    def _run_tasks(self):
+        metrics = self.metrics
+        timed = metrics is not None or self.trace_events is not None
+        while not self.stopping.is_set():
+            wait_start = time.time()
+            tasks = self.task_queue.get_chunk()
+            if not tasks:
                 break
+            start_time = time.time()
+            if metrics is not None:
+                metrics.record_idle(start_time - wait_start)
+            results = []
+            num_done = 0
+            for task in tasks:
+                task_start = time.time() if timed else 0
+                error = None
+                try:
+                    res = self._call(task)
+                    if self.frontier is not None:
+                        res = self.frontier.expand(task, res, self.task_queue)
+                    done = self._on_success(task, res, results)
+                except Exception as e:
+                    error = e
+                    done = self._on_failure(task, e, results)
+                num_done += done
+                if timed:
+                    self._record(task, task_start, time.time(), error, done)
+                self.task_queue.release(task)
+            if results:
+                self.res_queue.put(results)
+            if num_done:
+                self.task_queue.task_done(num_done)
+            self.task_queue.record_time(time.time() - start_time, len(tasks))
+
+    def _record(self, task, start_time, end_time, error, done):
+        """Record a task run into the metrics and the trace of the worker."""
+        meta = task_meta(task)
+        if self.metrics is not None:
+            self.metrics.record_task(meta, start_time, end_time, error)
+        if self.trace_events is not None:
+            if error is None:
+                self.trace_events.append((start_time, end_time, task_name(task), meta.get('index'),
+                                          meta.get('attempts', 0) + 1, 'ok', None))
+            else:
+                self.trace_events.append((start_time, end_time, task_name(task), meta.get('index'),
+                                          meta.get('attempts', 0), 'failed' if done else 'retry',
+                                          type(error).__name__))
+
+    def _call(self, task):
+        """Call the task function or the run method of the task."""
+        return call_task(task, self.session)
+
+    def _open_session(self):
+        if self.session_pool is not None:
+            self.session = self.session_pool.create()
+
+    def _close_session(self):
+        if self.session is not None:
+            self.session_pool.release(self.session)
+            self.session = None
+
+    def _on_success(self, task, res, results):
+        """Add the result of a task done into results.
+        :rtype (int): the number of tasks done.
+        """
+        if self.res_queue is None and self.checkpoint is None:
+            return 1
+        index = task_meta(task).get('index')
+        if self.res_queue is not None:
+            if self.transport is not None:
+                res = self.transport.pack(res)
+            results.append((index, True, res))
+        # A sink writer records the task once its result is written.
+        if self.checkpoint is not None and index is not None and not isinstance(self.res_queue, SinkWriter):
+            self.checkpoint.record(index)
+        return 1
+
+    def _on_failure(self, task, e, results):
+        """Put a failed task back into the task queue to retry it, or into the
+        failed queue if it should not be retried.
+        :rtype (int): the number of tasks done.
+        """
+        self.task_queue.num_failed.increment(1)
+        meta = task_meta(task)
+        attempts = meta.get('attempts', 0) + 1
+        meta['attempts'] = attempts
+        if self.retry is None:
+            retry = not self.failed_queue
+        else:
+            retry = self.retry.should_retry(e, attempts)
+        if retry:
+            delay = self.retry.delay(attempts) if self.retry is not None else 0
+            if 'queued' in meta:
+                meta['queued'] = time.time() + delay
+            self.task_queue.requeue(task, delay)
+            if self.errors is not None:
+                self.errors.report(task, e, attempts, delay)
+            else:
+                msg = "%s Task went wrong and will be retried in %.2fs: %s. Error message: %s" % (ERROR, delay, task, e)
+                logger.warning("\r%s%s" % (msg, ' ' * (term_width - len(msg))))
+            return 0
+        meta['error'] = "%s: %s" % (type(e).__name__, e)
+        if self.failed_queue:
+            self.failed_queue.put(task)
+        if self.res_queue is not None:
+            results.append((meta.get('index'), False, None))
+        if self.errors is not None:
+            self.errors.report(task, e, attempts)
+            return 1
+        msg = "%s Task went wrong %d times and added it into failed queue: %s. Error message: %s" % (
+            ERROR, attempts, task, e)
+        logger.error("\r%s%s" % (msg, ' ' * (term_width - len(msg))))
+        return 1
+
+
+class TaskFeeder(Thread):
+    """A feeder to pull task sources lazily into a streaming task queue.
+    The feeder either runs as a thread, or is read by the workers themselves when
+    they run out of tasks, depending on the task queue (see BaseQueue.feed_from).
+    Either way, it stops reading while the task queue is full, so that only a
+    bounded number of tasks stays in memory no matter how large the source is.
+    The task queue is closed once the source is exhausted.
+
+    Attributes
+        :param task_queue: (subclass of BaseQueue) a streaming task queue.
+        :param source: (iterable) the sources that tasks need for running tasks,
+            could be any iterable, iterator or generator.
+        :param make_task: (callable) function to turn a source item, its index and
+            optionally the time it was queued at into a task.
+        :param window: optional (int or None) if set, the feeder waits until the
+            index of the next source item is less than head.value + window.
+            It bounds the reorder buffer when results are yielded in order.
+        :param head: optional (SharedCounter) the index of the first source item
+            whose result has not been consumed yet.
+        :param skip: optional (callable or None) function of the index of a source
+            item, which returns True if the item should be skipped, e.g. when its
+            task succeeded before resuming a run.
+        :param dedup: optional (callable or None) function of a source item, which
+            returns False if the item is a duplicate of one read before, so that it
+            is skipped. The indices of duplicates are kept in duplicates if window
+            is set, so that results in order do not wait for them.
+    """
+
+    poll_interval = 0.001
+    max_read_time = 0.01
+    batch_size = 256
+
+    def __init__(self, task_queue, source, make_task, window=None, head=None, skip=None, dedup=None):
+        Thread.__init__(self, daemon=True)
+        self.task_queue = task_queue
+        self.source = source
+        self.make_task = make_task
+        self.window = window
+        self.head = head
+        self.skip = skip
+        self.dedup = dedup
+        self.duplicates = set()
+        self.num_duplicates = 0
+        self.items = enumerate(self.source)
+        self.next_index = 0
+        self.take_size = 1
+        self.stopped = td.Event()
+
+    def run(self):
+        while not self.task_queue.closed.is_set():
+            if not self.feed():
+                time.sleep(self.poll_interval)
+
+    def feed(self):
+        """Read the next source items into the task queue.
+        :rtype (int): number of tasks put into the task queue.
+        """
+        max_items = max(self.batch_size, self.task_queue.chunk_size())
+        tasks = [self.make_task(src_item, index) for index, src_item in self.take(max_items)]
+        if tasks:
+            self.task_queue.put_many(tasks)
+        if self.stopped.is_set():
+            self.task_queue.close()
+        return len(tasks)
+
+    def take(self, max_items=None):
+        """Read the next source items as (index, source item) pairs.
+        At most take_size items are read at a time. take_size starts from 1
+        and is halved if reading takes longer than max_read_time, so that the
+        items of a slow source are not held back, and doubled up to max_items
+        otherwise. Skipped items are read on until some items are left or
+        max_read_time is up.
+        :param max_items: optional (int or None) the maximum number of items
+            to read at a time. Default is batch_size.
+        :rtype (list): (index, source item) pairs, empty if no items could
+            be read for now.
+        """
+        max_items = max_items or self.batch_size
+        num_items = min(self.take_size, max_items)
+        if self.task_queue.maxsize:
+            num_items = min(num_items, self.task_queue.maxsize - self.task_queue.qsize.value)
+        if self.window is not None:
+            num_items = min(num_items, self.head.value + self.window - self.next_index)
+        if num_items <= 0 or self.stopped.is_set():
+            return []
+
+        start_time = time.time()
+        while True:
             try:
-                if type(task) == dict and 'caller' in task and 'source' in task:
-                    res = task['caller'](task['source'])
-                else:
-                    res = task.run()
-                if self.res_queue:
-                    self.res_queue.put(res)
-                self.task_queue.task_done()
+                items = list(itertools.islice(self.items, num_items))
             except Exception as e:
-                if self.failed_queue:
-                    self.failed_queue.put(task)
-                    self.task_queue.task_done()
-                    msg = "%s Task went wrong and added it into failed queue: %s. Error message: %s" % (ERROR, task, e)
-                    logger.error("\r%s%s" % (msg, ' ' * (term_width - len(msg))))
-                else:
-                    self.task_queue.put(task)
-                    msg = "%s Task went wrong and added it into task queue: %s. Error message: %s" % (ERROR, task, e)
-                    logger.warning("\r%s%s" % (msg, ' ' * (term_width - len(msg))))
+                logger.error("%s Failed to read tasks from the source. Error message: %s" % (ERROR, e))
+                self.stopped.set()
+                return []
+            if len(items) < num_items:
+                self.stopped.set()
+            self.next_index += len(items)
+            if self.skip is None and self.dedup is None:
+                break
+            items = [item for item in items if not self._skipped(item)]
+            if items or self.stopped.is_set() or time.time() - start_time > self.max_read_time:
+                break
+            if self.window is not None:
+                num_items = min(num_items, self.head.value + self.window - self.next_index)
+                if num_items <= 0:
+                    break
+
+        if time.time() - start_time > self.max_read_time:
+            self.take_size = max(self.take_size // 2, 1)
+        else:
+            self.take_size = min(self.take_size * 2, max_items)
+        return items
+
+    def _skipped(self, item):
+        """Return if an (index, source item) pair is skipped or a duplicate."""
+        index, src_item = item
+        if self.skip is not None and self.skip(index):
+            return True
+        if self.dedup is None:
+            return False
+        try:
+            if self.dedup(src_item):
+                return False
+        except Exception as e:
+            logger.error("%s Failed to deduplicate %s, run it anyway. Error message: %s" % (ERROR, src_item, e))
+            return False
+        self.num_duplicates += 1
+        if self.window is not None:
+            self.duplicates.add(index)
+        return True
+
+    def stop(self):
+        """Stop reading the source and close the task queue."""
+        self.stopped.set()
+
+
+class Frontier(object):
+    """The frontier of a recursive crawl, which turns the follow-up sources
+    discovered by tasks into new tasks and puts them back into the task queue
+    of the same run, so that links are crawled level after level without a
+    barrier between the levels.
+    A task discovers follow-up sources by returning a Follow, or by being a
+    generator function, whose yielded items are the follow-up sources and whose
+    return value is the result of the task. They are put into the task queue
+    before the task is done, so workers keep running until the queue is empty
+    and no task is running (see BaseQueue.finished).
+    Follow-up tasks are not bounded by the maxsize of the task queue, since a
+    worker must not wait for room in the queue it is draining. They have no
+    index in the source, so they are not recorded in checkpoints, and their
+    results are yielded as they arrive by run_iter(ordered=True).
+    The frontier is pickled into worker processes: a SetFilter is copied into
+    each of them, while a BloomFilter is shared by all of them.
+
+    Attributes
+        :param task_cls: (subclass of Task or any class with a run method, function,
+            method) task class to instantiate tasks or task function/ task method.
+        :param queued: optional (bool) whether to record the time tasks are queued
+            at, for metrics. Default is False.
+        :param dedup: optional (Filter or None) the filter to skip follow-up sources
+            seen before, including the source items of the run. Without a filter,
+            pages linking to each other are crawled again and again unless
+            max_depth is set. Default is None.
+        :param fingerprint: optional (callable) function of a source item which
+            returns the key to deduplicate it by. Default is url_fingerprint.
+        :param max_depth: optional (int or None) the maximum depth of follow-up
+            tasks, where tasks of the source have depth 0. None means unlimited.
+            Default is None.
+    """
+
+    def __init__(self, task_cls, queued=False, dedup=None, fingerprint=url_fingerprint, max_depth=None):
+        self.task_cls = task_cls
+        self.queued = queued
+        self.dedup = dedup
+        self.fingerprint = fingerprint
+        self.max_depth = max_depth
+
+    def make_task(self, src_item, index=None, queued_at=None):
+        """Turn a source item into a task.
+        :param queued_at: optional (float or None) the time the source item was
+            queued at, if it is queued before it is turned into a task.
+        """
+        queued = self.queued
+        if queued and queued_at is not None:
+            queued = queued_at
+        return make_task(self.task_cls, src_item, index, queued)
+
+    def expand(self, task, res, task_queue):
+        """Put the follow-up tasks of a task into the task queue, if the task
+        returned a Follow or a generator.
+        :param task: (Task, dict or any class with a run method) the task.
+        :param res: the value returned by the task.
+        :param task_queue: (subclass of BaseQueue) the task queue of the run.
+        :rtype: the result of the task.
+        """
+        if isinstance(res, Follow):
+            sources, res = res.sources, res.result
+        elif inspect.isgenerator(res):
+            sources, res = self._drain(res)
+        else:
+            return res
+        depth = task_meta(task).get('depth', 0) + 1
+        if self.max_depth is not None and depth > self.max_depth:
+            return res
+        tasks = []
+        for src_item in sources:
+            if self.dedup is not None and not self.dedup.add(self.fingerprint(src_item)):
+                continue
+            follow_task = self.make_task(src_item)
+            task_meta(follow_task)['depth'] = depth
+            tasks.append(follow_task)
+        if tasks:
+            task_queue.put_many(tasks)
+        return res
+
+    @staticmethod
+    def _drain(generator):
+        """Run a generator task to the end.
+        :rtype (tuple): (the yielded items, the return value).
+        """
+        items = []
+        try:
+            while True:
+                items.append(next(generator))
+        except StopIteration as e:
+            return items, e.value
 
 
 class BaseManager(ABC):
@@ -247,20 +968,120 @@ class BaseManager(ABC):
             The manager will instantiate the results queue if has_result is True,
             otherwise the result queue is always None. Default is False.
 
-        :param num_workers: optional (int or None) number of workers, could be None 
-            or int values:
-                None: input the number of workers in the command line.
+        :param num_workers: optional (int, 'auto' or None) number of workers, could be None,
+            'auto' or int values:
+                None: input the number of workers in the command line, or 'auto'
+                    if the standard input is not a terminal.
+                'auto': scale the number of workers between min_workers and
+                    max_workers by an Autoscaler, according to the throughput,
+                    error rate and latency of tasks.
                 int: could be any positive integer. but when using ProcessWorker 
                     as worker_cls, the number of workers being equals to or less than 
                     the number of cpu cores is recommended.
             Default is None.
 
+        :param min_workers: optional (int) the minimum number of workers when
+            num_workers is 'auto'. Default is 1.
+
+        :param max_workers: optional (int or None) the maximum number of workers
+            when num_workers is 'auto'. Default is max_auto_workers of the manager.
+
         :param add_failed: optional (bool) whether add failed tasks back into the
             task queue.
-            True: Put the failed tasks back into the task queue.
-            False: Put the failed tasks into the failed queue.
+            True: Put the failed tasks back into the task queue to retry them
+                with the default RetryPolicy.
+            False: Put the failed tasks into the failed queue at once.
+            Tasks which are not retried any more are listed after the run and
+            kept in manager.failed_tasks.
+
+        :param retry: optional (RetryPolicy or None) the retry policy of failed
+            tasks, overriding add_failed. Default is None.
+
+        :param checkpoint: optional (str, Checkpoint or None) the directory of a
+            checkpoint, or a Checkpoint, recording the succeeded tasks so that a
+            run could be resumed after a crash with run(resume=True).
+            Default is None.
+
+        :param sink: optional (Sink or None) the sink to write results into, e.g. a
+            JSONLSink, instead of keeping them in memory. Results are written by a
+            writer thread, or by one in each worker process into its own shard of
+            the sink. run returns no results then. Default is None.
+
+        :param session: optional (bool or SessionPool) whether to give each worker
+            a pooled requests.Session, which is passed to task functions having a
+            session argument and set as the session attribute of task instances.
+            True: use a SessionPool with the default options.
+            SessionPool: use the given pool, e.g. to limit connections per host.
+            Default is False.
+
+        :param shared_memory: optional (bool or SharedMemoryTransport) whether worker
+            processes pass large bytes-like results, e.g. page bodies or NumPy
+            arrays, through shared memory blocks instead of pickling them through
+            the results queue. The results are mapped back without copying, as
+            memoryviews or NumPy arrays.
+            True: use a SharedMemoryTransport with the default options.
+            SharedMemoryTransport: use the given transport, e.g. to set min_size.
+            Default is False.
+
+        :param metrics: optional (bool, str or MetricsExporter) whether to record the
+            run time, queue wait time and errors of tasks and the busy and idle time of
+            workers, which are merged across threads and processes by manager.stats().
+            True: record the metrics.
+            str: also write them into the file every 10 seconds, as a Prometheus
+                textfile if the path ends with .prom, otherwise as JSON.
+            MetricsExporter: also write them by the given exporter.
+            Default is False.
+
+        :param trace: optional (bool, str or Tracer) whether to record the timeline of
+            tasks run by every worker, written as a Chrome trace_event JSON file after
+            the run, see Tracer.
+            True: write the trace into qspider.trace.json.
+            str: write the trace into the given path.
+            Tracer: use the given tracer, e.g. to set max_events.
+            Default is False.
+
+        :param errors: optional (bool or ErrorAggregator) whether to report errors of
+            tasks to an ErrorAggregator, which logs a summary of errors grouped by
+            exception type and message every few seconds, instead of logging every
+            error from the workers.
+            True: use an ErrorAggregator with the default options.
+            False: log every error from the workers.
+            ErrorAggregator: use the given aggregator, e.g. to write every error
+                into a failure file.
+            Default is True.
+
+        :param queue_size: optional (int) the maximum number of pending tasks
+            in the task queue. Sources are pulled lazily into the task queue, so
+            the memory usage is bounded by queue_size instead of the size of the
+            source. 0 means unbounded. Default is 10000.
+
+        :param dedup: optional (bool, str or Filter) whether to skip source items
+            whose fingerprint was seen before, when they are read into the task queue.
+            Retried tasks and rerun_failed are not deduplicated.
+            True: keep the exact fingerprints in a SetFilter.
+            str: keep them in a SetFilter persisted in the given file between runs.
+            Filter: use the given filter, e.g. a BloomFilter for hundreds of
+                millions of sources in bounded memory.
+            Default is False.
+
+        :param fingerprint: optional (callable) function of a source item which
+            returns the key to deduplicate it by. Default is url_fingerprint, the
+            canonical url of str sources or the source item itself.
+
+        :param max_depth: optional (int or None) the maximum depth of the follow-up
+            tasks discovered by tasks which return a Follow or are generators, where
+            tasks of the source have depth 0. Follow-up tasks are run by the same
+            run until no task is left, see Frontier. Set dedup as well, so that
+            pages are not crawled again. None means unlimited. Default is None.
     """
 
+    # Whether each worker writes results into its own shard of the sink.
+    shard_sink = False
+    # Whether workers are processes.
+    multiprocess = False
+    # The default maximum number of workers when num_workers is 'auto'.
+    max_auto_workers = 256
+
     def __init__(self, source,
                  task_cls,
                  worker_cls,
@@ -268,78 +1089,422 @@ class BaseManager(ABC):
                  res_queue_cls,
                  has_result=False,
                  num_workers=None,
-                 add_failed=True):
+                 add_failed=True,
+                 min_workers=1,
+                 max_workers=None,
+                 retry=None,
+                 checkpoint=None,
+                 sink=None,
+                 session=False,
+                 shared_memory=False,
+                 metrics=False,
+                 trace=False,
+                 errors=True,
+                 queue_size=10000,
+                 dedup=False,
+                 fingerprint=url_fingerprint,
+                 max_depth=None):
 
         self.source = source
         self.task_cls = task_cls
+        self.is_caller = inspect.isfunction(self.task_cls) or inspect.ismethod(self.task_cls)
         self.worker_cls = worker_cls
         self.task_queue_cls = task_queue_cls
         self.res_queue_cls = res_queue_cls
         self.has_result = has_result
         self.num_workers = num_workers
-        if inspect.isfunction(self.task_cls) or inspect.ismethod(self.task_cls):
-            self.tasks = [{'caller': self.task_cls, 'source': src_item} for src_item in self.source]
+        self.min_workers = min_workers
+        self.max_workers = max_workers or self.max_auto_workers
+        self.autoscaler = None
+        self.queue_size = queue_size
+        self.task_queue = task_queue_cls(maxsize=self.queue_size, streaming=True)
+        self.feeder = TaskFeeder(self.task_queue, self.source, self._make_task)
+        self.sink = sink
+        self.writer = None
+        self.res_queue = res_queue_cls() if has_result and sink is None else None
+        self.failed_queue = task_queue_cls()
+        self.failed_tasks = []
+        if retry is None:
+            retry = RetryPolicy() if add_failed else RetryPolicy(max_attempts=1)
+        self.retry = retry
+        self.checkpoint = Checkpoint(checkpoint) if isinstance(checkpoint, str) else checkpoint
+        self.session_pool = SessionPool() if session is True else (session or None)
+        self.transport = SharedMemoryTransport() if shared_memory is True else (shared_memory or None)
+        self.metrics = Metrics() if metrics else None
+        self.profile_dir = None
+        self.profile_stats = None
+        self.tracer = Tracer() if trace is True else (Tracer(trace) if isinstance(trace, str) else (trace or None))
+        self.errors = ErrorAggregator() if errors is True else (errors or None)
+        self.exporter = MetricsExporter(metrics) if isinstance(metrics, str) else (
+            metrics if isinstance(metrics, MetricsExporter) else None)
+        # An empty filter is falsy, so it is checked by its type.
+        self.dedup = SetFilter() if dedup is True else (SetFilter(dedup) if isinstance(dedup, str) else (
+            dedup if isinstance(dedup, Filter) else None))
+        self.fingerprint = fingerprint
+        self.num_duplicates = 0
+        self.frontier = Frontier(task_cls, queued=self.metrics is not None, dedup=self.dedup,
+                                 fingerprint=fingerprint, max_depth=max_depth)
+
+    def run(self, silent=False, resume=False, profile=False, profile_top=20):
+        """Run tasks in the task queue using multi-workers.
+        Tasks failed after all the retries are listed after the run, and could
+        be run again by rerun_failed.
+
+        :param silent: optional (bool) whether to hide the progress bar.
+        :param resume: optional (bool) whether to skip the tasks which succeeded
+            in the previous runs recorded in the checkpoint. Otherwise the
+            checkpoint starts over. Default is False.
+        :param profile: optional (bool or str) whether to profile every worker thread
+            or process with cProfile, and merge their stats into one pstats file,
+            which is the given path or qspider.prof. The hot functions are printed
+            after the run, and the merged stats are kept in manager.profile_stats.
+            Default is False.
+        :param profile_top: optional (int) the number of hot functions to print.
+            Default is 20.
+        :rtype (list): results returned by tasks.
+        """
+        if profile:
+            self.profile_dir = make_profile_dir()
+        try:
+            results = list(self._iter_results(silent=silent, resume=resume))
+        finally:
+            if profile:
+                self._merge_profiles(profile if isinstance(profile, str) else 'qspider.prof', profile_top)
+        if self.failed_tasks:
+            self.report_failed()
+        return results
+
+    def rerun_failed(self, silent=False):
+        """Run the tasks in manager.failed_tasks again, with the retry policy
+        starting over.
+        :rtype (list): results returned by the tasks.
+        """
+        tasks, self.failed_tasks = self.failed_tasks, []
+        for task in tasks:
+            meta = task_meta(task)
+            meta.pop('attempts', None)
+            meta.pop('error', None)
+        self.task_queue = self.task_queue_cls(tasks)
+        return self.run(silent=silent, resume=self.checkpoint is not None)
+
+    def _merge_profiles(self, path, top):
+        """Merge the profiles of the workers into a pstats file and print the hot functions."""
+        profile_dir, self.profile_dir = self.profile_dir, None
+        self.profile_stats, summary = merge_profiles(profile_dir, path, top)
+        if self.profile_stats is None:
+            print("%s No worker was profiled." % WARN)
+            return
+        print("%s Profile of the workers is written into %s, the top %d functions by own time:" % (INFO, path, top))
+        print(summary)
+
+    def report_failed(self, max_lines=20):
+        """Print the tasks failed after all the retries and their errors.
+        :param max_lines: optional (int) the maximum number of tasks to print.
+        """
+        print("%s %d tasks failed after retries, see manager.failed_tasks:" % (WARN, len(self.failed_tasks)))
+        for task in self.failed_tasks[:max_lines]:
+            meta = task_meta(task)
+            name = "Task{source=%s}" % task['source'] if type(task) == dict else task
+            print("    %s, attempts: %d, %s" % (name, meta.get('attempts', 0), meta.get('error')))
+        if len(self.failed_tasks) > max_lines:
+            print("    ... and %d more." % (len(self.failed_tasks) - max_lines))
+
+    def run_iter(self, ordered=False, silent=False, window=None, resume=False):
+        """Run tasks using multi-workers and yield results as soon as workers
+        produce them, instead of collecting them after all the workers finish.
+        Tasks failed after all the retries are collected in manager.failed_tasks.
+
+        :param ordered: optional (bool) whether to yield results in the order of
+            the source. Results that arrive early are kept in a reorder buffer.
+            Default is False.
+        :param silent: optional (bool) whether to hide the progress bar.
+        :param window: optional (int or None) in ordered mode, the maximum number
+            of source items read ahead of the first result not yielded yet, which
+            bounds the reorder buffer. Default is queue_size (or 10000 if
+            queue_size is 0).
+        :param resume: optional (bool) whether to skip the tasks which succeeded
+            in the previous runs recorded in the checkpoint. Default is False.
+        :rtype (generator): results returned by tasks.
+        """
+        if not self.has_result:
+            raise ValueError("run_iter needs a manager with has_result=True.")
+        if self.sink is not None:
+            raise ValueError("run_iter yields no results when they are written into a sink.")
+        return self._iter_results(silent=silent, ordered=ordered, window=window, resume=resume)
+
+    def _iter_results(self, silent=False, ordered=False, window=None, resume=False):
+        """Run tasks and yield results in order of arrival or of the source."""
+        if resume and self.checkpoint is None:
+            raise ValueError("resume needs a manager with a checkpoint.")
+        if self.task_queue.closed.is_set():
+            msg = "%s %d tasks in total." % (INFO, self.task_queue.tot_size.value)
+        elif hasattr(self.source, '__len__'):
+            msg = "%s %d tasks in total." % (INFO, len(self.source))
         else:
-            self.tasks = [self.task_cls(src_item) for src_item in self.source]
-        self.task_queue = task_queue_cls(self.tasks)
-        self.res_queue = res_queue_cls() if has_result else None
-        self.failed_queue = task_queue_cls() if not add_failed else None
-
-    def run(self, silent=False):
-        """Run tasks in the task queue using multi-workers."""
-        msg = "%s %d tasks in total." % (INFO, len(self.tasks))
+            msg = "%s Reading tasks from the source lazily." % INFO
         print(msg)
+        skip = None
+        if resume:
+            print("%s %d tasks succeeded before, skip them." % (INFO, self.checkpoint.load()))
+            skip = self.checkpoint.is_done
+        elif self.checkpoint is not None:
+            self.checkpoint.clear()
+        if self.sink is not None:
+            # Keep the results written before resuming.
+            self.sink.append = self.sink.append or resume
+            if not self.shard_sink:
+                self.writer = SinkWriter(self.sink, checkpoint=self.checkpoint)
+                self.writer.start()
         self.num_workers = self.num_workers or self._get_num_workers()
 
+        head = SharedCounter(0, 'thread')
+        feeder, self.feeder = self.feeder, None
+        duplicates = None
+        if feeder is not None:
+            feeder.skip = skip
+            if self.dedup is not None:
+                feeder.dedup = self.is_new
+                duplicates = feeder.duplicates
+        if ordered and feeder is not None:
+            feeder.window = window or self.queue_size or 10000
+            feeder.head = head
+
         timer = None
         if not silent:
             timer = Timer(self.task_queue, fps=.1)
             timer.start()
 
-        workers = []
-        for i in range(self.num_workers):
-            worker = self.worker_cls(self.task_queue, self.res_queue, self.failed_queue)
-            worker.start()
-            workers.append(worker)
-
-        if not silent:
-            timer.join()
-        for worker in workers:
-            worker.join()
-
-        if self.failed_queue and self.failed_queue.qsize.value > 0:
-            flag = ''
-            while flag not in ['y', 'Y', 'n', 'N']:
-                flag = input("%s %d tasks failed, re-run failed tasks? (y/n): " % (WARN, self.failed_queue.qsize.value))
-
-            if flag in ['y', 'Y']:
-                self.task_queue = self.failed_queue
-                self.task_queue.tot_size = self.task_queue.qsize
-                self.num_workers = self._get_num_workers()
-                self.failed_queue = self.task_queue_cls()
-                return self.run()
-
-        results = []
-        if self.has_result:
-            while not self.res_queue.empty():
-                results.append(self.res_queue.get())
-        return results
+        self.autoscaler = None
+        if self.tracer is not None:
+            self.tracer.begin()
+        if self.errors is not None:
+            self.errors.start(shared=self.multiprocess)
+        workers = self._start_workers()
+        autoscaler = self.autoscaler
+        if self.exporter is not None:
+            self.exporter.start(self)
+        if feeder is not None:
+            self.task_queue.feed_from(feeder)
+
+        writer = self.writer
+        try:
+            try:
+                if self.res_queue is not None:
+                    reorder = {}
+                    while True:
+                        try:
+                            results = self.res_queue.get(timeout=self.task_queue.poll_interval)
+                        except Empty:
+                            if not any(worker.is_alive() for worker in workers) and self.res_queue.empty():
+                                break
+                            results = []
+                        for index, ok, res in results:
+                            if self.transport is not None:
+                                res = self.transport.unpack(res)
+                            if not ordered or index is None:
+                                if ok:
+                                    yield res
+                                continue
+                            reorder[index] = (ok, res)
+                        # Tasks dropped by the task queue, e.g. past their deadline, have no results,
+                        # so they are failed here, or results in order would wait for them forever.
+                        for task in self.task_queue.take_dropped():
+                            self.failed_tasks.append(task)
+                            index = task_meta(task).get('index')
+                            if ordered and index is not None:
+                                reorder[index] = (False, None)
+                        while ordered:
+                            if head.value in reorder:
+                                ok, res = reorder.pop(head.value)
+                                head.increment(1)
+                                if ok:
+                                    yield res
+                            elif skip is not None and skip(head.value):
+                                # Succeeded before resuming, the result is not kept.
+                                head.increment(1)
+                            elif duplicates and head.value in duplicates:
+                                duplicates.discard(head.value)
+                                head.increment(1)
+                            else:
+                                break
+                    for index in sorted(reorder):
+                        ok, res = reorder[index]
+                        if ok:
+                            yield res
+            except BaseException:
+                # Stop reading the source and running tasks if the caller stops consuming results.
+                if feeder is not None:
+                    feeder.stop()
+                for worker in workers:
+                    worker.stop()
+                if autoscaler is not None:
+                    autoscaler.stop()
+                if timer is not None:
+                    timer.stop()
+                    timer.join()
+                if self.exporter is not None:
+                    self.exporter.stop()
+                if self.tracer is not None:
+                    self.tracer.end()
+                if self.errors is not None:
+                    self.errors.stop()
+                self._drain_queues(workers)
+                raise
+
+            for worker in workers:
+                worker.join()
+            if autoscaler is not None:
+                autoscaler.stop()
+                for worker in workers:
+                    worker.join()
+            if timer is not None:
+                timer.stop()
+                timer.join()
+            if self.errors is not None:
+                self.errors.stop()
+            while not self.failed_queue.empty():
+                self.failed_tasks.extend(self.failed_queue.get_chunk())
+            self.failed_tasks.extend(self.task_queue.take_dropped() + self.failed_queue.take_dropped())
+            if feeder is not None and self.dedup is not None:
+                self.num_duplicates += feeder.num_duplicates
+                if feeder.num_duplicates:
+                    print("%s %d duplicate tasks were skipped." % (INFO, feeder.num_duplicates))
+                self.dedup.save()
+            if self.exporter is not None:
+                self.exporter.stop()
+            if self.tracer is not None:
+                num_tasks = self.tracer.end()
+                print("%s Timeline of %d tasks is written into %s, open it in chrome://tracing or ui.perfetto.dev." % (
+                    INFO, num_tasks, self.tracer.path))
+        finally:
+            # The writer records the checkpoint, so it is closed first.
+            self.writer = None
+            if writer is not None:
+                writer.close()
+            if self.session_pool is not None:
+                self.session_pool.close()
+            if self.checkpoint is not None:
+                self.checkpoint.close()
+            if self.transport is not None:
+                self._discard_results(workers)
+                self.transport.close()
+        if writer is not None and writer.error is not None:
+            raise writer.error
+
+    def _discard_results(self, workers):
+        """Throw away the results left in the results queue, e.g. when the caller
+        stops consuming results, until the workers quit after the tasks they are
+        running, and free the shared memory blocks of them."""
+        if self.res_queue is None:
+            return
+        while any(worker.is_alive() for worker in workers) or not self.res_queue.empty():
+            try:
+                results = self.res_queue.get(timeout=self.task_queue.poll_interval)
+            except Empty:
+                continue
+            if self.transport is not None:
+                for index, ok, res in results:
+                    self.transport.discard(res)
+
+    def _drain_queues(self, workers):
+        """Read out the queues shared with worker processes after the run is
+        aborted, until the workers quit after the tasks they are running, so that
+        neither they nor this process wait at exit to flush the tasks and results
+        they put into the queues. The failed tasks are kept in failed_tasks."""
+        if not self.multiprocess:
+            return
+        while True:
+            alive = any(worker.is_alive() for worker in workers)
+            self.task_queue.drain()
+            self.failed_tasks.extend(self.failed_queue.drain())
+            self._discard_results(())
+            if not alive:
+                return
+            time.sleep(self.task_queue.poll_interval)
+
+    def stats(self):
+        """Return a snapshot of the metrics of the workers (if the manager records
+        metrics, see the metrics argument) and the counters of the task queue.
+        Run time and queue wait time are summarized by count, mean, p50, p90, p99
+        and max in seconds.
+        :rtype (dict): the stats.
+        """
+        stats = self.metrics.stats() if self.metrics is not None else {}
+        stats['queue_size'] = self.task_queue.qsize.value
+        stats['tasks_queued'] = self.task_queue.tot_size.value
+        stats['tasks_done'] = self.task_queue.num_task_done.value
+        stats['tasks_duplicate'] = self.num_duplicates
+        return stats
+
+    def is_new(self, src_item):
+        """Add the fingerprint of a source item into the dedup filter.
+        :param src_item: the source item.
+        :rtype (bool): True if the source item was not seen before, or the
+            manager does not deduplicate source items.
+        """
+        if self.dedup is None:
+            return True
+        return self.dedup.add(self.fingerprint(src_item))
 
     def crawl(self):
         """[Deprecated] Use run method instead"""
         return self.run()
 
     def test(self, index=0):
-        """Test if the task.run method could run without any exceptions."""
-        task = self.tasks[index]
-        if type(task) == dict and 'caller' in task and 'source' in task:
-            return task['caller'](task['source'])
-        return task.run()
+        """Test if the task.run method could run without any exceptions.
+        Note that testing an iterator source consumes its first index + 1 items.
+        """
+        if hasattr(self.source, '__getitem__'):
+            src_item = self.source[index]
+        else:
+            src_item = next(itertools.islice(self.source, index, None))
+        task = self._make_task(src_item)
+        if self.session_pool is None:
+            return call_task(task)
+        session = self.session_pool.create()
+        try:
+            return call_task(task, session)
+        finally:
+            self.session_pool.release(session)
+
+    def _start_workers(self):
+        """Start num_workers workers, or an Autoscaler if num_workers is 'auto'.
+        :rtype (list): the started workers.
+        """
+        if self.num_workers == 'auto':
+            self.autoscaler = Autoscaler(self, self.min_workers, self.max_workers)
+            return self.autoscaler.start_workers()
+        workers = []
+        for i in range(self.num_workers):
+            worker = self._make_worker()
+            worker.start()
+            workers.append(worker)
+        return workers
+
+    def _make_worker(self):
+        """Return a new worker, which is not started yet."""
+        return self.worker_cls(self.task_queue, self.writer or self.res_queue, self.failed_queue,
+                               session_pool=self.session_pool, retry=self.retry,
+                               checkpoint=self.checkpoint,
+                               sink=self.sink if self.shard_sink else None,
+                               transport=self.transport if self.sink is None else None,
+                               metrics=self.metrics, profile_dir=self.profile_dir, tracer=self.tracer,
+                               errors=self.errors, frontier=self.frontier)
+
+    def _make_task(self, src_item, index=None, queued_at=None):
+        """Turn a source item into a task."""
+        return self.frontier.make_task(src_item, index, queued_at)
 
     def _get_num_workers(self):
-        """Input the number of workers in the command line."""
+        """Input the number of workers in the command line, or return 'auto'
+        if the standard input is not a terminal, e.g. in cron jobs."""
+        if not sys.stdin or not sys.stdin.isatty():
+            print("%s Scale the number of workers automatically." % INFO)
+            return 'auto'
         print(INPUT, end="")
-        num_workers_str = input(" Number of workers: ")
+        num_workers_str = input(" Number of workers ('auto' to scale automatically): ")
+        if num_workers_str.strip() == 'auto':
+            return 'auto'
         try:
             num_workers = int(num_workers_str)
             return num_workers
@@ -357,16 +1522,181 @@ class BaseManager(ABC):
 # Multi-threading
 class ThreadTaskQueue(BaseQueue):
     """A thread task queue contains tasks.
+    Tasks are kept in deques, whose append and popleft are atomic, so that
+    getting or putting a task takes no lock unless workers are waiting for new
+    tasks. Counters are sharded per thread and summed up when read.
+    A streaming queue is refilled by the workers themselves, which read source
+    items from the TaskFeeder in batches and turn them into tasks one by one
+    after getting them, so that reading the source never waits for the GIL
+    behind hundreds of workers.
 
     Attributes
         :param tasks: optional (iterable) the initial tasks, could be any
             iterable types. Elements the tasks should be instances of the
-            subclass of Task class, which has a run method."""
+            subclass of Task class, which has a run method.
+        :param maxsize: optional (int) the maximum number of pending tasks a
+            TaskFeeder keeps in the queue. 0 means unbounded. Default is 0.
+        :param streaming: optional (bool) whether tasks are fed lazily by a
+            TaskFeeder. Default is False."""
 
-    def __init__(self, tasks=None):
+    # Waiting workers are notified on put and close, the timeout is only a fallback.
+    wait_interval = 0.5
+
+    def __init__(self, tasks=None, maxsize=0, streaming=False):
         if tasks is None:
             tasks = []
-        BaseQueue.__init__(self, 'thread', Queue, td.Lock, tasks)
+        self.not_empty = td.Condition(td.Lock())
+        self.num_waiters = 0
+        # Source items read from the feeder, as (index, source item, time queued at).
+        self.items = deque()
+        self.feeder = None
+        self.feeder_blocked = False
+        self.refill_lock = td.Lock()
+        BaseQueue.__init__(self, 'thread', deque, td.Lock, td.Event, tasks, maxsize, streaming)
+        self.qsize = _Length(self.queue, self.items, self.delayed)
+        # Workers fill the queue up to maxsize once fewer than low_watermark
+        # tasks are left.
+        self.low_watermark = max(TaskFeeder.batch_size, self.maxsize // 4 if self.maxsize else 4096)
+
+    def put(self, task):
+        """Put a new Task instance into the queue.
+        :param task: (Task or its subclass) a Task instance
+        """
+        self.tot_size.increment(1)
+        self.requeue(task)
+
+    def put_many(self, tasks):
+        """Put a list of new Task instances into the queue.
+        :param tasks: (list) Task instances
+        """
+        self.tot_size.increment(len(tasks))
+        self.queue.extend(tasks)
+        self._notify(len(tasks))
+
+    def requeue(self, task, delay=0):
+        """Put a Task instance got from this queue back into the queue.
+        :param task: (Task or its subclass) a Task instance
+        :param delay: optional (float) seconds to wait before the task could be
+            got again. Default is 0.
+        """
+        if delay > 0:
+            with self.lock:
+                self._push_delayed(task, delay)
+        else:
+            self.queue.append(task)
+        self._notify(1)
+
+    def get(self):
+        """Get a Task instance out of the queue.
+        If the queue is empty but still open, wait for new tasks.
+        :rtype (Task or its subclass or None): None if there are no tasks left.
+        """
+        while True:
+            task = self.get_nowait()
+            if task is not None:
+                return task
+            if self.finished():
+                return None
+            with self.not_empty:
+                self.num_waiters += 1
+                timeout = self._wait_time()
+                if timeout:
+                    self.not_empty.wait(timeout)
+                self.num_waiters -= 1
+
+    def get_nowait(self):
+        """Get a Task instance out of the queue without waiting.
+        :rtype (Task or its subclass or None): None if there are no tasks for now.
+        """
+        if self._next_due() <= time.time():
+            with self.lock:
+                due = self._pop_due(1)
+            if due:
+                return due[0]
+        try:
+            return self.queue.popleft()
+        except IndexError:
+            pass
+        try:
+            index, src_item, queued_at = self.items.popleft()
+        except IndexError:
+            if self.feeder is None:
+                return None
+            self._refill()
+            try:
+                index, src_item, queued_at = self.items.popleft()
+            except IndexError:
+                return None
+        if self.feeder is not None and len(self.items) < self.low_watermark:
+            self._refill()
+        return self.make_task(src_item, index, queued_at)
+
+    def task_done(self, n=1):
+        """Increase the num_task_done if task_done is called, and wake up the
+        waiting workers once the last task is done, so that they quit.
+        :param n: optional (int) the number of tasks done. Default is 1.
+        """
+        self.num_task_done.increment(n)
+        if self.num_waiters and self.finished():
+            with self.not_empty:
+                self.not_empty.notify_all()
+
+    def feed_from(self, feeder):
+        """Let the workers read source items from the feeder when they run low
+        on tasks, instead of starting the feeder thread.
+        :param feeder: (TaskFeeder) the feeder of this streaming queue.
+        """
+        self.make_task = feeder.make_task
+        self.feeder = feeder
+        self._notify(self.num_waiters)
+
+    def close(self):
+        """Mark that no new tasks will be fed into the queue."""
+        self.closed.set()
+        with self.not_empty:
+            self.not_empty.notify_all()
+
+    def _refill(self):
+        """Read source items from the feeder, unless another worker is reading."""
+        if not self.refill_lock.acquire(blocking=False):
+            return
+        try:
+            feeder = self.feeder
+            if feeder is None:
+                return
+            items = feeder.take(self.maxsize or self.low_watermark)
+            self.feeder_blocked = not items
+            if items:
+                self.tot_size.increment(len(items))
+                # Tasks are made when they are got, the wait time counts from now.
+                now = time.time()
+                self.items.extend((index, src_item, now) for index, src_item in items)
+                self._notify(self.qsize.value)
+            if feeder.stopped.is_set():
+                self.feeder = None
+                self.close()
+        finally:
+            self.refill_lock.release()
+
+    def _wait_time(self):
+        """Return how long a worker waits for new tasks, 0 if there are tasks."""
+        if self.queue or self.items:
+            return 0
+        if self.closed.is_set():
+            timeout = self.wait_interval
+        else:
+            # Poll the feeder if it is waiting for results to be consumed.
+            timeout = self.poll_interval if self.feeder_blocked else self.wait_interval
+        timeout = min(timeout, self._next_due() - time.time())
+        return max(timeout, 0.001)
+
+    def _notify(self, n):
+        if self.num_waiters:
+            with self.not_empty:
+                self.not_empty.notify(n)
+
+    def _make_counter(self):
+        return ShardedCounter()
 
 
 class ThreadWorker(Thread, BaseWorker):
@@ -376,19 +1706,32 @@ class ThreadWorker(Thread, BaseWorker):
     put the results of the task (if there are results returned by task) into the 
     results queue. 
     If there are exceptions exist when the worker run the task, the worker will
-    put the task back into the task queue if failed_queue argument is None, else
-    it will put the task into the failed queue.
+    put the task back into the task queue to retry it after a backoff as long as
+    the retry policy allows, else it will put the task into the failed queue.
     
     Attributes
         :param task_queue: optional (subclass of BaseQueue) task queue contains task instances.
         :param res_queue: optional (Queue or its subclass) results queue contains the results 
             returned by the task.run method.
         :param failed_queue: (subclass of BaseQueue) failed queue contains failed task instances.
+        :param session_pool: optional (SessionPool) the pool to get the HTTP session of the worker from.
+        :param retry: optional (RetryPolicy) the retry policy of failed tasks.
+        :param checkpoint: optional (Checkpoint) the checkpoint to record succeeded tasks in.
+        :param sink: optional (Sink) the sink to write results into a shard of.
+        :param transport: optional (SharedMemoryTransport) the transport of large results to the manager.
+        :param metrics: optional (Metrics) the metrics of the manager to record the metrics of the worker in.
+        :param profile_dir: optional (str) the directory to dump the cProfile profile of the worker into.
+        :param tracer: optional (Tracer) the tracer to record the timeline of tasks into.
+        :param errors: optional (ErrorAggregator) the aggregator to report errors of tasks to.
+        :param frontier: optional (Frontier) the frontier to put follow-up tasks into the task queue by.
     """
 
-    def __init__(self, task_queue, res_queue=None, failed_queue=None):
+    def __init__(self, task_queue, res_queue=None, failed_queue=None, session_pool=None, retry=None,
+                 checkpoint=None, sink=None, transport=None, metrics=None,
+                 profile_dir=None, tracer=None, errors=None, frontier=None):
         Thread.__init__(self)
-        BaseWorker.__init__(self, task_queue, res_queue, failed_queue)
+        BaseWorker.__init__(self, task_queue, res_queue, failed_queue, session_pool, retry, checkpoint, sink,
+                            transport, metrics, profile_dir, tracer, errors, frontier)
 
     def run(self):
         self._run()
@@ -419,42 +1762,206 @@ class ThreadManager(BaseManager):
 
         :param add_failed: optional (bool) whether add failed tasks back into the
             task queue.
-            True: Put the failed tasks back into the task queue.
-            False: Put the failed tasks into the failed queue.
+            True: Put the failed tasks back into the task queue to retry them
+                with the default RetryPolicy.
+            False: Put the failed tasks into the failed queue at once.
+
+        :param task_queue_cls: optional (ThreadTaskQueue or its subclass) task queue
+            class, e.g. a PoliteTaskQueue with its options bound by functools.partial
+            to rate limit tasks per host. Default is ThreadTaskQueue.
+
+        Other keyword arguments (e.g. retry, queue_size) are passed to BaseManager.
     """
 
-    def __init__(self, source, task_cls, has_result=False, num_workers=None, add_failed=True):
+    def __init__(self, source, task_cls, has_result=False, num_workers=None, add_failed=True,
+                 task_queue_cls=ThreadTaskQueue, **kwargs):
         BaseManager.__init__(self, source,
                              task_cls,
                              ThreadWorker,
-                             ThreadTaskQueue,
+                             task_queue_cls,
                              Queue,
                              has_result,
                              num_workers,
-                             add_failed)
+                             add_failed,
+                             **kwargs)
 
 
 class QSpider(ThreadManager):
-    def __init__(self, source, task_cls, has_result=False, num_workers=None, add_failed=True):
-        ThreadManager.__init__(self, source, task_cls, has_result, num_workers, add_failed)
+    def __init__(self, source, task_cls, has_result=False, num_workers=None, add_failed=True, **kwargs):
+        ThreadManager.__init__(self, source, task_cls, has_result, num_workers, add_failed, **kwargs)
 
 
 # Multi-processing
 class ProcessTaskQueue(BaseQueue):
     """A process task queue contains tasks.
+    Tasks are passed between processes in chunks, so that getting, pickling and
+    acknowledging tasks costs one round trip per chunk instead of per task.
 
     Attributes
         :param tasks: optional (iterable) the initial tasks, could be any
             iterable types. Elements the tasks should be instances of the
-            subclass of Task class, which has a run method."""
-
-    def __init__(self, tasks=None):
+            subclass of Task class, which has a run method.
+        :param maxsize: optional (int) the maximum number of pending tasks a
+            TaskFeeder keeps in the queue. 0 means unbounded. Default is 0.
+        :param streaming: optional (bool) whether tasks are fed lazily by a
+            TaskFeeder. Default is False.
+        :param chunksize: optional (int or 'auto') the number of tasks in a chunk.
+            'auto' sizes chunks so that running a chunk takes about
+            target_chunk_time, based on the measured time of tasks. Default is 1."""
+
+    target_chunk_time = 0.01
+    max_chunksize = 1000
+
+    def __init__(self, tasks=None, maxsize=0, streaming=False, chunksize=1):
         if tasks is None:
             tasks = []
-        # BaseQueue.__init__(self, 'process', mp.Manager().Queue, mp.Lock, tasks)
-        # BaseQueue.__init__(self, 'process', mp.Manager().Queue, mp.Manager().Lock, tasks)
-        BaseQueue.__init__(self, 'process', mp.Queue, mp.Manager().Lock,
-                           tasks)  # Likely this is faster at putting tasks into task queue.
+        self.chunksize = chunksize
+        # Seconds spent on tasks and the number of them, for chunksize='auto'.
+        self.task_time = mp.Array('d', 2)
+        # Tasks got by get but not returned yet, local to each process.
+        self.buffer = deque()
+        # Guards the buffer and the delayed tasks shared by the threads of a process.
+        self.local_lock = td.Lock()
+        # A plain process lock, so that no Manager server process is started per queue.
+        BaseQueue.__init__(self, 'process', mp.Queue, mp.Lock, mp.Event, tasks, maxsize, streaming)
+
+    def put(self, task):
+        """Put a new Task instance into the queue.
+        :param task: (Task or its subclass) a Task instance
+        """
+        self.put_many([task])
+
+    def put_many(self, tasks):
+        """Put a list of new Task instances into the queue in chunks.
+        :param tasks: (list) Task instances
+        """
+        self.qsize.increment(len(tasks))
+        self.tot_size.increment(len(tasks))
+        chunk_size = self.chunk_size()
+        for i in range(0, len(tasks), chunk_size):
+            self.queue.put(tasks[i:i + chunk_size])
+
+    def requeue(self, task, delay=0):
+        """Put a Task instance got from this queue back into the queue.
+        A delayed task is kept by the process which got it, and got again by
+        the same process once it is due.
+        :param task: (Task or its subclass) a Task instance
+        :param delay: optional (float) seconds to wait before the task could be
+            got again. Default is 0.
+        """
+        self.qsize.increment(1)
+        if delay > 0:
+            with self.local_lock:
+                self._push_delayed(task, delay)
+        else:
+            self.queue.put([task])
+
+    def get(self):
+        """Get a Task instance out of the queue.
+        If the queue is empty but still open, wait for new tasks.
+        :rtype (Task or its subclass or None): None if there are no tasks left.
+        """
+        with self.local_lock:
+            if self.buffer:
+                return self.buffer.popleft()
+        chunk = self.get_chunk()
+        if not chunk:
+            return None
+        with self.local_lock:
+            self.buffer.extend(chunk[1:])
+        return chunk[0]
+
+    def get_chunk(self):
+        """Get a chunk of Task instances out of the queue.
+        :rtype (list): Task instances, empty if there are no tasks left.
+        """
+        with self.local_lock:
+            if self.buffer:
+                chunk = list(self.buffer)
+                self.buffer.clear()
+                return chunk
+        while True:
+            if self.delayed:
+                with self.local_lock:
+                    chunk = self._pop_due()
+                if chunk:
+                    self.qsize.increment(-len(chunk))
+                    return chunk
+            with self.local_lock:
+                timeout = self._poll_time()
+            try:
+                chunk = self._take(timeout)
+            except Empty:
+                if self.finished():
+                    return []
+                continue
+            self.qsize.increment(-len(chunk))
+            return chunk
+
+    def _take(self, timeout):
+        """Take a chunk out of the shared queue, waiting for at most timeout seconds.
+        :rtype (list): Task instances.
+        """
+        return self.queue.get(timeout=timeout)
+
+    def chunk_size(self):
+        """Return the number of tasks to put into a chunk."""
+        if self.chunksize != 'auto':
+            return self.chunksize
+        seconds, num_tasks = self.task_time[:]
+        if not num_tasks:
+            return 1
+        chunk_size = int(self.target_chunk_time * num_tasks / seconds) if seconds > 0 else self.max_chunksize
+        return max(1, min(chunk_size, self.max_chunksize))
+
+    def record_time(self, seconds, num_tasks):
+        """Record the time spent on running a chunk of tasks.
+        :param seconds: (float) time spent on the chunk.
+        :param num_tasks: (int) the number of tasks in the chunk.
+        """
+        if self.chunksize == 'auto':
+            with self.task_time.get_lock():
+                self.task_time[0] += seconds
+                self.task_time[1] += num_tasks
+
+    def hand_back(self):
+        """Put the buffered and the delayed tasks of this process back into the
+        queue, when the process stops getting tasks, e.g. a worker retired by the
+        Autoscaler, so that the other processes run them. Delayed tasks could be
+        got again at once then.
+        """
+        with self.local_lock:
+            tasks = list(self.buffer) + [task for due, seq, task in self.delayed]
+            # Delayed tasks are still counted in qsize, buffered ones are not.
+            self.qsize.increment(-len(self.delayed))
+            self.buffer.clear()
+            del self.delayed[:]
+        for task in tasks:
+            self.requeue(task)
+
+    def drain(self):
+        """Take the chunks left in the shared queue without running them, when the
+        run is aborted. This process does not wait at exit to flush the chunks it
+        put into the queue any more, since nobody would get them.
+        :rtype (list): Task instances.
+        """
+        self.queue.cancel_join_thread()
+        tasks = []
+        while True:
+            try:
+                tasks.extend(self.queue.get_nowait())
+            except Empty:
+                return tasks
+
+    def __getstate__(self):
+        # The local lock belongs to the process which created it.
+        state = self.__dict__.copy()
+        del state['local_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local_lock = td.Lock()
 
 
 class ProcessWorker(mp.Process, BaseWorker):
@@ -464,22 +1971,41 @@ class ProcessWorker(mp.Process, BaseWorker):
     put the results of the task (if there are results returned by task) into the 
     results queue. 
     If there are exceptions exist when the worker run the task, the worker will
-    put the task back into the task queue if failed_queue argument is None, else
-    it will put the task into the failed queue.
+    put the task back into the task queue to retry it after a backoff as long as
+    the retry policy allows, else it will put the task into the failed queue.
     
     Attributes
         :param task_queue: (subclass of BaseQueue) task queue contains task instances.
         :param res_queue: optional (Queue or its subclass) results queue contains the results 
             returned by the task.run method.
         :param failed_queue: optional (subclass of BaseQueue) failed queue contains failed task instances.
+        :param session_pool: optional (SessionPool) the pool to get the HTTP session of the worker from.
+        :param retry: optional (RetryPolicy) the retry policy of failed tasks.
+        :param checkpoint: optional (Checkpoint) the checkpoint to record succeeded tasks in.
+        :param sink: optional (Sink) the sink to write results into a shard of.
+        :param transport: optional (SharedMemoryTransport) the transport of large results to the manager.
+        :param metrics: optional (Metrics) the metrics of the manager to record the metrics of the worker in.
+        :param profile_dir: optional (str) the directory to dump the cProfile profile of the worker into.
+        :param tracer: optional (Tracer) the tracer to record the timeline of tasks into.
+        :param errors: optional (ErrorAggregator) the aggregator to report errors of tasks to.
+        :param frontier: optional (Frontier) the frontier to put follow-up tasks into the task queue by.
     """
 
-    def __init__(self, task_queue, res_queue=None, failed_queue=None):
+    shared_metrics = True
+
+    def __init__(self, task_queue, res_queue=None, failed_queue=None, session_pool=None, retry=None,
+                 checkpoint=None, sink=None, transport=None, metrics=None,
+                 profile_dir=None, tracer=None, errors=None, frontier=None):
         mp.Process.__init__(self)
-        BaseWorker.__init__(self, task_queue, res_queue, failed_queue)
+        BaseWorker.__init__(self, task_queue, res_queue, failed_queue, session_pool, retry, checkpoint, sink,
+                            transport, metrics, profile_dir, tracer, errors, frontier)
+        self.stopping = mp.Event()
 
     def run(self):
-        self._run()
+        try:
+            self._run()
+        finally:
+            self.task_queue.hand_back()
 
 
 class ProcessManager(BaseManager):
@@ -507,19 +2033,349 @@ class ProcessManager(BaseManager):
 
         :param add_failed: optional (bool) whether add failed tasks back into the
             task queue.
-            True: Put the failed tasks back into the task queue.
-            False: Put the failed tasks into the failed queue.
+            True: Put the failed tasks back into the task queue to retry them
+                with the default RetryPolicy.
+            False: Put the failed tasks into the failed queue at once.
+
+        :param chunksize: optional (int or 'auto') the number of tasks a worker
+            gets, acknowledges and returns results for at a time. 'auto' sizes
+            chunks from the measured time of tasks. Default is 1.
+
+        :param task_queue_cls: optional (ProcessTaskQueue or its subclass) task queue
+            class, e.g. a ProcessPriorityTaskQueue with its options bound by
+            functools.partial. Default is ProcessTaskQueue.
+
+        Other keyword arguments (e.g. retry, shared_memory, queue_size) are passed to BaseManager.
+        With a sink, each worker process writes results into its own shard of the sink.
     """
 
-    def __init__(self, source, task_cls, has_result=False, num_workers=None, add_failed=True):
+    shard_sink = True
+    multiprocess = True
+    max_auto_workers = os.cpu_count() or 1
+
+    def __init__(self, source, task_cls, has_result=False, num_workers=None, add_failed=True, chunksize=1,
+                 task_queue_cls=ProcessTaskQueue, **kwargs):
         BaseManager.__init__(self, source,
                              task_cls,
                              ProcessWorker,
-                             ProcessTaskQueue,
-                             mp.Manager().Queue,
+                             functools.partial(task_queue_cls, chunksize=chunksize),
+                             mp.Queue,
+                             has_result,
+                             num_workers,
+                             add_failed,
+                             **kwargs)
+
+
+# Hybrid of multi-processing and multi-threading
+class HybridWorker(ProcessWorker):
+    """A process worker class which runs a pool of thread workers, so that
+    CPU-bound parts of tasks run on multiple cores while each process keeps
+    num_threads blocking requests in flight.
+    All the threads of the process share its task queue, results queue and
+    failed queue, and each of them gets its own HTTP session from the session
+    pool. With a sink, the threads write results into one shard of the process.
+
+    Attributes
+        :param task_queue: (ProcessTaskQueue) task queue contains task instances.
+        :param res_queue: optional (Queue or its subclass) results queue contains the results
+            returned by the task.run method.
+        :param failed_queue: optional (ProcessTaskQueue) failed queue contains failed task instances.
+        :param session_pool: optional (SessionPool) the pool to get the HTTP sessions of the threads from.
+        :param retry: optional (RetryPolicy) the retry policy of failed tasks.
+        :param checkpoint: optional (Checkpoint) the checkpoint to record succeeded tasks in.
+        :param sink: optional (Sink) the sink to write results into a shard of.
+        :param transport: optional (SharedMemoryTransport) the transport of large results to the manager.
+        :param metrics: optional (Metrics) the metrics of the manager to record the metrics of the worker in.
+        :param profile_dir: optional (str) the directory to dump the cProfile profile of the worker into.
+        :param tracer: optional (Tracer) the tracer to record the timeline of tasks into.
+        :param errors: optional (ErrorAggregator) the aggregator to report errors of tasks to.
+        :param frontier: optional (Frontier) the frontier to put follow-up tasks into the task queue by.
+        :param num_threads: optional (int) the number of thread workers in the process. Default is 10.
+    """
+
+    def __init__(self, task_queue, res_queue=None, failed_queue=None, session_pool=None, retry=None,
+                 checkpoint=None, sink=None, transport=None, metrics=None,
+                 profile_dir=None, tracer=None, errors=None, frontier=None, num_threads=10):
+        ProcessWorker.__init__(self, task_queue, res_queue, failed_queue, session_pool, retry, checkpoint, sink,
+                               transport, profile_dir=profile_dir, tracer=tracer, errors=errors,
+                               frontier=frontier)
+        self.num_threads = num_threads
+        # Each thread records its metrics on its own, in shared memory.
+        self.thread_metrics = [metrics.worker(shared=True) for i in range(num_threads)] if metrics is not None else None
+
+    def run(self):
+        res_queue = self.res_queue
+        if self.sink is not None:
+            res_queue = SinkWriter(self.sink.shard(os.getpid()), checkpoint=self.checkpoint)
+            res_queue.start()
+        threads = []
+        try:
+            for i in range(self.num_threads):
+                thread = ThreadWorker(self.task_queue, res_queue, self.failed_queue,
+                                      session_pool=self.session_pool, retry=self.retry,
+                                      checkpoint=self.checkpoint, transport=self.transport,
+                                      profile_dir=self.profile_dir, tracer=self.tracer, errors=self.errors,
+                                      frontier=self.frontier)
+                # Threads quit once the process is asked to stop.
+                thread.stopping = self.stopping
+                if self.thread_metrics is not None:
+                    thread.metrics = self.thread_metrics[i]
+                thread.start()
+                threads.append(thread)
+        finally:
+            for thread in threads:
+                thread.join()
+            self.task_queue.hand_back()
+            if self.sink is not None:
+                res_queue.close()
+
+
+class HybridManager(BaseManager):
+    """A hybrid manager class which runs num_workers worker processes, each of
+    them running a pool of num_threads threads, fed from one task queue.
+    It suits tasks doing both blocking I/O and CPU-bound work, e.g. fetching
+    pages and parsing them: the processes use all the cpu cores, and the
+    threads keep num_workers * num_threads requests in flight.
+    Progress and errors of all the threads are shown by one progress bar, and
+    results are merged into the results of run.
+
+    Attributes
+        :param source: (iterable) the sources that tasks in the task 
+            queue need for running tasks.
+
+        :param task_cls: (subclass of Task or any class with a run method, 
+            function, method) 
+            task class to instantiate tasks or task function/ task method.
+
+        :param has_result: optional (bool) whether there are returned values from 
+            the task.run method.
+            The manager will instantiate the results queue if has_result is True,
+            otherwise the result queue is always None. Default is False.
+
+        :param num_workers: optional (int, 'auto' or None) number of worker processes,
+            could be None, 'auto' or int values:
+            None: input the number of processes in the command line, or 'auto' if
+                the standard input is not a terminal.
+            'auto': scale the number of processes up to the number of cpu cores.
+            int: could be any positive integer, the number of cpu cores is recommended.
+            Default is None.
+
+        :param add_failed: optional (bool) whether add failed tasks back into the
+            task queue.
+            True: Put the failed tasks back into the task queue to retry them
+                with the default RetryPolicy.
+            False: Put the failed tasks into the failed queue at once.
+
+        :param num_threads: optional (int) the number of threads in each worker
+            process. Default is 10.
+
+        :param chunksize: optional (int or 'auto') the number of tasks a thread
+            gets, acknowledges and returns results for at a time. Default is 1.
+
+        :param task_queue_cls: optional (ProcessTaskQueue or its subclass) task queue
+            class, e.g. a ProcessPriorityTaskQueue. Default is ProcessTaskQueue.
+
+        Other keyword arguments (e.g. retry, session, shared_memory, queue_size) are passed to BaseManager.
+    """
+
+    shard_sink = True
+    multiprocess = True
+    max_auto_workers = os.cpu_count() or 1
+
+    def __init__(self, source, task_cls, has_result=False, num_workers=None, add_failed=True,
+                 num_threads=10, chunksize=1, task_queue_cls=ProcessTaskQueue, **kwargs):
+        BaseManager.__init__(self, source,
+                             task_cls,
+                             functools.partial(HybridWorker, num_threads=num_threads),
+                             functools.partial(task_queue_cls, chunksize=chunksize),
+                             mp.Queue,
+                             has_result,
+                             num_workers,
+                             add_failed,
+                             **kwargs)
+        self.num_threads = num_threads
+
+
+# Asyncio
+class AsyncWorker(Thread, BaseWorker):
+    """An asyncio worker class which runs tasks concurrently on an event loop
+    in its own thread. 
+    The worker keeps up to concurrency tasks in flight. Task functions could be
+    coroutine functions, and Task classes could have an async run method, whose
+    coroutines are awaited. Plain functions are called on the event loop thread,
+    so they should not block.
+    If there are exceptions exist when the worker run the task, the worker will
+    put the task back into the task queue to retry it after a backoff as long as
+    the retry policy allows, else it will put the task into the failed queue.
+
+    Attributes
+        :param task_queue: (ThreadTaskQueue) task queue contains task instances.
+        :param res_queue: optional (Queue or its subclass) results queue contains the results 
+            returned by the task.run method.
+        :param failed_queue: optional (ThreadTaskQueue) failed queue contains failed task instances.
+        :param session_pool: optional (SessionPool) the pool to get the HTTP session of the worker from.
+            Note that requests blocks the event loop, so it only suits a few blocking calls.
+        :param retry: optional (RetryPolicy) the retry policy of failed tasks.
+        :param checkpoint: optional (Checkpoint) the checkpoint to record succeeded tasks in.
+        :param sink: optional (Sink) the sink to write results into a shard of.
+        :param transport: optional (SharedMemoryTransport) the transport of large results to the manager.
+        :param metrics: optional (Metrics) the metrics of the manager to record the metrics of the worker in.
+        :param profile_dir: optional (str) the directory to dump the cProfile profile of the worker into.
+        :param tracer: optional (Tracer) the tracer to record the timeline of tasks into.
+        :param errors: optional (ErrorAggregator) the aggregator to report errors of tasks to.
+        :param frontier: optional (Frontier) the frontier to put follow-up tasks into the task queue by.
+        :param concurrency: optional (int) the maximum number of tasks in flight. Default is 100.
+    """
+
+    def __init__(self, task_queue, res_queue=None, failed_queue=None, session_pool=None, retry=None,
+                 checkpoint=None, sink=None, transport=None, metrics=None,
+                 profile_dir=None, tracer=None, errors=None, frontier=None, concurrency=100):
+        Thread.__init__(self)
+        BaseWorker.__init__(self, task_queue, res_queue, failed_queue, session_pool, retry, checkpoint, sink,
+                            transport, metrics, profile_dir, tracer, errors, frontier)
+        self.concurrency = concurrency
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        self._open()
+        try:
+            if self.profile_dir is None:
+                loop.run_until_complete(self._run_async())
+            else:
+                profile_call(self.profile_dir, loop.run_until_complete, self._run_async())
+        finally:
+            self._close()
+            loop.close()
+
+    async def _run_async(self):
+        """Run tasks in the task queue until the queue is empty and no task is in
+        flight, or until the worker is stopped and the tasks in flight are done."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        in_flight = set()
+        while True:
+            await semaphore.acquire()
+            while True:
+                if self.stopping.is_set():
+                    # Take no new tasks, and let the tasks in flight finish.
+                    if in_flight:
+                        await asyncio.wait(list(in_flight))
+                    return
+                task = self.task_queue.get_nowait()
+                if task is not None:
+                    break
+                if self.task_queue.closed.is_set() and self.task_queue.empty() and not in_flight:
+                    return
+                if self.metrics is not None and not in_flight:
+                    self.metrics.record_idle(self.task_queue.poll_interval)
+                await asyncio.sleep(self.task_queue.poll_interval)
+            future = asyncio.ensure_future(self._run_task(task, semaphore))
+            in_flight.add(future)
+            future.add_done_callback(in_flight.discard)
+
+    async def _run_task(self, task, semaphore):
+        """Run a task, and release the semaphore once it is done."""
+        results = []
+        timed = self.metrics is not None or self.trace_events is not None
+        task_start = time.time() if timed else 0
+        error = None
+        try:
+            res = self._call(task)
+            if inspect.isawaitable(res):
+                res = await res
+            if self.frontier is not None:
+                res = self.frontier.expand(task, res, self.task_queue)
+            num_done = self._on_success(task, res, results)
+        except Exception as e:
+            error = e
+            num_done = self._on_failure(task, e, results)
+        finally:
+            semaphore.release()
+        if timed:
+            self._record(task, task_start, time.time(), error, num_done)
+        self.task_queue.release(task)
+        if results:
+            self.res_queue.put(results)
+        if num_done:
+            self.task_queue.task_done(num_done)
+
+
+class AsyncManager(BaseManager):
+    """An asyncio manager class to manage all the queues and an AsyncWorker,
+    which runs coroutine task functions or Task classes with an async run
+    method on a single event loop, so that thousands of I/O-bound tasks could
+    be in flight with one thread.
+
+    Attributes
+        :param source: (iterable) the sources that tasks in the task 
+            queue need for running tasks.
+
+        :param task_cls: (subclass of Task or any class with a run method, 
+            function, method) 
+            task class to instantiate tasks or task function/ task method.
+            The run method or the function could be a coroutine function.
+
+        :param has_result: optional (bool) whether there are returned values from 
+            the task.run method.
+            The manager will instantiate the results queue if has_result is True,
+            otherwise the result queue is always None. Default is False.
+
+        :param num_workers: optional (int, 'auto' or None) the maximum number of tasks
+            in flight, could be None, 'auto' or int values:
+            None: input the number in the command line, or 'auto' if the standard
+                input is not a terminal.
+            'auto': max_workers, which is 1000 by default.
+            int: could be any positive integer, thousands are fine for I/O-bound tasks.
+            Default is None.
+
+        :param add_failed: optional (bool) whether add failed tasks back into the
+            task queue.
+            True: Put the failed tasks back into the task queue to retry them
+                with the default RetryPolicy.
+            False: Put the failed tasks into the failed queue at once.
+
+        :param task_queue_cls: optional (ThreadTaskQueue or its subclass) task queue
+            class, e.g. a PoliteTaskQueue with its options bound by functools.partial
+            to rate limit tasks per host. Default is ThreadTaskQueue.
+
+        Other keyword arguments (e.g. retry, queue_size) are passed to BaseManager.
+    """
+
+    max_auto_workers = 1000
+
+    def __init__(self, source, task_cls, has_result=False, num_workers=None, add_failed=True,
+                 task_queue_cls=ThreadTaskQueue, **kwargs):
+        BaseManager.__init__(self, source,
+                             task_cls,
+                             AsyncWorker,
+                             task_queue_cls,
+                             Queue,
                              has_result,
                              num_workers,
-                             add_failed)
+                             add_failed,
+                             **kwargs)
+
+    def test(self, index=0):
+        """Test if the task.run method could run without any exceptions."""
+        res = BaseManager.test(self, index)
+        if inspect.isawaitable(res):
+            loop = asyncio.new_event_loop()
+            try:
+                res = loop.run_until_complete(res)
+            finally:
+                loop.close()
+        return res
+
+    def _start_workers(self):
+        """Start an AsyncWorker running num_workers tasks concurrently.
+        :rtype (list): the started workers.
+        """
+        concurrency = self.max_workers if self.num_workers == 'auto' else self.num_workers
+        worker = self.worker_cls(self.task_queue, self.writer or self.res_queue, self.failed_queue,
+                                 session_pool=self.session_pool, retry=self.retry, checkpoint=self.checkpoint,
+                                 metrics=self.metrics, profile_dir=self.profile_dir, tracer=self.tracer,
+                                 errors=self.errors, frontier=self.frontier, concurrency=concurrency)
+        worker.start()
+        return [worker]
 
 
 # Command line tool
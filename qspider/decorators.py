@@ -23,6 +23,7 @@
 import functools
 
 from .core import ThreadManager
+from .core import AsyncManager
 
 
 class concurrent(object):
@@ -65,3 +66,41 @@ class concurrent(object):
                 return thread_manager.run(*wargs, **wkwargs)
             return wrapper
         return decorator
+
+    @staticmethod
+    def async_class(source, *args, **kwargs):
+        """asyncio task class decorator, the run method could be a coroutine function.
+        
+        Attributes
+            :param source: (iterable) the sources that tasks in the task 
+                queue need for running tasks.
+            :param task_cls: (subclass of Task or any class with a run method, 
+                function, method) 
+                task class to instantiate tasks or task function/ task method.
+        """
+        def decorator(task_cls):
+            @functools.wraps(task_cls)
+            def wrapper():
+                async_manager = AsyncManager(source, task_cls, *args, **kwargs)
+                return async_manager
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def async_func(source, *args, **kwargs):
+        """asyncio task function decorator, the function could be a coroutine function.
+        
+        Attributes
+            :param source: (iterable) the sources that tasks in the task 
+                queue need for running tasks.
+            :param task_cls: (subclass of Task or any class with a run method, 
+                function, method) 
+                task class to instantiate tasks or task function/ task method.
+        """
+        def decorator(task_cls):
+            @functools.wraps(task_cls)
+            def wrapper(*wargs, **wkwargs):
+                async_manager = AsyncManager(source, task_cls, *args, **kwargs)
+                return async_manager.run(*wargs, **wkwargs)
+            return wrapper
+        return decorator
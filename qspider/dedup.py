@@ -0,0 +1,348 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import math
+import struct
+import ctypes
+import hashlib
+import threading as td
+import multiprocessing as mp
+from abc import ABC, abstractmethod
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, quote
+
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+
+
+def canonicalize_url(url):
+    """Return the canonical form of a url, so that urls of the same page are equal:
+    the scheme and the host are lowercased, the default port, the fragment and
+    dot segments of the path are removed, the path is percent-encoded and the
+    query parameters are sorted.
+    Strings which are not absolute urls are returned as they are.
+    :param url: (str) the url.
+    :rtype (str): the canonical url.
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.netloc:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        host = '[%s]' % host
+    netloc = host
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = '%s:%d' % (host, port)
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else '%s:%s' % (parts.username, parts.password)
+        netloc = '%s@%s' % (userinfo, netloc)
+    path = quote(_remove_dot_segments(parts.path) or '/', safe="/%:@!$&'()*+,;=~")
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)), quote_via=quote, safe="/:@!$'()*,;~")
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def _remove_dot_segments(path):
+    """Resolve the '.' and '..' segments of the path of a url."""
+    if '.' not in path:
+        return path
+    segments = []
+    for segment in path.split('/'):
+        if segment == '..':
+            if len(segments) > 1:
+                segments.pop()
+        elif segment != '.':
+            segments.append(segment)
+    if path.endswith(('/.', '/..')):
+        segments.append('')
+    return '/'.join(segments)
+
+
+def url_fingerprint(source_item):
+    """The default fingerprint of a source item: its canonical url if it is a str,
+    otherwise the source item itself."""
+    if isinstance(source_item, str):
+        return canonicalize_url(source_item)
+    return source_item
+
+
+def key_hash(key):
+    """Return a 128-bit hash of a key, which is a str, bytes or any object with
+    a stable repr.
+    :rtype (int): the hash.
+    """
+    if isinstance(key, str):
+        data = key.encode('utf-8')
+    elif isinstance(key, (bytes, bytearray, memoryview)):
+        data = bytes(key)
+    else:
+        data = repr(key).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=16).digest(), 'little')
+
+
+class Filter(ABC):
+    """An abstract filter of seen keys, which deduplicates tasks by the
+    fingerprints of their source items. Keys are hashed into 128 bits by
+    key_hash first.
+    Filter is an abstract class, which means it must be inherited
+    before it can be instantiated.
+
+    Attributes
+        :param path: optional (str or None) the file to persist the filter into,
+            which is loaded if it exists, so that keys seen in the previous runs
+            are skipped as well. The manager saves the filter after each run.
+            Default is None.
+    """
+
+    magic = b''
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def add(self, key):
+        """Add a key into the filter.
+        :param key: (str, bytes or any object with a stable repr) the key.
+        :rtype (bool): True if the key is new, False if it was seen before.
+        """
+        return self._add(key_hash(key))
+
+    def __contains__(self, key):
+        return self._contains(key_hash(key))
+
+    @abstractmethod
+    def __len__(self):
+        """Return the number of keys in the filter."""
+
+    @abstractmethod
+    def _add(self, value):
+        """Add a hashed key, return if it is new."""
+
+    @abstractmethod
+    def _contains(self, value):
+        """Return if a hashed key was added."""
+
+    @abstractmethod
+    def _dump(self, f):
+        """Write the filter after the magic header into a binary file."""
+
+    @abstractmethod
+    def _load(self, f):
+        """Read the filter after the magic header from a binary file."""
+
+    def load(self):
+        """Load the filter from path if the file exists.
+        :rtype (bool): whether the file exists.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as f:
+            if f.read(len(self.magic)) != self.magic:
+                raise ValueError("%s is not a file of %s." % (self.path, type(self).__name__))
+            self._load(f)
+        return True
+
+    def save(self, path=None):
+        """Write the filter into a file atomically.
+        :param path: optional (str or None) the file. Default is path of the filter.
+        """
+        path = path or self.path
+        if path is None:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(self.magic)
+            self._dump(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def __str__(self):
+        return "%s{keys=%d, path=%s}" % (type(self).__name__, len(self), self.path)
+
+
+class SetFilter(Filter):
+    """An exact filter keeping the 128-bit hashes of all the seen keys in a set,
+    which takes about 100 bytes per key. Collisions of the hashes are negligible
+    below trillions of keys.
+    The set lives in the manager process, which reads the source, so it works
+    with ProcessManager as well, but it is not shared with worker processes.
+
+    Attributes
+        :param path: optional (str or None) the file to persist the filter into.
+            Default is None.
+    """
+
+    magic = b'QSPSET1\n'
+    read_size = 1 << 20
+
+    def __init__(self, path=None):
+        Filter.__init__(self, path)
+        self.values = set()
+        self.lock = td.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.values)
+
+    def _add(self, value):
+        with self.lock:
+            if value in self.values:
+                return False
+            self.values.add(value)
+            return True
+
+    def _contains(self, value):
+        return value in self.values
+
+    def _dump(self, f):
+        with self.lock:
+            values = list(self.values)
+        for i in range(0, len(values), 65536):
+            f.write(b''.join(value.to_bytes(16, 'little') for value in values[i:i + 65536]))
+
+    def _load(self, f):
+        values = set()
+        while True:
+            data = f.read(self.read_size)
+            if not data:
+                break
+            values.update(int.from_bytes(data[i:i + 16], 'little') for i in range(0, len(data) - 15, 16))
+        self.values = values
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = td.Lock()
+
+
+class BloomFilter(Filter):
+    """A memory-bounded filter of seen keys, which may take a new key as a seen
+    one with a probability of error_rate, so that the task of the key is skipped,
+    but never takes a seen key as a new one.
+    It takes -ln(error_rate) / ln(2)^2 bits per key, e.g. about 1.8 GB for a
+    billion keys with an error rate of 0.1%, and the error rate grows once more
+    than capacity keys are added.
+    The bits live in shared memory, so the filter is shared with worker
+    processes, e.g. by ProcessManager.
+
+    Attributes
+        :param capacity: optional (int) the expected number of keys. Default is 10 million.
+        :param error_rate: optional (float) the false positive rate with capacity
+            keys. Default is 0.001.
+        :param path: optional (str or None) the file to persist the filter into.
+            The capacity and the error rate of the file are used if it exists.
+            Default is None.
+    """
+
+    magic = b'QSPBLM1\n'
+    header = struct.Struct('<QQQ')
+    write_size = 1 << 24
+
+    def __init__(self, capacity=10000000, error_rate=0.001, path=None):
+        Filter.__init__(self, path)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        self._allocate(num_bits, num_hashes)
+        self.lock = mp.Lock()
+        self.load()
+
+    def _allocate(self, num_bits, num_hashes):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.hash_range = range(num_hashes)
+        self.bits = mp.RawArray(ctypes.c_uint8, (num_bits + 7) // 8)
+        self.count = mp.RawValue(ctypes.c_int64, 0)
+        self.view = None
+
+    def _positions(self, value):
+        """Return the bits of a hashed key by double hashing."""
+        num_bits = self.num_bits
+        h1 = value & 0xffffffffffffffff
+        h2 = value >> 64 | 1
+        return [(h1 + i * h2) % num_bits for i in self.hash_range]
+
+    def _bytes(self):
+        if self.view is None:
+            self.view = memoryview(self.bits).cast('B')
+        return self.view
+
+    def __len__(self):
+        return self.count.value
+
+    def _add(self, value):
+        positions = [(position >> 3, 1 << (position & 7)) for position in self._positions(value)]
+        bits = self._bytes()
+        with self.lock:
+            new = False
+            for byte, bit in positions:
+                if not bits[byte] & bit:
+                    bits[byte] |= bit
+                    new = True
+            if new:
+                self.count.value += 1
+            return new
+
+    def _contains(self, value):
+        bits = self._bytes()
+        return all(bits[position >> 3] >> (position & 7) & 1 for position in self._positions(value))
+
+    def estimated_error_rate(self):
+        """Return the false positive rate with the keys added so far.
+        :rtype (float): the estimated rate.
+        """
+        return (1 - math.exp(-self.num_hashes * len(self) / self.num_bits)) ** self.num_hashes
+
+    def _dump(self, f):
+        bits = self._bytes()
+        with self.lock:
+            f.write(self.header.pack(self.num_bits, self.num_hashes, self.count.value))
+            for i in range(0, len(bits), self.write_size):
+                f.write(bits[i:i + self.write_size])
+
+    def _load(self, f):
+        num_bits, num_hashes, count = self.header.unpack(f.read(self.header.size))
+        if (num_bits, num_hashes) != (self.num_bits, self.num_hashes):
+            self._allocate(num_bits, num_hashes)
+        f.readinto(self._bytes())
+        self.count.value = count
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['view'] = None
+        return state
+
+    def __str__(self):
+        return "%s{keys=%d, bits=%d, hashes=%d, path=%s}" % (
+            type(self).__name__, len(self), self.num_bits, self.num_hashes, self.path)
@@ -0,0 +1,592 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+import copy
+import time
+import socket
+import logging
+import secrets
+import argparse
+import itertools
+import threading as td
+import multiprocessing as mp
+from queue import Queue
+from multiprocessing.connection import Listener, Client
+from multiprocessing.spawn import import_main_path
+
+from .core import BaseManager
+from .core import ThreadTaskQueue
+from .core import ThreadWorker
+from .core import task_source
+from .utils import INFO
+from .utils import WARN
+from .utils import ERROR
+from .utils import Thread
+
+logger = logging.getLogger(__name__)
+
+
+def parse_address(address):
+    """Turn a 'host:port' string into a (host, port) address."""
+    if isinstance(address, str):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return tuple(address)
+
+
+def _authkey(authkey):
+    """Return the authkey as bytes, from the QSPIDER_AUTHKEY environment variable if it is None."""
+    authkey = authkey or os.environ.get('QSPIDER_AUTHKEY')
+    if authkey is None:
+        return None
+    return authkey.encode('utf-8') if isinstance(authkey, str) else authkey
+
+
+class Broker(Thread):
+    """A broker which serves the task queue, the failed queue and the results
+    of a manager to remote workers over TCP, so that one source is run by
+    workers on multiple hosts, see DistributedManager.
+    Workers lease chunks of tasks and acknowledge each chunk with its results,
+    failed tasks, retries and follow-up tasks in one message. A lease is put
+    back into the task queue if the connection of its worker breaks, or if no
+    heartbeat of the worker arrives for lease_timeout seconds, so the tasks of
+    a dead worker run again on the others. Acknowledgements of leases put back
+    are ignored.
+    Messages are pickled through multiprocessing.connection, and peers are
+    authenticated by the authkey first, since unpickling runs code.
+    The broker thread quits once the task queue is finished, while workers
+    are still answered that the run is done until the broker is closed.
+
+    Attributes
+        :param manager: (BaseManager) the manager whose queues are served.
+        :param address: optional (tuple or str) the (host, port) or 'host:port' to
+            listen on. Port 0 picks a free port. Default is ('127.0.0.1', 0).
+        :param authkey: (bytes or str) the key remote workers authenticate with.
+        :param chunksize: optional (int) the maximum number of tasks of a lease.
+            Default is 10.
+        :param lease_timeout: optional (float) seconds without a heartbeat after
+            which the leases of a worker are put back. Default is 30.
+        :param heartbeat: optional (float) seconds between heartbeats of workers.
+            Default is 5.
+    """
+
+    poll_interval = 0.05
+
+    def __init__(self, manager, address=('127.0.0.1', 0), authkey=None, chunksize=10,
+                 lease_timeout=30, heartbeat=5):
+        Thread.__init__(self, daemon=True)
+        self.manager = manager
+        self.authkey = _authkey(authkey)
+        if self.authkey is None:
+            raise ValueError("Broker needs an authkey, since it unpickles messages of remote workers.")
+        # Many worker threads connect at once, a backlog of 1 would drop their handshakes.
+        self.listener = Listener(parse_address(address), backlog=128, authkey=self.authkey)
+        self.address = self.listener.address
+        self.chunksize = chunksize
+        self.lease_timeout = lease_timeout
+        self.heartbeat = heartbeat
+        # Lease id -> (worker id, tasks) of the chunks being run by workers.
+        self.leases = {}
+        self.lease_ids = itertools.count()
+        self.last_seen = {}
+        self.num_lost = 0
+        self.closing = False
+        self.acceptor = None
+        frontier = copy.copy(manager.frontier)
+        # Follow-up tasks are deduplicated by the broker.
+        frontier.dedup = None
+        output = manager.writer or manager.res_queue
+        self.config = {'retry': manager.retry, 'session_pool': manager.session_pool, 'frontier': frontier,
+                       'results': output is not None or manager.checkpoint is not None,
+                       'chunksize': chunksize, 'heartbeat': heartbeat}
+
+    @property
+    def connect_address(self):
+        """The (host, port) workers on this host connect to."""
+        host, port = self.address
+        return ('127.0.0.1' if host in ('0.0.0.0', '') else host), port
+
+    def run(self):
+        self.acceptor = Thread(target=self._accept, daemon=True)
+        self.acceptor.start()
+        task_queue = self.manager.task_queue
+        while not task_queue.finished():
+            time.sleep(self.poll_interval)
+            self._reap()
+
+    def close(self):
+        """Stop accepting workers. Workers connected before are told that the run is done."""
+        if self.closing:
+            return
+        self.closing = True
+        if self.acceptor is not None:
+            try:
+                # Wake up the accepting thread.
+                Client(self.connect_address, authkey=self.authkey).close()
+            except OSError:
+                pass
+        self.listener.close()
+
+    def _accept(self):
+        while not self.closing:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                break
+            except Exception as e:
+                logger.warning("%s A worker failed to connect to the broker: %s" % (WARN, e))
+                continue
+            if self.closing:
+                conn.close()
+                break
+            Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        """Answer the requests of a connection, and put back its leases once it breaks."""
+        leases = set()
+        try:
+            while True:
+                conn.send(self._handle(conn.recv(), leases))
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            logger.error("%s Failed to handle a request of a worker. Error message: %s" % (ERROR, e))
+        finally:
+            for lease_id in leases:
+                self._expire(lease_id)
+            conn.close()
+
+    def _handle(self, msg, leases):
+        kind, worker_id = msg[0], msg[1]
+        self.last_seen[worker_id] = time.time()
+        if kind == 'get':
+            return self._lease(worker_id, msg[2], leases)
+        if kind == 'ack':
+            leases.discard(msg[2])
+            self._ack(msg[2], msg[3])
+            return ('ok',)
+        if kind == 'hello':
+            return ('config', self.config)
+        return ('ok',)
+
+    def _lease(self, worker_id, max_tasks, leases):
+        task_queue = self.manager.task_queue
+        tasks = []
+        for i in range(min(max_tasks, self.chunksize)):
+            task = task_queue.get_nowait()
+            if task is None:
+                break
+            tasks.append(task)
+        if tasks:
+            lease_id = next(self.lease_ids)
+            self.leases[lease_id] = (worker_id, tasks)
+            leases.add(lease_id)
+            return ('tasks', lease_id, tasks)
+        if task_queue.finished():
+            return ('done',)
+        return ('wait', task_queue.poll_interval)
+
+    def _ack(self, lease_id, ack):
+        """Apply the outcome of a lease, unless it was put back."""
+        lease = self.leases.pop(lease_id, None)
+        if lease is None:
+            return
+        manager = self.manager
+        task_queue = manager.task_queue
+        # Follow-up tasks are put before the tasks of the lease are done.
+        follow = [task for task in ack['follow'] if manager.is_new(task_source(task))]
+        if follow:
+            task_queue.put_many(follow)
+        for task, delay in ack['retries']:
+            task_queue.requeue(task, delay)
+        for task in ack['failed']:
+            manager.failed_queue.put(task)
+        if ack['results']:
+            # The sink writer records the checkpoint once the results are written.
+            if manager.checkpoint is not None and manager.writer is None:
+                for index, ok, res in ack['results']:
+                    if ok and index is not None:
+                        manager.checkpoint.record(index)
+            output = manager.writer or manager.res_queue
+            if output is not None:
+                output.put(ack['results'])
+        if ack['num_failed']:
+            task_queue.num_failed.increment(ack['num_failed'])
+        for task in lease[1]:
+            task_queue.release(task)
+        if ack['num_done']:
+            task_queue.task_done(ack['num_done'])
+
+    def _expire(self, lease_id):
+        """Put the tasks of a lease back into the task queue."""
+        lease = self.leases.pop(lease_id, None)
+        if lease is None:
+            return
+        worker_id, tasks = lease
+        task_queue = self.manager.task_queue
+        for task in tasks:
+            task_queue.release(task)
+            task_queue.requeue(task)
+        self.num_lost += len(tasks)
+        msg = "%s Lost worker %s, %d tasks of it are put back." % (WARN, worker_id, len(tasks))
+        logger.warning("\r%s" % msg)
+
+    def _reap(self):
+        """Put back the leases of the workers which missed their heartbeats."""
+        deadline = time.time() - self.lease_timeout
+        for lease_id, (worker_id, tasks) in list(self.leases.items()):
+            if self.last_seen.get(worker_id, 0) < deadline:
+                self._expire(lease_id)
+
+
+class _Outbox(object):
+    """The results queue or the failed queue of a remote worker, which adds
+    into the acknowledgement of the lease of the current thread."""
+
+    def __init__(self, task_queue, name):
+        self.task_queue = task_queue
+        self.name = name
+
+    def put(self, item):
+        if self.name == 'results':
+            self.task_queue._ack()['results'].extend(item)
+        else:
+            self.task_queue._ack()[self.name].append(item)
+
+
+class _Counter(object):
+    """The num_failed counter of a remote worker."""
+
+    def __init__(self, task_queue):
+        self.task_queue = task_queue
+
+    def increment(self, n=1):
+        self.task_queue._ack()['num_failed'] += n
+
+
+class RemoteTaskQueue(object):
+    """The task queue of a remote worker process, which leases chunks of tasks
+    from a Broker and is read by ThreadWorkers like a BaseQueue. Each thread
+    has its own connection, and holds one lease at a time. The results,
+    failures, retries and follow-up tasks of a chunk are kept by the thread
+    and sent as the acknowledgement of its lease once the worker records
+    the time of the chunk, i.e. after the whole chunk is done.
+
+    Attributes
+        :param address: (tuple or str) the (host, port) or 'host:port' of the broker.
+        :param authkey: optional (bytes, str or None) the authkey of the broker.
+            Default is the QSPIDER_AUTHKEY environment variable.
+        :param worker_id: optional (str) the id of the worker in the logs of the
+            broker. Default is hostname:pid.
+    """
+
+    def __init__(self, address, authkey=None, worker_id=None):
+        self.address = parse_address(address)
+        self.authkey = _authkey(authkey)
+        self.worker_id = worker_id or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.chunksize = 1
+        self.local = td.local()
+        self.closed = td.Event()
+        self.results = _Outbox(self, 'results')
+        self.failed = _Outbox(self, 'failed')
+        self.num_failed = _Counter(self)
+
+    def connect(self, timeout=30):
+        """Say hello to the broker, retrying until it is up.
+        :param timeout: optional (float) the maximum seconds to wait for the broker.
+        :rtype (dict): the config of the run, see Broker.
+        """
+        deadline = time.time() + timeout
+        while True:
+            reply = self._request(('hello', self.worker_id))
+            if reply is not None:
+                config = reply[1]
+                self.chunksize = config['chunksize']
+                return config
+            if time.time() > deadline:
+                raise ConnectionError("Could not connect to the broker at %s:%d." % self.address)
+            time.sleep(1)
+
+    def get_chunk(self):
+        """Lease a chunk of Task instances from the broker, waiting while the
+        queue of the broker is empty but not finished.
+        :rtype (list): Task instances, empty if there are no tasks left or the
+            broker is gone.
+        """
+        while not self.closed.is_set():
+            reply = self._request(('get', self.worker_id, self.chunksize))
+            if reply is None or reply[0] == 'done':
+                self.closed.set()
+                break
+            if reply[0] == 'tasks':
+                self.local.lease = reply[1]
+                self.local.ack = {'results': [], 'failed': [], 'retries': [], 'follow': [],
+                                  'num_done': 0, 'num_failed': 0}
+                return reply[2]
+            time.sleep(reply[1])
+        return []
+
+    def get(self):
+        chunk = self.get_chunk()
+        return chunk[0] if chunk else None
+
+    def put(self, task):
+        self.put_many([task])
+
+    def put_many(self, tasks):
+        """Add follow-up tasks into the acknowledgement of the current lease."""
+        self._ack()['follow'].extend(tasks)
+
+    def requeue(self, task, delay=0):
+        """Add a task to retry after delay seconds into the acknowledgement of the current lease."""
+        self._ack()['retries'].append((task, delay))
+
+    def task_done(self, n=1):
+        self._ack()['num_done'] += n
+
+    def release(self, task):
+        """Tasks are released by the broker once their lease is acknowledged."""
+
+    def chunk_size(self):
+        return self.chunksize
+
+    def record_time(self, seconds, num_tasks):
+        """Acknowledge the lease of the current thread, as the chunk is done."""
+        lease = getattr(self.local, 'lease', None)
+        if lease is None:
+            return
+        ack, self.local.lease, self.local.ack = self.local.ack, None, None
+        self._request(('ack', self.worker_id, lease, ack))
+
+    def heartbeat(self):
+        """Tell the broker that the worker is alive.
+        :rtype (bool): False if the broker is gone.
+        """
+        return self._request(('heartbeat', self.worker_id)) is not None
+
+    def _ack(self):
+        return self.local.ack
+
+    def _request(self, msg):
+        """Send a message to the broker and return its reply, or None if the broker is gone."""
+        try:
+            conn = getattr(self.local, 'conn', None)
+            if conn is None:
+                conn = self.local.conn = Client(self.address, authkey=self.authkey)
+            conn.send(msg)
+            return conn.recv()
+        except (EOFError, OSError):
+            self.local.conn = None
+            return None
+
+
+def run_worker(address, authkey=None, num_threads=10, timeout=30):
+    """Run tasks leased from a broker by num_threads ThreadWorkers, until the
+    run of the broker is done.
+    Task functions and task classes are pickled by reference, so they have to
+    be importable by the worker, see the --main option of `qspider worker`.
+
+    :param address: (tuple or str) the (host, port) or 'host:port' of the broker.
+    :param authkey: optional (bytes, str or None) the authkey of the broker.
+        Default is the QSPIDER_AUTHKEY environment variable.
+    :param num_threads: optional (int) the number of worker threads. Default is 10.
+    :param timeout: optional (float) the maximum seconds to wait for the broker
+        to be up. Default is 30.
+    """
+    task_queue = RemoteTaskQueue(address, authkey)
+    config = task_queue.connect(timeout)
+    session_pool = config['session_pool']
+    res_queue = task_queue.results if config['results'] else None
+    workers = []
+    for i in range(num_threads):
+        worker = ThreadWorker(task_queue, res_queue, task_queue.failed, session_pool=session_pool,
+                              retry=config['retry'], frontier=config['frontier'])
+        worker.start()
+        workers.append(worker)
+    stopped = td.Event()
+
+    def beat():
+        # A failed heartbeat, e.g. while reconnecting, is sent again at the next
+        # beat, or the broker would put back the leases the threads are running.
+        while not stopped.wait(config['heartbeat']) and not task_queue.closed.is_set():
+            task_queue.heartbeat()
+    heart = Thread(target=beat, daemon=True)
+    heart.start()
+    for worker in workers:
+        worker.join()
+    stopped.set()
+    if session_pool is not None:
+        session_pool.close()
+
+
+class DistributedManager(BaseManager):
+    """A distributed manager class which serves the task queue to remote
+    workers through a Broker, so that one source is run by worker processes
+    on multiple hosts. Each of them is started by
+        qspider worker --connect host:port --authkey KEY
+    and runs tasks by a pool of threads. The source is read, deduplicated and
+    checkpointed by the manager, results are yielded by run and run_iter as
+    usual, and the progress bar counts the tasks of all the workers.
+    Task functions and task classes are pickled by reference, so they have to
+    be importable by the workers: define them in a module, or pass the script
+    of the manager by --main.
+    Metrics, traces and profiles are not collected from remote workers.
+
+    Example:
+        >>> manager = DistributedManager(urls, fetch, has_result=True, address=('0.0.0.0', 7070))
+        >>> pages = manager.run()
+
+    Attributes
+        :param source: (iterable) the sources that tasks in the task
+            queue need for running tasks.
+
+        :param task_cls: (subclass of Task or any class with a run method,
+            function, method)
+            task class to instantiate tasks or task function/ task method.
+
+        :param has_result: optional (bool) whether there are returned values from
+            the task.run method. Default is False.
+
+        :param num_workers: optional (int or 'auto') the number of worker processes
+            started on this host, next to the remote ones. 'auto' starts one per
+            cpu core. Default is 0.
+
+        :param add_failed: optional (bool) whether add failed tasks back into the
+            task queue, see BaseManager.
+
+        :param address: optional (tuple or str) the (host, port) or 'host:port' the
+            broker listens on, e.g. ('0.0.0.0', 7070) to serve remote hosts. Port 0
+            picks a free port. Default is ('127.0.0.1', 0).
+
+        :param authkey: optional (bytes, str or None) the key workers authenticate
+            with. Default is the QSPIDER_AUTHKEY environment variable, or a random
+            key printed with the command to start workers.
+
+        :param chunksize: optional (int) the maximum number of tasks a worker thread
+            leases at a time. Default is 10.
+
+        :param num_threads: optional (int) the number of threads of the local worker
+            processes. Default is 10.
+
+        :param lease_timeout: optional (float) seconds without a heartbeat after which
+            the tasks leased by a worker are run again by others. Default is 30.
+
+        :param task_queue_cls: optional (ThreadTaskQueue or its subclass) task queue
+            class of the broker, e.g. a PriorityTaskQueue. Default is ThreadTaskQueue.
+
+        Other keyword arguments (e.g. retry, session, sink, dedup) are passed to BaseManager.
+    """
+
+    def __init__(self, source, task_cls, has_result=False, num_workers=0, add_failed=True,
+                 address=('127.0.0.1', 0), authkey=None, chunksize=10, num_threads=10, lease_timeout=30,
+                 task_queue_cls=ThreadTaskQueue, **kwargs):
+        BaseManager.__init__(self, source,
+                             task_cls,
+                             None,
+                             task_queue_cls,
+                             Queue,
+                             has_result,
+                             num_workers,
+                             add_failed,
+                             **kwargs)
+        self.address = address
+        self.random_authkey = _authkey(authkey) is None
+        self.authkey = _authkey(authkey) or secrets.token_hex(16).encode('ascii')
+        self.chunksize = chunksize
+        self.num_threads = num_threads
+        self.lease_timeout = lease_timeout
+        self.broker = None
+
+    def _start_workers(self):
+        """Start the broker and the local worker processes.
+        :rtype (list): the broker and the local worker processes.
+        """
+        self.broker = Broker(self, self.address, self.authkey, chunksize=self.chunksize,
+                             lease_timeout=self.lease_timeout)
+        self.broker.start()
+        host, port = self.broker.address
+        if host in ('0.0.0.0', ''):
+            host = socket.gethostname()
+        command = "qspider worker --connect %s:%d" % (host, port)
+        if self.random_authkey:
+            command += " --authkey %s" % self.authkey.decode('ascii')
+        print("%s Broker is listening on %s:%d, start workers by: %s" % (INFO, host, port, command))
+        num_local = (os.cpu_count() or 1) if self.num_workers == 'auto' else self.num_workers
+        workers = [self.broker]
+        for i in range(num_local):
+            worker = mp.Process(target=run_worker, args=(self.broker.connect_address, self.authkey),
+                                kwargs={'num_threads': self.num_threads}, daemon=True)
+            worker.start()
+            workers.append(worker)
+        return workers
+
+    def _get_num_workers(self):
+        """Workers connect to the broker, so none is started by default."""
+        return 0
+
+    def _iter_results(self, *args, **kwargs):
+        try:
+            yield from BaseManager._iter_results(self, *args, **kwargs)
+        finally:
+            if self.broker is not None:
+                self.broker.close()
+
+
+# Command line tool
+def main(argv=None):
+    """The qspider command line tool."""
+    parser = argparse.ArgumentParser('qspider', description="QSpider command line tool")
+    commands = parser.add_subparsers(dest='command')
+    worker = commands.add_parser('worker', help="Run tasks leased from the broker of a DistributedManager")
+    worker.add_argument('--connect', required=True, metavar='HOST:PORT', help="The address of the broker")
+    worker.add_argument('--authkey', default=None,
+                        help="The authkey of the broker. Default is the QSPIDER_AUTHKEY environment variable")
+    worker.add_argument('-t', '--threads', type=int, default=10, help="Number of threads of each process")
+    worker.add_argument('-p', '--processes', type=int, default=1, help="Number of worker processes")
+    worker.add_argument('--main', metavar='PATH',
+                        help="The script of the manager, if tasks are defined in it")
+    worker.add_argument('--timeout', type=float, default=30, help="Seconds to wait for the broker to be up")
+    args = parser.parse_args(argv)
+    if args.command != 'worker':
+        parser.print_help()
+        return
+
+    sys.path.insert(0, os.getcwd())
+    if args.main:
+        # Tasks defined in the script of the manager are pickled as __main__ members.
+        import_main_path(args.main)
+    if args.processes == 1:
+        run_worker(args.connect, args.authkey, args.threads, args.timeout)
+        return
+    processes = [mp.Process(target=run_worker, args=(args.connect, args.authkey, args.threads, args.timeout))
+                 for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+import json
+import time
+import shutil
+import logging
+import threading as td
+import multiprocessing as mp
+from queue import Empty
+from threading import Thread
+from collections import deque
+
+from .utils import ERROR
+
+
+logger = logging.getLogger(__name__)
+term_width, _ = shutil.get_terminal_size()
+
+
+class ErrorAggregator(object):
+    """An aggregator of the errors of tasks, which takes logging off the hot path
+    of workers. Workers only append an event per error to a queue, and a
+    background thread groups the errors by exception type and message (with
+    numbers masked, so that 'timeout after 3s' and 'timeout after 5s' are
+    grouped together), and logs a summary with counts and samples every
+    interval seconds.
+    Every error is still logged at the DEBUG level of the qspider.errors
+    logger, and written into a failure file as a JSON line if path is given.
+
+    Attributes
+        :param interval: optional (float) seconds between summaries. Default is 5.
+        :param max_samples: optional (int) the number of sample tasks shown for
+            each group of errors. Default is 3.
+        :param path: optional (str or None) the path of a file to append every error
+            into as a JSON line. Default is None.
+    """
+
+    max_description = 200
+
+    def __init__(self, interval=5.0, max_samples=3, path=None):
+        self.interval = interval
+        self.max_samples = max_samples
+        self.path = path
+        self.shared = False
+        self.events = deque()
+        self.file = None
+        self.thread = None
+        self.stopped = td.Event()
+        self.last_flush = time.time()
+
+    def start(self, shared=False):
+        """Start the thread summarizing errors.
+        :param shared: optional (bool) whether errors are reported by worker processes.
+        """
+        self.shared = shared
+        self.events = mp.Queue() if shared else deque()
+        if self.path is not None:
+            self.file = open(self.path, 'a')
+        self.stopped.clear()
+        self.last_flush = time.time()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the thread and summarize the errors reported since the last summary."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def report(self, task, error, attempts, delay=None):
+        """Report an error of a task, called by workers.
+        :param task: (Task, dict or any class with a run method) the failed task.
+        :param error: (Exception) the error raised by the task.
+        :param attempts: (int) the number of times the task has been run.
+        :param delay: optional (float or None) seconds to retry the task in, None if
+            the task is added into the failed queue.
+        """
+        if type(task) == dict and 'source' in task:
+            description = "Task{source=%s}" % (task['source'],)
+        else:
+            description = str(task)
+        event = (time.time(), description[:self.max_description], attempts, delay,
+                 type(error).__name__, str(error)[:self.max_description])
+        if self.shared:
+            self.events.put(event)
+        else:
+            self.events.append(event)
+
+    def flush(self):
+        """Summarize the errors reported since the last summary."""
+        events = self._drain()
+        now = time.time()
+        seconds, self.last_flush = now - self.last_flush, now
+        if not events:
+            return
+        debug = logger.isEnabledFor(logging.DEBUG)
+        groups = {}
+        # Messages repeat a lot, so mask the numbers of each message once.
+        keys = {}
+        num_retried = 0
+        for event in events:
+            at, description, attempts, delay, error_type, message = event
+            if delay is not None:
+                num_retried += 1
+            key = keys.get((error_type, message))
+            if key is None:
+                key = keys[(error_type, message)] = (error_type, re.sub(r'\d+', 'N', message))
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, []]
+            group[0] += 1
+            if len(group[1]) < self.max_samples:
+                group[1].append(description)
+            if debug:
+                if delay is None:
+                    logger.debug("%s Task went wrong %d times and added it into failed queue: %s. Error message: %s" % (
+                        ERROR, attempts, description, message))
+                else:
+                    logger.debug("%s Task went wrong and will be retried in %.2fs: %s. Error message: %s" % (
+                        ERROR, delay, description, message))
+            if self.file is not None:
+                self.file.write(json.dumps({'time': at, 'task': description, 'attempts': attempts,
+                                            'retry_in': delay, 'error': error_type, 'message': message}) + '\n')
+        if self.file is not None:
+            self.file.flush()
+        msg = "%s %d task errors in the last %.1fs, %d will be retried, %d added into failed queue:" % (
+            ERROR, len(events), seconds, num_retried, len(events) - num_retried)
+        lines = ["\r%s%s" % (msg, ' ' * (term_width - len(msg)))]
+        for (error_type, message), (count, samples) in sorted(groups.items(), key=lambda item: -item[1][0]):
+            lines.append("    %d x %s: %s, e.g. %s" % (count, error_type, message, ', '.join(samples)))
+        logger.error('\n'.join(lines))
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def _drain(self):
+        """Take all the events reported so far.
+        :rtype (list): the events.
+        """
+        events = []
+        if not self.shared:
+            while self.events:
+                events.append(self.events.popleft())
+            return events
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except Empty:
+                return events
+
+    def __getstate__(self):
+        # Worker processes only report events into the shared queue.
+        state = self.__dict__.copy()
+        state['file'] = None
+        state['thread'] = None
+        del state['stopped']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.stopped = td.Event()
@@ -36,20 +36,19 @@ logging.basicConfig(level=logging.INFO)
 # Class examples
 def test_of_thread():
     """Example of multi-threading"""
-    import requests
-
     class ThreadTask(Task):
         def __init__(self, task_source):
             Task.__init__(self, task_source)
 
         def run(self):
-            res = requests.get(self.task_source, timeout=5)
+            # self.session is the pooled session of the worker
+            res = self.session.get(self.task_source, timeout=5)
             if random.randint(0, 100) < 5:
                 raise Exception("Random exception")
             return res.status_code
 
     source = ['http://www.baidu.com' for _ in range(500)]
-    tm = ThreadManager(source, ThreadTask, has_result=True, add_failed=True)
+    tm = ThreadManager(source, ThreadTask, has_result=True, add_failed=True, session=True)
     results = tm.run(silent=False)
     print(len(results))
 
@@ -96,9 +95,9 @@ class MyTask(Task):
 
 
 # Task function test
-@concurrent.thread_func(get_source(), has_result=True)
-def my_task(task_source):
-    res = requests.get(task_source, timeout=5)
+@concurrent.thread_func(get_source(), has_result=True, session=True)
+def my_task(task_source, session):
+    res = session.get(task_source, timeout=5)
     return res.status_code
 
 
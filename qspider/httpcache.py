@@ -0,0 +1,319 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# Headers which describe the body as it was sent, not as it is stored.
+_TRANSFER_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'connection')
+# Headers a 304 response updates the stored response with.
+_UPDATED_HEADERS = ('etag', 'last-modified', 'cache-control', 'expires', 'date', 'age')
+
+
+def _cache_control(headers):
+    """Parse the Cache-Control header into a dict of lowercase directives."""
+    directives = {}
+    for part in headers.get('Cache-Control', '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+
+def _expires(headers, now):
+    """Return the time a response stops being fresh, 0 if it has to be revalidated."""
+    directives = _cache_control(headers)
+    if 'no-cache' in directives:
+        return 0
+    try:
+        if 's-maxage' in directives or 'max-age' in directives:
+            max_age = int(directives.get('s-maxage', directives.get('max-age')))
+            return now + max_age - int(headers.get('Age', 0))
+        if 'Expires' in headers:
+            return parsedate_to_datetime(headers['Expires']).timestamp()
+    except (TypeError, ValueError):
+        pass
+    return 0
+
+
+class HTTPCache(object):
+    """A cache of HTTP responses for repeated crawls, shared by the sessions of
+    a SessionPool (see SessionPool.cache) across threads and processes.
+    Bodies are stored in files named by their sha256, so a body is written
+    once however many urls return it, and is never changed once written.
+    Each url has an entry file with the validators and freshness of its last
+    response: ETag, Last-Modified and Cache-Control or Expires. Entries are
+    written into temporary files and renamed, so readers in other processes
+    see either the old or the new entry, and the max_entries most recently
+    used ones are kept in an in-memory LRU index of each process.
+    Requests of a cached url get If-None-Match and If-Modified-Since headers,
+    and a 304 response is answered with the cached body. Responses still fresh
+    are served without any request, unless revalidate is True.
+    Only successful GET responses are cached, except the ones with
+    Cache-Control: no-store, a Vary header other than Accept-Encoding, or
+    neither validators nor freshness. Bodies are stored decoded.
+
+    Attributes
+        :param path: (str) the directory of the cache, created if it does not exist.
+        :param max_entries: optional (int) the maximum number of entries kept in
+            memory by each process. Default is 100000.
+        :param revalidate: optional (bool) whether to send a conditional request
+            even if the cached response is still fresh. Default is False.
+
+    Example
+        ThreadManager(urls, fetch, session=SessionPool(cache=HTTPCache('http-cache')))
+    """
+
+    def __init__(self, path, max_entries=100000, revalidate=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.revalidate = revalidate
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(path, 'entries'), exist_ok=True)
+        os.makedirs(os.path.join(path, 'bodies'), exist_ok=True)
+
+    def get(self, url):
+        """Return the entry of a url, or None if it is not cached.
+        :param url: (str) the url.
+        :rtype (dict or None): the entry.
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                self.entries.move_to_end(url)
+                return entry
+        try:
+            with open(self._entry_path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('url') != url:
+            return None
+        self._remember(url, entry)
+        return entry
+
+    def store(self, response):
+        """Store a response of a GET request, or drop the entry of its url if
+        the page is gone or its new response could not be cached.
+        :param response: (requests.Response) a response whose body is read.
+        :rtype (dict or None): the entry, None if the response is not cached.
+        """
+        url = response.request.url
+        headers = response.headers
+        if response.status_code != 200:
+            if response.status_code in (404, 410):
+                self.discard(url)
+            return None
+        now = time.time()
+        vary = headers.get('Vary', '').lower().replace(' ', '')
+        expires = _expires(headers, now)
+        if ('no-store' in _cache_control(headers) or vary not in ('', 'accept-encoding')
+                or not (headers.get('ETag') or headers.get('Last-Modified') or expires > now)):
+            self.discard(url)
+            return None
+        body = response.content
+        digest = hashlib.sha256(body).hexdigest()
+        body_path = self._body_path(digest)
+        if not os.path.exists(body_path):
+            self._write(body_path, body)
+        entry = {'url': url, 'digest': digest, 'expires': expires,
+                 'headers': {name: value for name, value in headers.items()
+                             if name.lower() not in _TRANSFER_HEADERS}}
+        self._save(url, entry)
+        return entry
+
+    def refresh(self, entry, response):
+        """Update an entry with the headers of a 304 response revalidating it.
+        :param entry: (dict) the entry revalidated.
+        :param response: (requests.Response) the 304 response.
+        :rtype (dict): the updated entry.
+        """
+        headers = CaseInsensitiveDict(entry['headers'])
+        for name in _UPDATED_HEADERS:
+            if name in response.headers:
+                headers[name] = response.headers[name]
+        entry = dict(entry, headers=dict(headers), expires=_expires(headers, time.time()))
+        self._save(entry['url'], entry)
+        return entry
+
+    def discard(self, url):
+        """Forget the cached response of a url.
+        :param url: (str) the url.
+        """
+        with self.lock:
+            self.entries.pop(url, None)
+        try:
+            os.remove(self._entry_path(url))
+        except OSError:
+            pass
+
+    def is_fresh(self, entry):
+        """Return if a cached response could be served without a request."""
+        return not self.revalidate and entry['expires'] > time.time()
+
+    def read_body(self, entry):
+        """Return the cached body of an entry, or None if it is gone."""
+        try:
+            with open(self._body_path(entry['digest']), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def prune(self, min_age=3600):
+        """Remove the bodies no entry refers to, e.g. old versions of pages.
+        :param min_age: optional (float) seconds a body is kept at least, so that
+            bodies being stored with their entries are not removed. Default is 3600.
+        :rtype (int): the number of bodies removed.
+        """
+        digests = set()
+        for directory, _, names in os.walk(os.path.join(self.path, 'entries')):
+            for name in names:
+                try:
+                    with open(os.path.join(directory, name)) as f:
+                        digests.add(json.load(f)['digest'])
+                except (OSError, ValueError, KeyError):
+                    pass
+        num_removed = 0
+        deadline = time.time() - min_age
+        for directory, _, names in os.walk(os.path.join(self.path, 'bodies')):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if name not in digests and os.path.getmtime(path) < deadline:
+                        os.remove(path)
+                        num_removed += 1
+                except OSError:
+                    pass
+        return num_removed
+
+    def _remember(self, url, entry):
+        with self.lock:
+            self.entries[url] = entry
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _save(self, url, entry):
+        self._write(self._entry_path(url), json.dumps(entry).encode('utf-8'))
+        self._remember(url, entry)
+
+    @staticmethod
+    def _write(path, data):
+        """Write a file atomically, safe with other threads and processes writing it."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _entry_path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, 'entries', key[:2], key)
+
+    def _body_path(self, digest):
+        return os.path.join(self.path, 'bodies', digest[:2], digest)
+
+    def __getstate__(self):
+        # The index and the lock stay in the process which created them.
+        state = self.__dict__.copy()
+        state['entries'] = OrderedDict()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+class CachingAdapter(HTTPAdapter):
+    """A transport adapter which answers GET requests from an HTTPCache.
+    Requests with a Range, an Authorization or their own conditional headers
+    are sent as they are. Streamed responses are not stored, but a streamed
+    request could still be answered from the cache.
+    Responses served from the cache have from_cache set to True.
+
+    Attributes
+        :param cache: (HTTPCache) the cache.
+        :param kwargs: optional the arguments of requests.adapters.HTTPAdapter.
+    """
+
+    bypass_headers = ('Range', 'Authorization', 'If-None-Match', 'If-Modified-Since')
+
+    def __init__(self, cache, **kwargs):
+        self.cache = cache
+        HTTPAdapter.__init__(self, **kwargs)
+
+    def send(self, request, stream=False, **kwargs):
+        if request.method != 'GET' or any(name in request.headers for name in self.bypass_headers):
+            response = HTTPAdapter.send(self, request, stream=stream, **kwargs)
+            if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.ok:
+                self.cache.discard(request.url)
+            response.from_cache = False
+            return response
+        cache = self.cache
+        entry = cache.get(request.url)
+        body = None
+        if entry is not None:
+            body = cache.read_body(entry)
+        if body is not None:
+            if cache.is_fresh(entry):
+                return self._cached_response(request, entry, body)
+            headers = CaseInsensitiveDict(entry['headers'])
+            request = request.copy()
+            if 'ETag' in headers:
+                request.headers['If-None-Match'] = headers['ETag']
+            if 'Last-Modified' in headers:
+                request.headers['If-Modified-Since'] = headers['Last-Modified']
+        response = HTTPAdapter.send(self, request, stream=stream, **kwargs)
+        if response.status_code == 304 and body is not None:
+            response.close()
+            return self._cached_response(request, cache.refresh(entry, response), body)
+        if not stream:
+            cache.store(response)
+        response.from_cache = False
+        return response
+
+    def _cached_response(self, request, entry, body):
+        response = Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = body
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.from_cache = True
+        return response
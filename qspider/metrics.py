@@ -0,0 +1,372 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import math
+import time
+import logging
+import threading as td
+import multiprocessing as mp
+from threading import Thread
+
+from .utils import ERROR
+
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """A histogram of durations with log-linear buckets, like HdrHistogram.
+    Each power of two of microseconds is split into sub_buckets buckets, so
+    that recording is O(1) and percentiles are within 1 / sub_buckets of the
+    recorded values, from 1us up to about 19 hours.
+
+    Attributes
+        :param counts: optional (list or None) the counts of the buckets.
+        :param total: optional (float) the sum of the recorded values.
+        :param max_value: optional (float) the maximum recorded value.
+    """
+
+    sub_buckets = 16
+    num_buckets = 37 * sub_buckets
+
+    def __init__(self, counts=None, total=0.0, max_value=0.0):
+        self.counts = list(counts) if counts is not None else [0] * self.num_buckets
+        self.total = total
+        self.max_value = max_value
+
+    @classmethod
+    def bucket(cls, seconds):
+        """Return the index of the bucket of a duration in seconds."""
+        mantissa, exponent = math.frexp(seconds * 1e6)
+        if exponent < 1:
+            return 0
+        index = (exponent - 1) * cls.sub_buckets + int((mantissa - 0.5) * 2 * cls.sub_buckets)
+        return min(index, cls.num_buckets - 1)
+
+    @classmethod
+    def value(cls, index):
+        """Return the middle of a bucket in seconds."""
+        exponent, sub = divmod(index, cls.sub_buckets)
+        return (1 << exponent) * (1 + (sub + 0.5) / cls.sub_buckets) / 1e6
+
+    def record(self, seconds):
+        """Record a duration in seconds."""
+        self.counts[self.bucket(seconds)] += 1
+        self.total += seconds
+        if seconds > self.max_value:
+            self.max_value = seconds
+
+    def merge(self, other):
+        """Add the counts of another histogram into this one."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.max_value = max(self.max_value, other.max_value)
+        return self
+
+    @property
+    def count(self):
+        return int(sum(self.counts))
+
+    @property
+    def mean(self):
+        count = self.count
+        return self.total / count if count else 0.0
+
+    def percentile(self, p):
+        """Return the p-th percentile (0-100) of the recorded durations in seconds."""
+        count = self.count
+        if not count:
+            return 0.0
+        rank = max(1, math.ceil(count * p / 100))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.value(index), self.max_value)
+        return self.max_value
+
+    def summary(self):
+        """Return the count, mean, p50, p90, p99 and max of the durations.
+        :rtype (dict): the summary.
+        """
+        return {'count': self.count, 'mean': self.mean, 'p50': self.percentile(50),
+                'p90': self.percentile(90), 'p99': self.percentile(99), 'max': self.max_value}
+
+
+class WorkerMetrics(object):
+    """The metrics of a worker: run time and queue wait time of its tasks,
+    errors by exception type, and the time it was busy or idle.
+    A WorkerMetrics is written only by its worker, so it needs no lock. The
+    metrics of a worker process are kept in shared memory, so that the manager
+    reads them while the worker is running.
+
+    Attributes
+        :param shared: optional (bool) whether to keep the metrics in shared
+            memory for a worker process. Default is False.
+    """
+
+    max_errors = 32
+    name_size = 64
+    # Offsets of the fields in data.
+    TASKS, FAILED, STARTED, ENDED, IDLE, RUN_SUM, RUN_MAX, WAIT_SUM, WAIT_MAX = range(9)
+    ERRORS = 9
+    RUN_HIST = ERRORS + max_errors
+    WAIT_HIST = RUN_HIST + Histogram.num_buckets
+    SIZE = WAIT_HIST + Histogram.num_buckets
+
+    def __init__(self, shared=False):
+        if shared:
+            self.data = mp.RawArray('d', self.SIZE)
+            self.error_names = mp.RawArray('c', self.max_errors * self.name_size)
+        else:
+            self.data = [0.0] * self.SIZE
+            self.error_names = [''] * self.max_errors
+        self.shared = shared
+        # Error slots of exception types, local to the worker.
+        self.error_slots = {}
+
+    def start(self):
+        """Mark that the worker starts running."""
+        self.data[self.STARTED] = time.time()
+        self.data[self.ENDED] = 0
+
+    def stop(self):
+        """Mark that the worker stops running."""
+        self.data[self.ENDED] = time.time()
+
+    def record_idle(self, seconds):
+        """Record the time the worker waited for tasks."""
+        self.data[self.IDLE] += seconds
+
+    def record_task(self, task_meta, start_time, end_time, error=None):
+        """Record the run time of a task, its queue wait time and its error.
+        :param task_meta: (dict) the metadata of the task, with the time it was
+            queued at as 'queued'.
+        :param start_time: (float) the time the task started running at.
+        :param end_time: (float) the time the task was done at.
+        :param error: optional (Exception or None) the error raised by the task.
+        """
+        data = self.data
+        run_time = end_time - start_time
+        data[self.TASKS] += 1
+        data[self.RUN_HIST + Histogram.bucket(run_time)] += 1
+        data[self.RUN_SUM] += run_time
+        if run_time > data[self.RUN_MAX]:
+            data[self.RUN_MAX] = run_time
+        queued = task_meta.get('queued')
+        if queued is not None:
+            wait_time = max(start_time - queued, 0.0)
+            data[self.WAIT_HIST + Histogram.bucket(wait_time)] += 1
+            data[self.WAIT_SUM] += wait_time
+            if wait_time > data[self.WAIT_MAX]:
+                data[self.WAIT_MAX] = wait_time
+        if error is not None:
+            data[self.FAILED] += 1
+            data[self.ERRORS + self._error_slot(type(error).__name__)] += 1
+
+    def snapshot(self):
+        """Return the metrics recorded so far.
+        :rtype (dict): tasks, failed, busy and idle seconds, run_time and wait_time
+            Histograms and errors by exception type.
+        """
+        data = self.data[:]
+        started, ended, idle = data[self.STARTED], data[self.ENDED], data[self.IDLE]
+        elapsed = ((ended or time.time()) - started) if started else 0.0
+        errors = {}
+        for slot in range(self.max_errors):
+            if data[self.ERRORS + slot]:
+                name = self._error_name(slot)
+                errors[name] = errors.get(name, 0) + int(data[self.ERRORS + slot])
+        return {
+            'tasks': int(data[self.TASKS]),
+            'failed': int(data[self.FAILED]),
+            'busy': max(elapsed - idle, 0.0),
+            'idle': idle,
+            'run_time': Histogram(data[self.RUN_HIST:self.WAIT_HIST], data[self.RUN_SUM], data[self.RUN_MAX]),
+            'wait_time': Histogram(data[self.WAIT_HIST:self.SIZE], data[self.WAIT_SUM], data[self.WAIT_MAX]),
+            'errors': errors,
+        }
+
+    def _error_slot(self, name):
+        """Return the slot of an exception type, the last slot for other types
+        once all the slots are taken."""
+        slot = self.error_slots.get(name)
+        if slot is None:
+            slot = min(len(self.error_slots), self.max_errors - 1)
+            if slot < self.max_errors - 1:
+                self.error_slots[name] = slot
+                self._set_error_name(slot, name)
+            else:
+                self._set_error_name(slot, 'Other')
+        return slot
+
+    def _set_error_name(self, slot, name):
+        if not self.shared:
+            self.error_names[slot] = name
+            return
+        name = name.encode('utf-8')[:self.name_size - 1].ljust(self.name_size, b'\0')
+        self.error_names[slot * self.name_size:(slot + 1) * self.name_size] = name
+
+    def _error_name(self, slot):
+        if not self.shared:
+            return self.error_names[slot]
+        name = self.error_names[slot * self.name_size:(slot + 1) * self.name_size]
+        return name.rstrip(b'\0').decode('utf-8', 'replace')
+
+
+class Metrics(object):
+    """The metrics of all the workers of a manager, which are merged into one
+    snapshot by stats.
+    """
+
+    def __init__(self):
+        self.workers = []
+        self.lock = td.Lock()
+
+    def worker(self, shared=False):
+        """Return the metrics of a new worker.
+        :param shared: optional (bool) whether the worker is a process.
+        :rtype (WorkerMetrics): the metrics of the worker.
+        """
+        metrics = WorkerMetrics(shared)
+        with self.lock:
+            self.workers.append(metrics)
+        return metrics
+
+    def stats(self):
+        """Return the merged metrics of all the workers.
+        :rtype (dict): the number of workers, tasks and failed tasks, busy and idle
+            seconds, the utilization of workers, the summaries of run time and queue
+            wait time, and errors by exception type.
+        """
+        with self.lock:
+            workers = list(self.workers)
+        run_time, wait_time = Histogram(), Histogram()
+        stats = {'workers': len(workers), 'tasks': 0, 'failed': 0, 'busy': 0.0, 'idle': 0.0, 'errors': {}}
+        for metrics in workers:
+            snapshot = metrics.snapshot()
+            for key in ('tasks', 'failed', 'busy', 'idle'):
+                stats[key] += snapshot[key]
+            for name, n in snapshot['errors'].items():
+                stats['errors'][name] = stats['errors'].get(name, 0) + n
+            run_time.merge(snapshot['run_time'])
+            wait_time.merge(snapshot['wait_time'])
+        total = stats['busy'] + stats['idle']
+        stats['utilization'] = stats['busy'] / total if total else 0.0
+        stats['run_time'] = run_time.summary()
+        stats['wait_time'] = wait_time.summary()
+        return stats
+
+
+class MetricsExporter(object):
+    """An exporter which writes the stats of a manager into a file by a thread
+    every interval seconds and once the run is done, as a Prometheus textfile
+    (for the textfile collector of node_exporter) or as JSON. The file is
+    replaced atomically, so readers never see a partial file.
+
+    Attributes
+        :param path: (str) the path of the file.
+        :param interval: optional (float) seconds between writes. Default is 10.
+        :param format: optional (str or None) 'prometheus' or 'json'. Default is
+            'prometheus' if path ends with .prom, otherwise 'json'.
+        :param prefix: optional (str) the prefix of Prometheus metric names.
+            Default is 'qspider'.
+    """
+
+    def __init__(self, path, interval=10.0, format=None, prefix='qspider'):
+        self.path = path
+        self.interval = interval
+        self.format = format or ('prometheus' if path.endswith('.prom') else 'json')
+        self.prefix = prefix
+        self.manager = None
+        self.thread = None
+        self.stopped = td.Event()
+
+    def start(self, manager):
+        """Start writing the stats of a manager periodically."""
+        self.manager = manager
+        self.stopped.clear()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop writing periodically and write the final stats."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            self.write()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        """Write the current stats of the manager into the file."""
+        try:
+            stats = self.manager.stats()
+            if self.format == 'prometheus':
+                content = self.format_prometheus(stats)
+            else:
+                content = json.dumps(stats, indent=2, sort_keys=True)
+            tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error("%s Failed to write metrics into %s. Error message: %s" % (ERROR, self.path, e))
+
+    def format_prometheus(self, stats):
+        """Format stats in the Prometheus text exposition format.
+        :rtype (str): the text.
+        """
+        p = self.prefix
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP %s_%s %s' % (p, name, help_text))
+            lines.append('# TYPE %s_%s %s' % (p, name, kind))
+            for labels, value in samples:
+                lines.append('%s_%s%s %s' % (p, name, labels, repr(float(value))))
+
+        metric('tasks_total', 'counter', 'Tasks run, including retried attempts.', [('', stats['tasks'])])
+        metric('task_failures_total', 'counter', 'Tasks which raised an exception, by exception type.',
+               [('{type="%s"}' % name, n) for name, n in sorted(stats['errors'].items())] or [('', 0)])
+        for name, help_text in (('run_time', 'Seconds spent on running tasks.'),
+                                ('wait_time', 'Seconds tasks waited in the task queue.')):
+            summary = stats[name]
+            samples = [('{quantile="%s"}' % q, summary[key]) for q, key in (('0.5', 'p50'), ('0.9', 'p90'),
+                                                                           ('0.99', 'p99'))]
+            metric('task_%s_seconds' % name, 'summary', help_text, samples)
+            lines.append('%s_task_%s_seconds_sum %r' % (p, name, float(summary['mean'] * summary['count'])))
+            lines.append('%s_task_%s_seconds_count %d' % (p, name, summary['count']))
+        metric('worker_busy_seconds_total', 'counter', 'Seconds workers spent on tasks.', [('', stats['busy'])])
+        metric('worker_idle_seconds_total', 'counter', 'Seconds workers waited for tasks.', [('', stats['idle'])])
+        metric('worker_utilization', 'gauge', 'Busy time over the running time of workers.',
+               [('', stats['utilization'])])
+        metric('workers', 'gauge', 'Workers started.', [('', stats['workers'])])
+        for key in ('queue_size', 'tasks_queued', 'tasks_done'):
+            if key in stats:
+                metric(key, 'gauge', key.replace('_', ' ').capitalize() + '.', [('', stats[key])])
+        return '\n'.join(lines) + '\n'
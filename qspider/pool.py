@@ -0,0 +1,316 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import time
+import inspect
+import functools
+import itertools
+import threading
+import multiprocessing as mp
+from queue import Empty
+
+from .core import TaskFeeder
+from .core import ProcessTaskQueue
+from .core import ProcessWorker
+from .core import HybridWorker
+from .core import task_meta
+from .utils import Thread
+from .retry import RetryPolicy
+from .sessions import SessionPool
+from .transport import SharedMemoryTransport
+
+
+class Batch(object):
+    """A batch of tasks submitted to a WorkerPool, whose results could be
+    waited for like a future.
+
+    Attributes
+        :param batch_id: (int) the id of the batch in the pool.
+        :param on_done: optional (callable or None) function called with the
+            batch once all its tasks are done.
+    """
+
+    def __init__(self, batch_id, on_done=None):
+        self.batch_id = batch_id
+        self.on_done = on_done
+        self.results = {}
+        self.failed_tasks = []
+        self.num_tasks = None
+        self.num_done = 0
+        self.error = None
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+
+    def result(self, timeout=None):
+        """Wait for all the tasks of the batch to be done.
+        :param timeout: optional (float or None) the maximum seconds to wait.
+        :rtype (list): results returned by the succeeded tasks, in the order of
+            the source. Failed tasks are kept in batch.failed_tasks. The error is
+            raised instead if the results of the batch could not be routed to it.
+        """
+        if not self.finished.wait(timeout):
+            raise TimeoutError("Batch %d is not done in %ss." % (self.batch_id, timeout))
+        if self.error is not None:
+            raise self.error
+        return [self.results[index] for index in sorted(self.results)]
+
+    def done(self):
+        """Return if all the tasks of the batch are done."""
+        return self.finished.is_set()
+
+    def _add(self, index, ok, res):
+        with self.lock:
+            self.num_done += 1
+            if ok:
+                self.results[index] = res
+            self._check()
+
+    def _set_num_tasks(self, num_tasks):
+        with self.lock:
+            self.num_tasks = num_tasks
+            self._check()
+
+    def _fail(self, error):
+        with self.lock:
+            if self.finished.is_set():
+                return
+            self.error = error
+            self.finished.set()
+            if self.on_done is not None:
+                self.on_done(self)
+
+    def _check(self):
+        if self.num_tasks is not None and self.num_done >= self.num_tasks and not self.finished.is_set():
+            self.finished.set()
+            if self.on_done is not None:
+                self.on_done(self)
+
+    def __repr__(self):
+        return "Batch{id=%d, done=%d, total=%s}" % (self.batch_id, self.num_done, self.num_tasks)
+
+
+class BatchFeeder(TaskFeeder):
+    """A feeder to pull the source items of a batch into the task queue of a
+    WorkerPool, which stays open for the next batches.
+
+    Attributes
+        :param task_queue: (ProcessTaskQueue) the task queue of the pool.
+        :param source: (iterable) the sources of the tasks of the batch.
+        :param make_task: (callable) function to turn a source item and its index
+            into a task.
+        :param batch: (Batch) the batch the tasks belong to.
+    """
+
+    def __init__(self, task_queue, source, make_task, batch):
+        TaskFeeder.__init__(self, task_queue, source, make_task)
+        self.batch = batch
+
+    def run(self):
+        while not self.stopped.is_set() and not self.task_queue.closed.is_set():
+            if not self.feed():
+                time.sleep(self.poll_interval)
+        self.batch._set_num_tasks(self.next_index)
+
+    def feed(self):
+        """Read the next source items into the task queue, without closing it.
+        :rtype (int): number of tasks put into the task queue.
+        """
+        max_items = max(self.batch_size, self.task_queue.chunk_size())
+        tasks = [self.make_task(src_item, index) for index, src_item in self.take(max_items)]
+        if tasks:
+            self.task_queue.put_many(tasks)
+        return len(tasks)
+
+
+class WorkerPool(object):
+    """A pool of long-lived worker processes, which runs batches of tasks
+    submitted again and again, e.g. by a service, without starting workers for
+    each batch. Workers keep their imports, HTTP sessions and caches warm
+    across batches, and no Manager server process is started.
+    Batches share the workers, and could be submitted from multiple threads.
+    Task functions and task classes are pickled with the tasks, so they have to
+    be defined at the top level of a module.
+
+    Example:
+        >>> with WorkerPool(num_workers=4, num_threads=10, session=True) as pool:
+        ...     for urls in batches:
+        ...         pages = pool.run(urls, fetch)
+
+    Attributes
+        :param num_workers: optional (int or None) the number of worker processes.
+            Default is the number of cpu cores.
+        :param num_threads: optional (int) the number of threads in each worker
+            process, see HybridManager. Default is 1.
+        :param add_failed: optional (bool) whether to retry failed tasks with the
+            default RetryPolicy. Default is True.
+        :param retry: optional (RetryPolicy or None) the retry policy of failed
+            tasks, overriding add_failed. Default is None.
+        :param session: optional (bool or SessionPool) whether to give each worker
+            thread a pooled requests.Session, kept across batches. Default is False.
+        :param shared_memory: optional (bool or SharedMemoryTransport) whether to
+            pass large bytes-like results through shared memory. Default is False.
+        :param chunksize: optional (int or 'auto') the number of tasks a worker
+            gets at a time. Default is 1.
+        :param queue_size: optional (int) the maximum number of pending tasks of
+            all the batches. Default is 10000.
+    """
+
+    poll_interval = 0.05
+
+    def __init__(self, num_workers=None, num_threads=1, add_failed=True, retry=None, session=False,
+                 shared_memory=False, chunksize=1, queue_size=10000):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.num_threads = num_threads
+        if retry is None:
+            retry = RetryPolicy() if add_failed else RetryPolicy(max_attempts=1)
+        self.retry = retry
+        self.session_pool = SessionPool() if session is True else (session or None)
+        self.transport = SharedMemoryTransport() if shared_memory is True else (shared_memory or None)
+        self.task_queue = ProcessTaskQueue(maxsize=queue_size, streaming=True, chunksize=chunksize)
+        self.failed_queue = ProcessTaskQueue()
+        self.res_queue = mp.Queue()
+        self.batches = {}
+        self.batch_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.closed = False
+
+        if num_threads > 1:
+            worker_cls = functools.partial(HybridWorker, num_threads=num_threads)
+        else:
+            worker_cls = ProcessWorker
+        self.workers = []
+        for i in range(self.num_workers):
+            worker = worker_cls(self.task_queue, self.res_queue, self.failed_queue,
+                                session_pool=self.session_pool, retry=self.retry,
+                                transport=self.transport)
+            worker.start()
+            self.workers.append(worker)
+        self.dispatcher = Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, source, task_cls):
+        """Submit a batch of tasks, which are read from the source lazily.
+        :param source: (iterable) the sources of the tasks.
+        :param task_cls: (subclass of Task or any class with a run method, function,
+            method) task class to instantiate tasks or task function/ task method.
+        :rtype (Batch): the batch, to wait for its results by batch.result().
+        """
+        if self.closed:
+            raise ValueError("submit to a closed WorkerPool.")
+        with self.lock:
+            batch = Batch(next(self.batch_ids), on_done=self._forget)
+            self.batches[batch.batch_id] = batch
+        make_task = functools.partial(self._make_task, task_cls, batch.batch_id)
+        BatchFeeder(self.task_queue, source, make_task, batch).start()
+        return batch
+
+    def run(self, source, task_cls, timeout=None):
+        """Run a batch of tasks and wait for its results.
+        :rtype (list): results returned by the succeeded tasks, in the order of the source.
+        """
+        return self.submit(source, task_cls).result(timeout)
+
+    def close(self):
+        """Let the workers quit once the submitted tasks are done, and wait for them."""
+        if self.closed:
+            return
+        self.closed = True
+        self.task_queue.close()
+        for worker in self.workers:
+            worker.join()
+        self.dispatcher.join()
+        if self.session_pool is not None:
+            self.session_pool.close()
+
+    def _make_task(self, task_cls, batch_id, src_item, index):
+        """Turn a source item into a task, indexed by the batch id and its index."""
+        if inspect.isfunction(task_cls) or inspect.ismethod(task_cls):
+            return {'caller': task_cls, 'source': src_item, 'meta': {'index': (batch_id, index)}}
+        task = task_cls(src_item)
+        task_meta(task)['index'] = (batch_id, index)
+        return task
+
+    def _dispatch(self):
+        """Route results got from the workers to their batches. A batch fails with
+        the error if one of its results could not be routed, and all the pending
+        batches do if the results could not be got, so that no waiter is blocked."""
+        while True:
+            try:
+                results = self.res_queue.get(timeout=self.poll_interval)
+            except Empty:
+                if self.closed and not any(worker.is_alive() for worker in self.workers) \
+                        and self.res_queue.empty():
+                    break
+                continue
+            except Exception as e:
+                self._fail_pending(e)
+                continue
+            for result in results:
+                batch = None
+                try:
+                    (batch_id, index), ok, res = result
+                    with self.lock:
+                        batch = self.batches.get(batch_id)
+                    if batch is None:
+                        # The batch failed before, its late results are dropped.
+                        if self.transport is not None:
+                            self.transport.discard(res)
+                        continue
+                    if self.transport is not None:
+                        res = self.transport.unpack(res)
+                    if not ok:
+                        # The failed task was put into the failed queue before its result.
+                        self._collect_failed()
+                    batch._add(index, ok, res)
+                except Exception as e:
+                    if batch is None:
+                        self._fail_pending(e)
+                    else:
+                        batch._fail(e)
+
+    def _fail_pending(self, error):
+        """Fail all the batches which are not done with an error."""
+        with self.lock:
+            batches = list(self.batches.values())
+        for batch in batches:
+            batch._fail(error)
+
+    def _forget(self, batch):
+        with self.lock:
+            self.batches.pop(batch.batch_id, None)
+
+    def _collect_failed(self):
+        while self.failed_queue.qsize.value > 0:
+            for task in self.failed_queue.get_chunk():
+                batch_id, index = task_meta(task)['index']
+                with self.lock:
+                    batch = self.batches.get(batch_id)
+                if batch is not None:
+                    batch.failed_tasks.append(task)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return False
@@ -0,0 +1,384 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import time
+import heapq
+import weakref
+import itertools
+import threading as td
+import multiprocessing as mp
+from queue import Empty
+
+from .core import ThreadTaskQueue
+from .core import ProcessTaskQueue
+from .core import _Length
+from .core import task_meta
+from .core import task_source
+from .utils import Thread
+
+
+def task_attribute(task, name):
+    """Return an attribute of a task instance, or the value of name in the
+    metadata of a task, or None if the task has neither."""
+    value = getattr(task, name, None) if type(task) != dict else None
+    if value is None:
+        value = task_meta(task).get(name)
+    return value
+
+
+class _PriorityHeap(object):
+    """Pending tasks ordered by priority, or by deadline first, with the tasks
+    which have a deadline kept in a second heap to promote or drop them.
+    A task taken out of one heap is left in the other one as an empty entry,
+    which is skipped when it is popped. Tasks whose priority or deadline could
+    not be computed are dropped by the next pop, like the expired ones."""
+
+    def __init__(self, priority=None, deadline=None, edf=False, promote=None, drop_expired=True):
+        self.priority = priority
+        self.deadline = deadline
+        self.edf = edf
+        self.promote = promote
+        self.drop_expired = drop_expired
+        self.track_deadlines = drop_expired or promote is not None
+        self.heap = []
+        # Heap of (deadline, sequence, entry) of the tasks which have a deadline.
+        self.deadlines = []
+        self.seq = itertools.count()
+        self.size = 0
+        # Tasks whose priority or deadline function raised.
+        self.rejected = []
+
+    def push(self, task):
+        try:
+            if self.priority is not None:
+                priority = self.priority(task_source(task))
+            else:
+                priority = task_attribute(task, 'priority') or 0
+            if self.deadline is not None:
+                deadline = self.deadline(task_source(task))
+            else:
+                deadline = task_attribute(task, 'deadline')
+        except Exception as e:
+            task_meta(task)['error'] = "Failed to get the priority or deadline of the task: %s: %s" % (
+                type(e).__name__, e)
+            self.rejected.append(task)
+            self.size += 1
+            return
+        seq = next(self.seq)
+        if self.edf:
+            entry = [(float('inf') if deadline is None else deadline, priority), seq, task]
+        else:
+            entry = [priority, seq, task]
+        heapq.heappush(self.heap, entry)
+        if deadline is not None and self.track_deadlines:
+            heapq.heappush(self.deadlines, (deadline, seq, entry))
+        self.size += 1
+
+    def pop(self, now):
+        """Take the next task, after dropping the tasks past their deadline.
+        :rtype (tuple): (task or None if there are no tasks, the dropped tasks).
+        """
+        expired = []
+        if self.rejected:
+            expired, self.rejected = self.rejected, []
+            self.size -= len(expired)
+        deadlines = self.deadlines
+        while deadlines:
+            deadline, seq, entry = deadlines[0]
+            if entry[2] is None:
+                heapq.heappop(deadlines)
+            elif self.drop_expired and deadline <= now:
+                heapq.heappop(deadlines)
+                task = self._take(entry)
+                task_meta(task)['error'] = "Deadline expired before the task started"
+                expired.append(task)
+            elif self.promote is not None and deadline - now <= self.promote:
+                heapq.heappop(deadlines)
+                return self._take(entry), expired
+            else:
+                break
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if entry[2] is not None:
+                return self._take(entry), expired
+        return None, expired
+
+    def _take(self, entry):
+        task, entry[2] = entry[2], None
+        self.size -= 1
+        return task
+
+    def __len__(self):
+        return self.size
+
+
+class PriorityTaskQueue(ThreadTaskQueue):
+    """A thread task queue which serves the pending tasks with the smallest
+    priority first, like queue.PriorityQueue, and tasks of equal priority in
+    the order they were put. Optionally tasks with a deadline are served
+    earliest deadline first, promoted ahead of all the others shortly before
+    their deadline, and dropped once it has passed.
+    Priorities and deadlines are taken from a function of the task source, or
+    else from the priority and deadline attributes of task instances (or the
+    metadata of task dicts). Deadlines are timestamps as returned by time.time().
+    Dropped tasks are counted as done, and listed in manager.failed_tasks,
+    like the tasks whose priority or deadline function raised an exception.
+    Tasks are read ahead of the workers up to maxsize, so that the priorities
+    apply to all the pending tasks. Pushing and popping take O(log n) time, so
+    millions of pending tasks are fine.
+
+    Attributes
+        :param tasks: optional (iterable) the initial tasks.
+        :param maxsize: optional (int) the maximum number of pending tasks a
+            TaskFeeder keeps in the queue. 0 means unbounded. Default is 0.
+        :param streaming: optional (bool) whether tasks are fed lazily by a
+            TaskFeeder. Default is False.
+        :param priority: optional (function or None) the function turning a task
+            source into its priority. Default is None.
+        :param deadline: optional (function or None) the function turning a task
+            source into its deadline, or None if it has none. Default is None.
+        :param edf: optional (bool) whether to serve tasks with a deadline earliest
+            deadline first, ahead of the tasks without one, and by priority among
+            equal deadlines. Default is False.
+        :param promote: optional (float or None) tasks whose deadline is less than
+            promote seconds away are served before all the others. Default is None.
+        :param drop_expired: optional (bool) whether to drop tasks whose deadline
+            passed before a worker got them. Default is True.
+
+    Example
+        ThreadManager(urls, task, task_queue_cls=functools.partial(PriorityTaskQueue, priority=lambda url: -rank[url]))
+    """
+
+    # The maximum number of tasks read ahead on each get.
+    lookahead_batch = 256
+
+    def __init__(self, tasks=None, maxsize=0, streaming=False,
+                 priority=None, deadline=None, edf=False, promote=None, drop_expired=True):
+        self.heap = _PriorityHeap(priority, deadline, edf, promote, drop_expired)
+        self.heap_lock = td.Lock()
+        self.expired_tasks = []
+        ThreadTaskQueue.__init__(self, tasks, maxsize, streaming)
+        self.qsize = _Length(self.queue, self.items, self.delayed, self.heap)
+
+    def get_nowait(self):
+        """Get the Task instance of the highest priority without waiting.
+        :rtype (Task or its subclass or None): None if there are no tasks for now.
+        """
+        with self.heap_lock:
+            for i in range(self.lookahead_batch):
+                task = ThreadTaskQueue.get_nowait(self)
+                if task is None:
+                    break
+                self.heap.push(task)
+            task, expired = self.heap.pop(time.time())
+            self.expired_tasks.extend(expired)
+        if expired:
+            self.task_done(len(expired))
+        return task
+
+    def take_dropped(self):
+        """Take the tasks dropped after their deadline.
+        :rtype (list): Task instances.
+        """
+        with self.heap_lock:
+            tasks, self.expired_tasks = self.expired_tasks, []
+        return tasks
+
+    def _wait_time(self):
+        return 0 if self.heap else ThreadTaskQueue._wait_time(self)
+
+
+class _DispatchedTaskQueue(ProcessTaskQueue):
+    """A process task queue whose pending tasks are held by the process which
+    created it, i.e. the manager, in a heap with push(task), pop(now) and len.
+    A dispatcher thread there keeps prefetch chunks of the next tasks ready
+    for the workers, and pushes the tasks put by worker processes, e.g.
+    follow-up tasks and retries, which are sent to it through an inbox queue.
+
+    Attributes
+        :param heap: the pending tasks, whose pop(now) returns the next task or
+            None, and a list of the tasks dropped instead.
+        :param tasks, maxsize, streaming, chunksize: see ProcessTaskQueue.
+        :param prefetch: optional (int) the number of chunks kept ready for the
+            workers. Default is 4.
+    """
+
+    dispatch_interval = 0.005
+
+    def __init__(self, heap, tasks=None, maxsize=0, streaming=False, chunksize=1, prefetch=4):
+        self.heap = heap
+        self.heap_lock = td.Lock()
+        self.expired_tasks = []
+        self.owner = os.getpid()
+        self.inbox = mp.Queue()
+        # The number of tasks in the chunks ready for the workers.
+        self.ready = mp.Value('i', 0)
+        self.prefetch = prefetch
+        ProcessTaskQueue.__init__(self, tasks, maxsize, streaming, chunksize)
+        self.dispatcher = Thread(target=self._dispatch, args=(weakref.ref(self),), daemon=True)
+        self.dispatcher.start()
+
+    def put_many(self, tasks):
+        """Put a list of new Task instances into the heap.
+        :param tasks: (list) Task instances
+        """
+        self.qsize.increment(len(tasks))
+        self.tot_size.increment(len(tasks))
+        self._push(tasks)
+
+    def requeue(self, task, delay=0):
+        """Put a Task instance got from this queue back into the heap.
+        A delayed task is kept by the process which got it, see ProcessTaskQueue.
+        :param task: (Task or its subclass) a Task instance
+        :param delay: optional (float) seconds to wait before the task could be
+            got again. Default is 0.
+        """
+        if delay > 0:
+            ProcessTaskQueue.requeue(self, task, delay)
+            return
+        self.qsize.increment(1)
+        self._push([task])
+
+    def take_dropped(self):
+        """Take the tasks dropped after their deadline.
+        :rtype (list): Task instances.
+        """
+        with self.heap_lock:
+            tasks, self.expired_tasks = self.expired_tasks, []
+        return tasks
+
+    def _push(self, tasks):
+        if os.getpid() != self.owner:
+            self.inbox.put(tasks)
+            return
+        with self.heap_lock:
+            for task in tasks:
+                self.heap.push(task)
+        self._top_up()
+
+    def _take(self, timeout):
+        if os.getpid() == self.owner:
+            # E.g. the manager draining the failed queue, whose dispatcher quit
+            # as soon as the empty queue was closed.
+            self._receive()
+            self._top_up()
+        chunk = self.queue.get(timeout=timeout)
+        with self.ready.get_lock():
+            self.ready.value -= len(chunk)
+        return chunk
+
+    def _top_up(self):
+        """Move the top tasks of the heap into chunks ready for the workers."""
+        chunk_size = self.chunk_size()
+        num_expired = 0
+        with self.heap_lock:
+            while self.ready.value < self.prefetch * chunk_size:
+                chunk = []
+                now = time.time()
+                while len(chunk) < chunk_size:
+                    task, expired = self.heap.pop(now)
+                    if expired:
+                        self.expired_tasks.extend(expired)
+                        num_expired += len(expired)
+                    if task is None:
+                        break
+                    chunk.append(task)
+                if not chunk:
+                    break
+                with self.ready.get_lock():
+                    self.ready.value += len(chunk)
+                self.queue.put(chunk)
+        if num_expired:
+            self.qsize.increment(-num_expired)
+            self.task_done(num_expired)
+
+    def _receive(self):
+        """Push the tasks sent by worker processes into the heap."""
+        try:
+            tasks = self.inbox.get(timeout=self.dispatch_interval)
+        except Empty:
+            return
+        with self.heap_lock:
+            while True:
+                for task in tasks:
+                    self.heap.push(task)
+                try:
+                    tasks = self.inbox.get_nowait()
+                except Empty:
+                    break
+
+    @staticmethod
+    def _dispatch(ref):
+        """Receive and dispatch tasks until the queue is finished or garbage collected."""
+        while True:
+            queue = ref()
+            if queue is None or queue.finished():
+                return
+            queue._receive()
+            queue._top_up()
+            del queue
+
+    def __getstate__(self):
+        # The heap and the dispatcher belong to the process which created the queue.
+        state = ProcessTaskQueue.__getstate__(self)
+        for name in ('heap', 'heap_lock', 'expired_tasks', 'dispatcher'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        ProcessTaskQueue.__setstate__(self, state)
+        self.heap = None
+        self.heap_lock = td.Lock()
+        self.expired_tasks = []
+        self.dispatcher = None
+
+
+class ProcessPriorityTaskQueue(_DispatchedTaskQueue):
+    """A process task queue which serves the pending tasks with the smallest
+    priority first, with the same options as PriorityTaskQueue.
+    The heap lives in the process which created the queue, i.e. the manager,
+    see _DispatchedTaskQueue. So a task could be overtaken by at most
+    prefetch chunks of tasks of a lower priority. The priority and deadline
+    functions are only called in that process, so they need not be picklable.
+
+    Attributes
+        :param tasks: optional (iterable) the initial tasks.
+        :param maxsize: optional (int) the maximum number of pending tasks a
+            TaskFeeder keeps in the queue. 0 means unbounded. Default is 0.
+        :param streaming: optional (bool) whether tasks are fed lazily by a
+            TaskFeeder. Default is False.
+        :param chunksize: optional (int or 'auto') the number of tasks in a chunk.
+            Default is 1.
+        :param priority, deadline, edf, promote, drop_expired: see PriorityTaskQueue.
+        :param prefetch: optional (int) the number of chunks kept ready for the
+            workers. Default is 4.
+
+    Example
+        ProcessManager(urls, task, task_queue_cls=functools.partial(ProcessPriorityTaskQueue, edf=True))
+    """
+
+    def __init__(self, tasks=None, maxsize=0, streaming=False, chunksize=1,
+                 priority=None, deadline=None, edf=False, promote=None, drop_expired=True, prefetch=4):
+        heap = _PriorityHeap(priority, deadline, edf, promote, drop_expired)
+        _DispatchedTaskQueue.__init__(self, heap, tasks, maxsize, streaming, chunksize, prefetch)
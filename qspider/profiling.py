@@ -0,0 +1,78 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import io
+import os
+import glob
+import shutil
+import pstats
+import cProfile
+import tempfile
+import threading as td
+
+
+def make_profile_dir():
+    """Return a new temporary directory for the profiles of workers."""
+    return tempfile.mkdtemp(prefix='qspider-profile-')
+
+
+def profile_call(profile_dir, func, *args, **kwargs):
+    """Call a function with cProfile enabled in the current thread, and dump
+    the profile into the profile directory, named by the process id and the
+    thread id, once the function returns or raises.
+    :param profile_dir: (str) the directory to dump the profile into.
+    :param func: (callable) the function to call.
+    :rtype (object): the value returned by the function.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(profile_dir, 'worker.%d.%d.prof' % (os.getpid(), td.get_ident())))
+
+
+def merge_profiles(profile_dir, path, top=20, sort='tottime'):
+    """Merge the profiles of all the workers in the profile directory into one
+    pstats file, and remove the directory.
+    :param profile_dir: (str) the directory of the profiles of workers.
+    :param path: (str) the path of the merged pstats file, which could be
+        read by pstats.Stats or viewed by tools like snakeviz.
+    :param top: optional (int) the number of hot functions in the summary. Default is 20.
+    :param sort: optional (str) the pstats sort key of the summary. Default is 'tottime'.
+    :rtype (tuple): (pstats.Stats or None, str) the merged stats, None if no worker
+        was profiled, and the summary of the top hot functions.
+    """
+    files = sorted(glob.glob(os.path.join(profile_dir, '*.prof')))
+    try:
+        if not files:
+            return None, ''
+        stream = io.StringIO()
+        stats = pstats.Stats(*files, stream=stream)
+        stats.dump_stats(path)
+        # List the merged file instead of the temporary ones in the summary.
+        stats.files = [path]
+        stats.strip_dirs().sort_stats(sort).print_stats(top)
+        return stats, stream.getvalue()
+    finally:
+        shutil.rmtree(profile_dir, ignore_errors=True)
@@ -0,0 +1,83 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import math
+import random
+
+
+class RetryPolicy(object):
+    """A retry policy of failed tasks. A failed task is retried after an
+    exponential backoff of backoff * factor ** (attempts - 1) seconds, at most
+    max_backoff seconds, scaled by a random factor in [1 - jitter, 1 + jitter]
+    so that tasks failed together are not retried together.
+
+    Attributes
+        :param max_attempts: optional (int or None) the maximum number of runs
+            of a task, including the first one. None means retrying until the
+            task succeeds. Default is 3.
+        :param backoff: optional (float) seconds to wait before the first retry.
+            Default is 1.
+        :param factor: optional (float) the multiplier of the backoff after
+            each retry. Default is 2.
+        :param max_backoff: optional (float) the maximum seconds to wait before
+            a retry. Default is 60.
+        :param jitter: optional (float) the fraction of the backoff to randomize,
+            between 0 and 1. Default is 0.1.
+        :param retry_on: optional (exception class or tuple of exception classes)
+            the exceptions worth retrying, tasks raising other exceptions fail
+            at once. Default is Exception.
+    """
+
+    def __init__(self, max_attempts=3, backoff=1, factor=2, max_backoff=60, jitter=0.1, retry_on=Exception):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on = retry_on
+
+    def should_retry(self, error, attempts):
+        """Return if a task should be retried.
+        :param error: (Exception) the exception raised by the task.
+        :param attempts: (int) the number of runs of the task so far.
+        :rtype (bool): whether to retry the task.
+        """
+        if self.max_attempts is not None and attempts >= self.max_attempts:
+            return False
+        return isinstance(error, self.retry_on)
+
+    def delay(self, attempts):
+        """Return the seconds to wait before retrying a task.
+        :param attempts: (int) the number of runs of the task so far.
+        :rtype (float): the seconds to wait.
+        """
+        exponent = attempts - 1
+        if self.factor > 1 and 0 < self.backoff < self.max_backoff:
+            # Stop growing once max_backoff is reached, so that the power never overflows.
+            exponent = min(exponent, math.ceil(math.log(self.max_backoff / self.backoff, self.factor)))
+        delay = min(self.backoff * self.factor ** exponent, self.max_backoff)
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(delay, 0)
+
+    def __str__(self):
+        return "RetryPolicy{max_attempts=%s, backoff=%s, factor=%s}" % (self.max_attempts, self.backoff, self.factor)
@@ -0,0 +1,255 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import threading as td
+from collections import deque
+from urllib.parse import urlsplit
+
+from .core import ThreadTaskQueue
+from .core import _Length
+from .core import task_meta
+from .core import task_source
+
+
+def host_key(source_item):
+    """Return the host of a url source item, or None for other source items."""
+    if isinstance(source_item, str):
+        return urlsplit(source_item).hostname
+    return None
+
+
+class TokenBucket(object):
+    """A token bucket rate limiter, which allows burst requests at once and
+    rate requests per second on average.
+
+    Attributes
+        :param rate: (float) the number of tokens added per second.
+        :param burst: optional (int) the maximum number of tokens. Default is 1.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def take(self, now=None):
+        """Take a token out of the bucket if there is one.
+        :rtype (float): 0 if a token is taken, else the seconds until the next token.
+        """
+        if now is None:
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now):
+        """Return if the bucket has refilled up to burst tokens, i.e. it was left idle."""
+        return self.tokens + (now - self.last) * self.rate >= self.burst
+
+
+class _KeyState(object):
+    """Pending tasks and limits of a key."""
+
+    def __init__(self, rate=None, burst=1, max_concurrency=None):
+        self.tasks = deque()
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_concurrency = max_concurrency
+        self.active = 0
+
+    def is_idle(self, now):
+        """Return if the key has no tasks and its rate window has passed, so
+        that dropping its state does not change how its next tasks are limited."""
+        return (not self.tasks and not self.active
+                and (self.bucket is None or self.bucket.is_full(now)))
+
+
+class _Schedule(object):
+    """Pending tasks partitioned by key, served round-robin."""
+
+    # The seconds between sweeps of the states of idle keys.
+    evict_interval = 1
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.states = {}
+        # Keys of the running tasks by their ids.
+        self.running = {}
+        self.ring = deque()
+        self.size = 0
+        self.next_evict = 0
+
+    def add(self, task, key):
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = _KeyState(**self.limits(key))
+        if not state.tasks:
+            self.ring.append(key)
+        state.tasks.append(task)
+        self.size += 1
+
+    def pop(self, now):
+        """Take a task of the next key which is neither throttled nor busy.
+        :rtype (tuple): (task, 0) or (None, the seconds until a throttled key is ready).
+        """
+        if now >= self.next_evict:
+            self.evict(now)
+        delay = float('inf')
+        for i in range(len(self.ring)):
+            key = self.ring[0]
+            self.ring.rotate(-1)
+            state = self.states[key]
+            if state.max_concurrency is not None and state.active >= state.max_concurrency:
+                continue
+            if state.bucket is not None:
+                wait = state.bucket.take(now)
+                if wait:
+                    delay = min(delay, wait)
+                    continue
+            task = state.tasks.popleft()
+            self.size -= 1
+            state.active += 1
+            self.running[id(task)] = key
+            if not state.tasks:
+                self.ring.pop()
+            return task, 0
+        return None, delay
+
+    def release(self, task):
+        try:
+            key = self.running.pop(id(task))
+        except KeyError:
+            return
+        state = self.states.get(key)
+        if state is None:
+            return
+        state.active -= 1
+        if state.is_idle(time.monotonic()):
+            del self.states[key]
+
+    def evict(self, now):
+        """Drop the states of idle keys, e.g. hosts crawled long ago."""
+        for key in [key for key, state in self.states.items() if state.is_idle(now)]:
+            del self.states[key]
+        self.next_evict = now + self.evict_interval
+
+    def __len__(self):
+        return self.size
+
+
+class PoliteTaskQueue(ThreadTaskQueue):
+    """A thread task queue which partitions tasks by a key of their sources,
+    the host of urls by default, and limits the rate and the concurrency of
+    the tasks of each key. Workers are served round-robin from the keys which
+    are ready, so that a throttled host does not hold up the others.
+    Tasks are read ahead of the workers up to maxsize to find ready keys.
+    Tasks whose key function raised an exception, e.g. on a malformed url,
+    are counted as done, and listed in manager.failed_tasks.
+
+    Attributes
+        :param tasks: optional (iterable) the initial tasks.
+        :param maxsize: optional (int) the maximum number of pending tasks a
+            TaskFeeder keeps in the queue. 0 means unbounded. Default is 0.
+        :param streaming: optional (bool) whether tasks are fed lazily by a
+            TaskFeeder. Default is False.
+        :param key: optional (function) the function turning a task source into
+            its key. Default is host_key.
+        :param rate: optional (float or None) the number of tasks started per
+            second for each key. None means unlimited. Default is None.
+        :param burst: optional (int) the number of tasks of a key which could be
+            started at once under the rate limit. Default is 1.
+        :param max_concurrency: optional (int or None) the maximum number of
+            running tasks of each key. None means unlimited. Default is None.
+        :param limits: optional (dict or None) the rate, burst and max_concurrency
+            of specific keys, e.g. {'example.com': {'rate': 0.5}}, overriding the
+            defaults above.
+
+    Example
+        ThreadManager(urls, task, task_queue_cls=functools.partial(PoliteTaskQueue, rate=2, max_concurrency=4))
+    """
+
+    # The maximum number of tasks read ahead on each get.
+    lookahead_batch = 256
+
+    def __init__(self, tasks=None, maxsize=0, streaming=False,
+                 key=host_key, rate=None, burst=1, max_concurrency=None, limits=None):
+        self.key = key
+        self.default_limits = {'rate': rate, 'burst': burst, 'max_concurrency': max_concurrency}
+        self.limits = limits or {}
+        self.schedule = _Schedule(self._limits_of)
+        self.schedule_lock = td.Lock()
+        self.next_delay = 0
+        self.failed_tasks = []
+        ThreadTaskQueue.__init__(self, tasks, maxsize, streaming)
+        self.qsize = _Length(self.queue, self.items, self.delayed, self.schedule)
+
+    def get_nowait(self):
+        """Get a Task instance of a key which is ready without waiting.
+        :rtype (Task or its subclass or None): None if no key is ready for now.
+        """
+        failed = []
+        with self.schedule_lock:
+            for i in range(self.lookahead_batch):
+                task = ThreadTaskQueue.get_nowait(self)
+                if task is None:
+                    break
+                try:
+                    key = self.key(task_source(task))
+                except Exception as e:
+                    task_meta(task)['error'] = "Failed to get the key of the task: %s: %s" % (type(e).__name__, e)
+                    failed.append(task)
+                    continue
+                self.schedule.add(task, key)
+            task, self.next_delay = self.schedule.pop(time.monotonic())
+            self.failed_tasks.extend(failed)
+        if failed:
+            self.task_done(len(failed))
+        return task
+
+    def take_dropped(self):
+        """Take the tasks whose key function raised an exception.
+        :rtype (list): Task instances.
+        """
+        with self.schedule_lock:
+            tasks, self.failed_tasks = self.failed_tasks, []
+        return tasks
+
+    def release(self, task):
+        """Mark that a task finished running, so that another task of its key could run.
+        :param task: (Task or its subclass) a Task instance
+        """
+        with self.schedule_lock:
+            self.schedule.release(task)
+        self._notify(1)
+
+    def _limits_of(self, key):
+        limits = dict(self.default_limits)
+        limits.update(self.limits.get(key, {}))
+        return limits
+
+    def _wait_time(self):
+        timeout = ThreadTaskQueue._wait_time(self)
+        return max(min(self.next_delay, timeout), 0.001) if timeout else 0
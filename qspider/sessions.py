@@ -0,0 +1,127 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import inspect
+import functools
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .httpcache import HTTPCache
+from .httpcache import CachingAdapter
+
+
+class SessionPool(object):
+    """A pool of requests.Session objects with pooled keep-alive connections.
+    Each worker gets its own session from the pool and reuses the connections
+    of the session across all its tasks, instead of making a new TCP/TLS
+    connection for every request.
+
+    Attributes
+        :param pool_connections: optional (int) the number of hosts to keep
+            connection pools for in each session. Default is 10.
+        :param pool_maxsize: optional (int) the maximum number of connections
+            kept alive for each host in each session. Default is 10.
+        :param pool_block: optional (bool) whether to wait for a free connection
+            instead of opening a new one when pool_maxsize connections to a host
+            are in use. Default is False.
+        :param max_retries: optional (int) the maximum number of retries of
+            failed connections. Default is 0.
+        :param headers: optional (dict or None) default headers of the sessions.
+        :param cache: optional (HTTPCache, str or None) the HTTPCache, or its
+            directory, answering the GET requests of the sessions with cached
+            responses, revalidated by conditional requests. Default is None.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False, max_retries=0, headers=None,
+                 cache=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.max_retries = max_retries
+        self.headers = headers
+        self.cache = HTTPCache(cache) if isinstance(cache, str) else cache
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    def create(self):
+        """Create a session which is closed when the pool is closed.
+        :rtype (requests.Session): the session.
+        """
+        session = requests.Session()
+        kwargs = dict(pool_connections=self.pool_connections,
+                      pool_maxsize=self.pool_maxsize,
+                      pool_block=self.pool_block,
+                      max_retries=self.max_retries)
+        if self.cache is not None:
+            adapter = CachingAdapter(self.cache, **kwargs)
+        else:
+            adapter = HTTPAdapter(**kwargs)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if self.headers:
+            session.headers.update(self.headers)
+        with self.lock:
+            self.sessions.append(session)
+        return session
+
+    def release(self, session):
+        """Close a session created by the pool."""
+        session.close()
+        with self.lock:
+            if session in self.sessions:
+                self.sessions.remove(session)
+
+    def close(self):
+        """Close all the sessions created by the pool."""
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        for session in sessions:
+            session.close()
+
+    def __getstate__(self):
+        # Sessions and locks stay in the process which created them.
+        state = self.__dict__.copy()
+        state['sessions'] = []
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def accepts_session(func):
+    """Return if a task function has a session argument."""
+    try:
+        return 'session' in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,360 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import csv
+import copy
+import json
+import time
+import struct
+import pickle
+import logging
+from queue import Queue, Empty
+from threading import Thread
+from abc import ABC, abstractmethod
+
+from .utils import ERROR
+
+
+logger = logging.getLogger(__name__)
+
+
+class Sink(ABC):
+    """An abstract result sink, which writes results returned by tasks into
+    a file instead of keeping them in memory.
+    In process mode, each worker process writes into its own shard of the sink,
+    whose path is path with the process id inserted before the extension, e.g.
+    results.1234.jsonl for results.jsonl.
+    Sink is an abstract class, which means it must be inherited
+    before it can be instantiated.
+
+    Attributes
+        :param path: (str) the path of the file to write results into.
+        :param append: optional (bool) whether to append to the file instead of
+            truncating it, e.g. when resuming a run. Default is False.
+    """
+
+    # Results are buffered in memory until this number of bytes is written.
+    buffer_size = 1 << 20
+    binary = False
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.append = append
+        self.file = None
+
+    def open(self):
+        """Open the file of the sink."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        mode = ('a' if self.append else 'w') + ('b' if self.binary else '')
+        kwargs = {} if self.binary else {'encoding': 'utf-8', 'newline': ''}
+        self.file = open(self.path, mode, buffering=self.buffer_size, **kwargs)
+
+    @abstractmethod
+    def write(self, results):
+        """Write a batch of results.
+        :param results: (list) results returned by tasks.
+        """
+
+    def flush(self, sync=False):
+        """Flush the buffered results into the file.
+        :param sync: optional (bool) whether to sync the file to disk as well.
+        """
+        if self.file is not None:
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        """Flush the buffered results and close the file."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def shard(self, name):
+        """Return a copy of the sink writing into a shard of its file.
+        :param name: (str or int) the name of the shard.
+        :rtype (Sink): the sink of the shard.
+        """
+        sink = copy.copy(self)
+        root, ext = os.path.splitext(self.path)
+        sink.path = "%s.%s%s" % (root, name, ext)
+        sink.file = None
+        return sink
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['file'] = None
+        return state
+
+    def __str__(self):
+        return "%s{path=%s}" % (type(self).__name__, self.path)
+
+
+class JSONLSink(Sink):
+    """A sink writing each result as a line of JSON.
+
+    Attributes
+        :param path: (str) the path of the file to write results into.
+        :param append: optional (bool) whether to append to the file. Default is False.
+        :param default: optional (callable) function to turn objects which are not
+            JSON serializable into serializable ones. Default is str.
+    """
+
+    def __init__(self, path, append=False, default=str):
+        Sink.__init__(self, path, append)
+        self.default = default
+
+    def write(self, results):
+        self.file.write(''.join(json.dumps(res, ensure_ascii=False, default=self.default) + '\n'
+                                for res in results))
+
+
+class CSVSink(Sink):
+    """A sink writing each result as a row of CSV. Results could be dicts,
+    lists or tuples, and other results are written as a row of one column.
+
+    Attributes
+        :param path: (str) the path of the file to write results into.
+        :param append: optional (bool) whether to append to the file. Default is False.
+        :param fieldnames: optional (list or None) the columns of dict results.
+            Default is the keys of the first result.
+        :param header: optional (bool) whether to write the header row of dict
+            results into a new file. Default is True.
+    """
+
+    def __init__(self, path, append=False, fieldnames=None, header=True):
+        Sink.__init__(self, path, append)
+        self.fieldnames = fieldnames
+        self.header = header
+        self.writer = None
+
+    def open(self):
+        Sink.open(self)
+        self.writer = None
+
+    def write(self, results):
+        for res in results:
+            if isinstance(res, dict):
+                if self.writer is None:
+                    self.fieldnames = self.fieldnames or list(res)
+                    self.writer = csv.DictWriter(self.file, self.fieldnames, extrasaction='ignore')
+                    if self.header and self.file.tell() == 0:
+                        self.writer.writeheader()
+                self.writer.writerow(res)
+            elif isinstance(res, (list, tuple)):
+                csv.writer(self.file).writerow(res)
+            else:
+                csv.writer(self.file).writerow([res])
+
+    def __getstate__(self):
+        state = Sink.__getstate__(self)
+        state['writer'] = None
+        return state
+
+
+class PickleSink(Sink):
+    """A sink writing each result as a pickle prefixed by its length, as an
+    8-byte little-endian unsigned integer. Use PickleSink.read to read them.
+
+    Attributes
+        :param path: (str) the path of the file to write results into.
+        :param append: optional (bool) whether to append to the file. Default is False.
+        :param protocol: optional (int) the pickle protocol. Default is the highest one.
+    """
+
+    binary = True
+    header = struct.Struct('<Q')
+
+    def __init__(self, path, append=False, protocol=pickle.HIGHEST_PROTOCOL):
+        Sink.__init__(self, path, append)
+        self.protocol = protocol
+
+    def write(self, results):
+        chunks = []
+        for res in results:
+            data = pickle.dumps(res, self.protocol)
+            chunks.append(self.header.pack(len(data)))
+            chunks.append(data)
+        self.file.write(b''.join(chunks))
+
+    @classmethod
+    def read(cls, path):
+        """Read the results written by a PickleSink. A result cut short by a
+        crash at the end of the file is ignored.
+        :param path: (str) the path of the file.
+        :rtype (generator): the results.
+        """
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(cls.header.size)
+                if len(header) < cls.header.size:
+                    return
+                size, = cls.header.unpack(header)
+                data = f.read(size)
+                if len(data) < size:
+                    return
+                yield pickle.loads(data)
+
+
+class CallbackSink(Sink):
+    """A sink calling a function with each result. In process mode, the function
+    is called in the worker processes.
+
+    Attributes
+        :param callback: (callable) function to call with each result.
+    """
+
+    def __init__(self, callback):
+        Sink.__init__(self, None)
+        self.callback = callback
+
+    def open(self):
+        pass
+
+    def write(self, results):
+        for res in results:
+            self.callback(res)
+
+    def shard(self, name):
+        return self
+
+    def __str__(self):
+        return "CallbackSink{callback=%s}" % self.callback
+
+
+class SinkWriter(Thread):
+    """A writer thread which takes batches of results put by workers and
+    writes them into a sink, merging the batches which are waiting into one
+    write. Workers wait when maxsize batches are waiting, so that results do
+    not pile up in memory if the sink is slower than the workers.
+    With a checkpoint, the file of the sink is synced to disk on every flush,
+    and a task is recorded as done only once its result is synced, so that a
+    crash never leaves a task recorded whose result is lost.
+
+    Attributes
+        :param sink: (Sink) the sink to write results into.
+        :param maxsize: optional (int) the maximum number of batches waiting
+            to be written. Default is 10000.
+        :param checkpoint: optional (Checkpoint or None) the checkpoint to record
+            the indices of the results written into. Default is None.
+    """
+
+    max_batches = 1024
+    flush_interval = 1.0
+
+    def __init__(self, sink, maxsize=10000, checkpoint=None):
+        Thread.__init__(self, daemon=True)
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.queue = Queue(maxsize)
+        # Indices of the results written but not synced yet.
+        self.unsynced = []
+        self.num_written = 0
+        self.error = None
+
+    def put(self, results):
+        """Put a batch of (index, ok, result) tuples returned by a worker.
+        :param results: (list) (index, ok, result) tuples.
+        """
+        self.queue.put(results)
+
+    def run(self):
+        last_flush = time.time()
+        try:
+            self.sink.open()
+        except Exception as e:
+            self._fail(e)
+        while True:
+            try:
+                batch = self.queue.get(timeout=self.flush_interval)
+            except Empty:
+                self._flush()
+                last_flush = time.time()
+                continue
+            stop = batch is None
+            batches = [] if stop else [batch]
+            for i in range(self.max_batches):
+                if stop:
+                    break
+                try:
+                    batch = self.queue.get_nowait()
+                except Empty:
+                    break
+                if batch is None:
+                    stop = True
+                else:
+                    batches.append(batch)
+            records = [res for batch in batches for index, ok, res in batch if ok]
+            if records and self.error is None:
+                try:
+                    self.sink.write(records)
+                    self.num_written += len(records)
+                except Exception as e:
+                    self._fail(e)
+                else:
+                    self._record(batches)
+            if stop:
+                break
+            if time.time() - last_flush >= self.flush_interval:
+                self._flush()
+                last_flush = time.time()
+        self._flush()
+        try:
+            self.sink.close()
+        except Exception as e:
+            self._fail(e)
+        if self.checkpoint is not None:
+            self.checkpoint.flush(sync=True)
+
+    def close(self):
+        """Write all the results put and close the sink."""
+        self.queue.put(None)
+        self.join()
+
+    def _record(self, batches):
+        """Keep the indices of the results written, to record them once they are synced."""
+        if self.checkpoint is not None:
+            self.unsynced.extend(index for batch in batches for index, ok, res in batch
+                                 if ok and index is not None)
+
+    def _flush(self):
+        """Flush the sink, and sync it and record the indices of the results
+        written into the checkpoint if there is one."""
+        if self.error is not None:
+            return
+        try:
+            self.sink.flush(sync=self.checkpoint is not None)
+        except Exception as e:
+            self._fail(e)
+            return
+        indices, self.unsynced = self.unsynced, []
+        for index in indices:
+            self.checkpoint.record(index)
+
+    def _fail(self, e):
+        # Results are dropped from now on, so that workers are not blocked.
+        if self.error is None:
+            self.error = e
+            logger.error("%s Failed to write results into %s. Error message: %s" % (ERROR, self.sink, e))
@@ -0,0 +1,503 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import atexit
+import shutil
+import pickle
+import struct
+import weakref
+import tempfile
+import itertools
+import threading as td
+import multiprocessing as mp
+from queue import Empty
+from collections import deque, OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .core import ThreadTaskQueue
+from .core import _Length
+from .core import task_meta
+from .priority import _DispatchedTaskQueue
+
+# The key of the metadata of a task read from disk, holding the id of its record.
+_RECORD = 'spill_record'
+
+
+def _untag(task):
+    """Remove the record id from the metadata of a task.
+    :rtype (int or None): the record id, None if the task was not read from disk.
+    """
+    if type(task) != dict and not hasattr(task, '__dict__'):
+        return None
+    return task_meta(task).pop(_RECORD, None)
+
+
+def _close_at_exit(ref):
+    queue = ref()
+    if queue is not None:
+        queue.close()
+
+
+class _SegmentQueue(object):
+    """A FIFO queue of tasks which keeps at most memsize pending tasks in a hot
+    segment in memory, and spills the others to append-only segment files.
+    Tasks are written and read in records of batch_size pickled tasks, each
+    prefixed by its number of tasks and its length.
+    A cursor file holds the position of the oldest record whose tasks are not
+    all released yet, and segment files before it are removed. So reopening
+    the directory after a restart or a crash gets back all the spilled tasks
+    which did not finish, while a task could run again at most once more.
+    Tasks in memory are written at exit, or by flush.
+    The deque methods used by ThreadTaskQueue are thread-safe.
+    """
+
+    header = struct.Struct('<II')
+
+    def __init__(self, directory=None, memsize=10000, batch_size=1000, segment_bytes=64 << 20):
+        self.memsize = memsize
+        self.batch_size = batch_size
+        self.segment_bytes = segment_bytes
+        self.lock = td.Lock()
+        self.head = deque()
+        self.tail = []
+        # Record id -> [tasks not released, (segment, offset) of the record].
+        self.records = OrderedDict()
+        self.record_ids = itertools.count()
+        self.read_fd = None
+        self.write_fd = None
+        self.lock_fd = None
+        self.tmpdir = None
+        if directory is None:
+            directory = self.tmpdir = tempfile.mkdtemp(prefix='qspider-spill-')
+        else:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock_directory()
+        self._recover()
+        atexit.register(_close_at_exit, weakref.ref(self))
+
+    def append(self, task):
+        with self.lock:
+            if not self.num_spilled and not self.tail and len(self.head) < self.memsize:
+                self.head.append(task)
+                return
+            self.tail.append(task)
+            if len(self.tail) >= self.batch_size:
+                self._spill()
+
+    def extend(self, tasks):
+        with self.lock:
+            if not self.num_spilled and not self.tail:
+                room = self.memsize - len(self.head)
+                self.head.extend(tasks[:room])
+                tasks = tasks[room:]
+            self.tail.extend(tasks)
+            if len(self.tail) >= self.batch_size:
+                self._spill()
+
+    def popleft(self):
+        """Take the next task.
+        :raise IndexError: if there are no tasks.
+        """
+        with self.lock:
+            if not self.head:
+                if self.num_spilled:
+                    self.head.extend(self._read())
+                elif self.tail:
+                    self.head.extend(self.tail)
+                    self.tail = []
+            return self.head.popleft()
+
+    def release(self, task):
+        """Mark that a task taken from the queue finished, or was put again."""
+        record_id = _untag(task)
+        if record_id is not None:
+            self.release_records([record_id])
+
+    def release_records(self, record_ids):
+        """Mark that tasks of records finished, by the record id of each task."""
+        with self.lock:
+            for record_id in record_ids:
+                record = self.records.get(record_id)
+                if record is not None:
+                    record[0] -= 1
+            self._commit()
+
+    def push(self, task):
+        self.append(task)
+
+    def pop(self, now):
+        """Take the next task, see _DispatchedTaskQueue.
+        :rtype (tuple): (task or None if there are no tasks, no dropped tasks).
+        """
+        try:
+            return self.popleft(), ()
+        except IndexError:
+            return None, ()
+
+    def flush(self):
+        """Write the pending tasks in memory into the segment files, except the
+        tasks which are read from them and kept there until they are released."""
+        with self.lock:
+            if self.lock_fd is not None:
+                self._flush()
+
+    def close(self):
+        """Write the pending tasks in memory, and close the segment files.
+        A temporary directory is removed instead. Closing again does nothing,
+        e.g. when the workers of a finished queue close it at once."""
+        with self.lock:
+            if self.lock_fd is None:
+                return
+            if self.tmpdir is None:
+                self._flush()
+            for fd in (self.read_fd, self.write_fd):
+                if fd is not None:
+                    os.close(fd)
+            self.read_fd = self.write_fd = None
+            if not self.num_spilled and not self.records:
+                # Nothing is left to run, e.g. the run is done.
+                for name in os.listdir(self.directory):
+                    if name.endswith('.seg') or name == 'cursor':
+                        os.remove(self._path(name))
+            os.close(self.lock_fd)
+            self.lock_fd = None
+            if self.tmpdir is not None:
+                shutil.rmtree(self.tmpdir, ignore_errors=True)
+                self.tmpdir = None
+
+    def _flush(self):
+        read = deque(task for task in self.head if _RECORD in task_meta(task))
+        self.tail[:0] = [task for task in self.head if _RECORD not in task_meta(task)]
+        self.head = read
+        self._spill()
+
+    def _lock_directory(self):
+        """Lock the directory, so that no other queue spills into it."""
+        self.lock_fd = os.open(os.path.join(self.directory, 'lock'), os.O_WRONLY | os.O_CREAT, 0o644)
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+            raise ValueError("Spill directory %s is used by another queue." % self.directory)
+
+    def _recover(self):
+        """Count the tasks left in the segment files since the cursor, and drop
+        a record cut by a crash in the middle of a write."""
+        segments = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.seg'))
+        try:
+            with open(self._path('cursor')) as f:
+                segment, offset = map(int, f.read().split())
+        except (OSError, ValueError):
+            segment, offset = (segments[0] if segments else 0), 0
+        self.cursor = (segment, offset)
+        self.read_segment, self.read_offset = segment, offset
+        self.write_segment = max(segments + [segment])
+        self.num_spilled = 0
+        for seg in segments:
+            if seg < segment:
+                os.remove(self._segment_path(seg))
+                continue
+            with open(self._segment_path(seg), 'r+b') as f:
+                file_size = os.fstat(f.fileno()).st_size
+                pos = offset if seg == segment else 0
+                while pos + self.header.size <= file_size:
+                    f.seek(pos)
+                    num_tasks, size = self.header.unpack(f.read(self.header.size))
+                    if pos + self.header.size + size > file_size:
+                        break
+                    pos += self.header.size + size
+                    self.num_spilled += num_tasks
+                if pos < file_size:
+                    f.truncate(pos)
+
+    def _spill(self):
+        """Write the tasks of the tail into records of batch_size tasks."""
+        tasks, self.tail = self.tail, []
+        for i in range(0, len(tasks), self.batch_size):
+            batch = tasks[i:i + self.batch_size]
+            data = pickle.dumps(batch, pickle.HIGHEST_PROTOCOL)
+            if self.write_fd is None:
+                self.write_fd = os.open(self._segment_path(self.write_segment),
+                                        os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            elif os.fstat(self.write_fd).st_size >= self.segment_bytes:
+                os.close(self.write_fd)
+                self.write_segment += 1
+                self.write_fd = os.open(self._segment_path(self.write_segment),
+                                        os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            os.write(self.write_fd, self.header.pack(len(batch), len(data)) + data)
+            self.num_spilled += len(batch)
+
+    def _read(self):
+        """Read records of at least batch_size tasks in total, or all the spilled ones.
+        :rtype (list): Task instances.
+        """
+        tasks = []
+        while self.num_spilled and len(tasks) < self.batch_size:
+            if self.read_fd is None:
+                self.read_fd = os.open(self._segment_path(self.read_segment), os.O_RDONLY)
+            data = os.pread(self.read_fd, self.header.size, self.read_offset)
+            if len(data) < self.header.size:
+                # The end of a segment, which is never appended to again.
+                os.close(self.read_fd)
+                self.read_fd = None
+                self.read_segment += 1
+                self.read_offset = 0
+                continue
+            num_tasks, size = self.header.unpack(data)
+            batch = pickle.loads(os.pread(self.read_fd, size, self.read_offset + self.header.size))
+            record_id = next(self.record_ids)
+            num_tagged = 0
+            for task in batch:
+                if type(task) == dict or hasattr(task, '__dict__'):
+                    task_meta(task)[_RECORD] = record_id
+                    num_tagged += 1
+            self.records[record_id] = [num_tagged, (self.read_segment, self.read_offset)]
+            self.read_offset += self.header.size + size
+            self.num_spilled -= num_tasks
+            tasks.extend(batch)
+        self._commit()
+        return tasks
+
+    def _commit(self):
+        """Move the cursor to the oldest record with tasks not released, and
+        remove the segment files before it."""
+        records = self.records
+        while records and next(iter(records.values()))[0] <= 0:
+            records.popitem(last=False)
+        if records:
+            cursor = next(iter(records.values()))[1]
+        else:
+            cursor = (self.read_segment, self.read_offset)
+        if cursor == self.cursor:
+            return
+        path = self._path('cursor')
+        with open(path + '.tmp', 'w') as f:
+            f.write('%d %d' % cursor)
+        os.replace(path + '.tmp', path)
+        for segment in range(self.cursor[0], cursor[0]):
+            try:
+                os.remove(self._segment_path(segment))
+            except OSError:
+                pass
+        self.cursor = cursor
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _segment_path(self, segment):
+        return self._path('%010d.seg' % segment)
+
+    def __len__(self):
+        return len(self.head) + len(self.tail) + self.num_spilled
+
+    def __del__(self):
+        # Unlock the directory once the queue is dropped, e.g. with its manager.
+        if getattr(self, 'lock_fd', None) is not None:
+            self.close()
+
+
+class SpillTaskQueue(ThreadTaskQueue):
+    """A thread task queue which keeps a hot segment of at most memsize pending
+    tasks in memory, and spills the others to append-only segment files in a
+    directory, written and read in batches. So follow-up tasks and retries of a
+    long crawl could grow to hundreds of millions without running out of memory.
+    Tasks read from the files are acknowledged once they finish, and the files
+    of the streaming task queue of a manager survive a restart: a new queue on
+    the same directory runs the spilled tasks which did not finish first.
+    Pending tasks in memory are written at exit, so a crash loses at most
+    memsize + batch_size tasks, and the ones running which were never spilled.
+    Together with resume=True and a persisted dedup filter, the source items
+    done or spilled already are not run again.
+    The failed queue of a manager, and the other queues which are not
+    streaming, spill into a temporary directory. Tasks are pickled, so task
+    functions should be importable, like with a ProcessManager.
+
+    Attributes
+        :param tasks: optional (iterable) the initial tasks.
+        :param maxsize: optional (int) the maximum number of pending tasks a
+            TaskFeeder keeps in the queue. 0 means unbounded. Default is 0.
+        :param streaming: optional (bool) whether tasks are fed lazily by a
+            TaskFeeder. Default is False.
+        :param directory: optional (str or None) the directory of the segment
+            files, created if it does not exist, None for a temporary one.
+            Default is None.
+        :param memsize: optional (int) the maximum number of pending tasks kept
+            in memory before spilling. Default is 10000.
+        :param batch_size: optional (int) the number of tasks written or read at
+            once. Default is 1000.
+        :param segment_bytes: optional (int) the size of a segment file, after
+            which a new one is started. Default is 64 MiB.
+
+    Example
+        ThreadManager(urls, crawl, task_queue_cls=functools.partial(SpillTaskQueue, directory='frontier'))
+    """
+
+    def __init__(self, tasks=None, maxsize=0, streaming=False,
+                 directory=None, memsize=10000, batch_size=1000, segment_bytes=64 << 20):
+        ThreadTaskQueue.__init__(self, None, maxsize, streaming=True)
+        self.queue = _SegmentQueue(directory if streaming else None, memsize, batch_size, segment_bytes)
+        self.qsize = _Length(self.queue, self.items, self.delayed)
+        # The tasks spilled before a restart.
+        self.tot_size.increment(len(self.queue))
+        if tasks:
+            self.put_many(list(tasks))
+        if not streaming:
+            self.close()
+
+    def release(self, task):
+        """Acknowledge a task read from the segment files.
+        :param task: (Task or its subclass) a Task instance
+        """
+        self.queue.release(task)
+
+    def finished(self):
+        """Return if the queue is closed and all the tasks put into it are done,
+        and unlock the directory then, so that the next run could use it.
+        :rtype (bool): whether workers could quit.
+        """
+        if not ThreadTaskQueue.finished(self):
+            return False
+        if self.queue.tmpdir is None:
+            self.queue.close()
+        return True
+
+    def flush(self):
+        """Write the pending tasks in memory into the segment files."""
+        self.queue.flush()
+
+
+class ProcessSpillTaskQueue(_DispatchedTaskQueue):
+    """A process task queue which spills pending tasks to segment files like
+    SpillTaskQueue. The segment files are owned by the process which created
+    the queue, i.e. the manager, which keeps prefetch chunks of tasks ready for
+    the worker processes, see _DispatchedTaskQueue. Workers acknowledge the
+    tasks read from the files once per chunk.
+
+    Attributes
+        :param tasks: optional (iterable) the initial tasks.
+        :param maxsize: optional (int) the maximum number of pending tasks a
+            TaskFeeder keeps in the queue. 0 means unbounded. Default is 0.
+        :param streaming: optional (bool) whether tasks are fed lazily by a
+            TaskFeeder. Default is False.
+        :param chunksize: optional (int or 'auto') the number of tasks in a chunk.
+            Default is 1.
+        :param directory, memsize, batch_size, segment_bytes: see SpillTaskQueue.
+        :param prefetch: optional (int) the number of chunks kept ready for the
+            workers. Default is 4.
+
+    Example
+        ProcessManager(urls, crawl, task_queue_cls=functools.partial(ProcessSpillTaskQueue, directory='frontier'))
+    """
+
+    def __init__(self, tasks=None, maxsize=0, streaming=False, chunksize=1,
+                 directory=None, memsize=10000, batch_size=1000, segment_bytes=64 << 20, prefetch=4):
+        segments = _SegmentQueue(directory if streaming else None, memsize, batch_size, segment_bytes)
+        num_spilled = len(segments)
+        # Record ids of the released tasks, sent to the manager once per chunk.
+        self.acks = mp.Queue()
+        self.released = []
+        _DispatchedTaskQueue.__init__(self, segments, tasks, maxsize, streaming, chunksize, prefetch)
+        self.qsize.increment(num_spilled)
+        self.tot_size.increment(num_spilled)
+
+    def requeue(self, task, delay=0):
+        """Put a Task instance got from this queue back into the queue.
+        :param task: (Task or its subclass) a Task instance
+        :param delay: optional (float) seconds to wait before the task could be
+            got again. Default is 0.
+        """
+        if delay <= 0:
+            # The copy sent to the manager must not be acknowledged again.
+            self.release(task)
+        _DispatchedTaskQueue.requeue(self, task, delay)
+
+    def release(self, task):
+        """Acknowledge a task read from the segment files.
+        :param task: (Task or its subclass) a Task instance
+        """
+        record_id = _untag(task)
+        if record_id is not None:
+            with self.local_lock:
+                self.released.append(record_id)
+
+    def record_time(self, seconds, num_tasks):
+        """Record the time spent on a chunk, and send the acknowledgements of its tasks.
+        :param seconds: (float) time spent on the chunk.
+        :param num_tasks: (int) the number of tasks in the chunk.
+        """
+        _DispatchedTaskQueue.record_time(self, seconds, num_tasks)
+        self._send_acks()
+
+    def hand_back(self):
+        """Put the buffered and the delayed tasks of this process back into the
+        queue, and acknowledge the copies read from the segment files."""
+        _DispatchedTaskQueue.hand_back(self)
+        self._send_acks()
+
+    def _send_acks(self):
+        with self.local_lock:
+            released, self.released = self.released, []
+        if not released:
+            return
+        if os.getpid() == self.owner:
+            self.heap.release_records(released)
+        else:
+            self.acks.put(released)
+
+    def finished(self):
+        """Return if the queue is closed and all the tasks put into it are done,
+        and unlock the directory then, see SpillTaskQueue.
+        :rtype (bool): whether workers could quit.
+        """
+        if not _DispatchedTaskQueue.finished(self):
+            return False
+        if os.getpid() == self.owner and self.heap.tmpdir is None:
+            self.heap.close()
+        return True
+
+    def flush(self):
+        """Write the pending tasks in memory into the segment files.
+        Only the process which created the queue could flush it."""
+        self.heap.flush()
+
+    def _receive(self):
+        _DispatchedTaskQueue._receive(self)
+        while True:
+            try:
+                released = self.acks.get_nowait()
+            except Empty:
+                break
+            self.heap.release_records(released)
+
+    def __setstate__(self, state):
+        _DispatchedTaskQueue.__setstate__(self, state)
+        self.released = []
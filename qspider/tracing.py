@@ -0,0 +1,113 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import glob
+import json
+import pickle
+import shutil
+import tempfile
+import threading as td
+from collections import deque
+
+# The id of the current thread shown by the OS, or the Python one before Python 3.8.
+thread_id = getattr(td, 'get_native_id', td.get_ident)
+
+
+class Tracer(object):
+    """A tracer which records the timeline of tasks run by the workers of a
+    manager, and writes it as a Chrome trace_event JSON file, which could be
+    opened in chrome://tracing or https://ui.perfetto.dev to find stragglers,
+    idle gaps of workers and bursts of retries.
+    Each worker records the start and end time, attempt number and outcome of
+    its tasks into its own bounded ring, which keeps only the last max_events
+    tasks, so the memory used is bounded no matter how many tasks are run. The
+    rings are dumped by the workers when they quit, and merged after the run.
+
+    Attributes
+        :param path: optional (str) the path of the trace file. Default is
+            'qspider.trace.json'.
+        :param max_events: optional (int) the maximum number of tasks kept by
+            each worker. Default is 20000.
+    """
+
+    def __init__(self, path='qspider.trace.json', max_events=20000):
+        self.path = path
+        self.max_events = max_events
+        self.trace_dir = None
+
+    def begin(self):
+        """Prepare the directory the workers dump their rings into."""
+        self.trace_dir = tempfile.mkdtemp(prefix='qspider-trace-')
+
+    def ring(self):
+        """Return a new ring of events for a worker.
+        Events are (start time, end time, task name, index, attempt, outcome, error) tuples.
+        :rtype (deque): the ring.
+        """
+        return deque(maxlen=self.max_events)
+
+    def dump(self, ring, name):
+        """Dump the ring of a worker, named by the process id and the thread id.
+        :param ring: (deque) the ring of the worker.
+        :param name: (str) the name of the worker shown in the timeline.
+        """
+        pid, tid = os.getpid(), thread_id()
+        with open(os.path.join(self.trace_dir, 'trace.%d.%d.pickle' % (pid, tid)), 'wb') as f:
+            pickle.dump((pid, tid, name, list(ring)), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def end(self):
+        """Merge the rings of all the workers into the trace file.
+        :rtype (int): the number of tasks in the trace.
+        """
+        trace_dir, self.trace_dir = self.trace_dir, None
+        if trace_dir is None:
+            return 0
+        workers = []
+        try:
+            for path in sorted(glob.glob(os.path.join(trace_dir, '*.pickle'))):
+                with open(path, 'rb') as f:
+                    workers.append(pickle.load(f))
+        finally:
+            shutil.rmtree(trace_dir, ignore_errors=True)
+        # Events are appended as tasks end, so the first event of a ring may not
+        # have started first, e.g. in an AsyncWorker running tasks concurrently.
+        origin = min((event[0] for pid, tid, name, events in workers for event in events), default=0)
+        trace_events = []
+        num_tasks = 0
+        for pid, tid, name, events in workers:
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+            for start, end, task_name, index, attempt, outcome, error in events:
+                event = {'name': task_name, 'cat': 'task', 'ph': 'X', 'pid': pid, 'tid': tid,
+                         'ts': round((start - origin) * 1e6, 1), 'dur': round((end - start) * 1e6, 1),
+                         'args': {'index': index, 'attempt': attempt, 'outcome': outcome}}
+                if error is not None:
+                    event['args']['error'] = error
+                    event['cname'] = 'terrible' if outcome == 'failed' else 'bad'
+                trace_events.append(event)
+            num_tasks += len(events)
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            # json.dumps encodes in one go by the C encoder, much faster than json.dump.
+            f.write(json.dumps({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}))
+        os.replace(tmp_path, self.path)
+        return num_tasks
@@ -0,0 +1,219 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import threading
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8, whose results are pickled as usual.
+    shared_memory = None
+
+
+if shared_memory is not None:
+    class _Block(shared_memory.SharedMemory):
+        """A shared memory block mapped by the manager, which could only be closed
+        once no view on it is exported."""
+
+        def __del__(self):
+            try:
+                self.close()
+            except (OSError, BufferError):
+                pass
+
+
+# The blocks mapped by the transports of this process, closed once no result
+# on them is referenced, even after their transports are gone.
+_mapped_blocks = []
+_mapped_lock = threading.Lock()
+
+
+class SharedResult(object):
+    """A handle of a result written into a shared memory block, which is passed
+    between processes instead of the result itself.
+
+    Attributes
+        :param name: (str) the name of the shared memory block.
+        :param nbytes: (int) the size of the result in bytes.
+        :param kind: (str) 'bytes', 'buffer' or 'ndarray', the type to map the
+            block back as.
+        :param format: optional (str) the struct format of the items of a buffer.
+        :param shape: optional (tuple) the shape of a buffer or an array.
+        :param dtype: optional (str) the dtype of a NumPy array.
+    """
+    __slots__ = ('name', 'nbytes', 'kind', 'format', 'shape', 'dtype')
+
+    def __init__(self, name, nbytes, kind, format='B', shape=None, dtype=None):
+        self.name = name
+        self.nbytes = nbytes
+        self.kind = kind
+        self.format = format
+        self.shape = shape
+        self.dtype = dtype
+
+    def __getstate__(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+    def __repr__(self):
+        return "SharedResult{name=%s, nbytes=%d, kind=%s}" % (self.name, self.nbytes, self.kind)
+
+
+class SharedMemoryTransport(object):
+    """A transport of large results from worker processes to the manager through
+    shared memory.
+    A worker copies a bytes, bytearray or any C-contiguous buffer (e.g. a NumPy
+    array) result of at least min_size bytes into a new shared memory block,
+    and puts only a small SharedResult handle into the results queue, instead of
+    pickling the result through the results queue twice. The manager maps the
+    block back without copying, and unlinks it at once, so that the memory is
+    freed once the result is no longer referenced and the block is closed.
+    Blocks are closed when more than max_mapped blocks are mapped, and when the
+    manager finishes. While max_mapped results on blocks are still referenced,
+    further results are copied out of their blocks, so that the manager does
+    not run out of file descriptors.
+
+    Results are mapped back as:
+        bytes, bytearray, buffers: memoryview of the block, with the format and
+            shape of the original buffer. Use bytes(view) to get a copy.
+        NumPy arrays: NumPy array of the same dtype and shape on the block.
+
+    On Windows, a block is freed once no process maps it, so results are
+    pickled as usual there, as well as on Python before 3.8, which has no
+    multiprocessing.shared_memory.
+
+    Attributes
+        :param min_size: optional (int) the minimum size in bytes of results to
+            pass through shared memory. Smaller results are pickled as usual,
+            since creating a block costs a few system calls. Default is 256 KiB.
+        :param max_mapped: optional (int) the maximum number of blocks mapped by
+            the manager process at once. Default is 256.
+    """
+
+    def __init__(self, min_size=1 << 18, max_mapped=256):
+        self.min_size = max(1, min_size)
+        self.max_mapped = max(1, max_mapped)
+        self.enabled = os.name != 'nt' and shared_memory is not None
+        # The number of results unpacked when the mapped blocks are closed next.
+        self.next_close = 0
+        self.num_unpacked = 0
+        if self.enabled:
+            # Start the resource tracker before forking workers, so that workers
+            # share it with the manager instead of starting their own ones, which
+            # would unlink the blocks not consumed yet once the workers exit.
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+
+    def pack(self, res):
+        """Write a large bytes-like result into a shared memory block, in a
+        worker process.
+        :param res: (object) the result returned by a task.
+        :rtype (SharedResult or object): the handle of the block, or res itself if
+            it is not a large C-contiguous buffer.
+        """
+        if not self.enabled or isinstance(res, (str, int, float, type(None))):
+            return res
+        try:
+            view = memoryview(res)
+        except TypeError:
+            return res
+        if view.nbytes < self.min_size or not view.c_contiguous:
+            return res
+        if isinstance(res, (bytes, bytearray)):
+            handle = SharedResult(None, view.nbytes, 'bytes')
+        elif hasattr(res, '__array_interface__') and hasattr(res, 'dtype'):
+            handle = SharedResult(None, view.nbytes, 'ndarray', shape=tuple(res.shape), dtype=res.dtype.str)
+        else:
+            handle = SharedResult(None, view.nbytes, 'buffer', view.format, view.shape)
+        shm = shared_memory.SharedMemory(create=True, size=view.nbytes)
+        try:
+            shm.buf[:view.nbytes] = view.cast('B')
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        handle.name = shm.name
+        # The block outlives the mapping of the worker until the manager unlinks it.
+        shm.close()
+        return handle
+
+    def unpack(self, res):
+        """Map a result passed by pack back, in the manager process.
+        :param res: (SharedResult or object) a result got from the results queue.
+        :rtype (object): the result.
+        """
+        if not isinstance(res, SharedResult):
+            return res
+        shm = self._attach(res.name)
+        self.num_unpacked += 1
+        if len(_mapped_blocks) >= self.max_mapped and self.num_unpacked >= self.next_close:
+            self.close()
+            # Results kept by the caller stay mapped, try again after a quarter of them.
+            self.next_close = self.num_unpacked + self.max_mapped // 4
+        with _mapped_lock:
+            mapped = len(_mapped_blocks) < self.max_mapped
+            if mapped:
+                _mapped_blocks.append(shm)
+        if mapped:
+            view = shm.buf[:res.nbytes]
+        else:
+            with shm.buf[:res.nbytes] as block:
+                view = memoryview(bytearray(block))
+            shm.close()
+        if res.kind == 'ndarray':
+            import numpy
+            return numpy.frombuffer(view, dtype=res.dtype).reshape(res.shape)
+        if res.kind == 'buffer' and (res.format != 'B' or len(res.shape) != 1):
+            return view.cast(res.format, res.shape)
+        return view
+
+    def discard(self, res):
+        """Free the shared memory block of a result which will not be consumed."""
+        if isinstance(res, SharedResult):
+            self._attach(res.name).close()
+
+    @staticmethod
+    def close():
+        """Close the mapped blocks whose results are no longer referenced.
+        The blocks of results still referenced stay mapped until a later call.
+        """
+        with _mapped_lock:
+            blocks = []
+            for shm in _mapped_blocks:
+                try:
+                    shm.close()
+                except BufferError:
+                    # A view on the block is still exported.
+                    blocks.append(shm)
+            _mapped_blocks[:] = blocks
+
+    @staticmethod
+    def _attach(name):
+        """Map a shared memory block and unlink it, so that it is freed once closed.
+        :rtype (_Block): the block.
+        """
+        shm = _Block(name=name)
+        shm.unlink()
+        return shm
@@ -27,7 +27,7 @@ import itertools
 import shutil
 import logging
 from termcolor import colored
-from threading import Thread
+from threading import Thread, Event
 
 logging.basicConfig(level=logging.INFO)
 
@@ -36,17 +36,19 @@ if os.name == 'nt':
     init()
 
 
-def display_progress(start_time, cur_size, tot_size, ncols=None, prog_char='━', desc=None):
+def display_progress(start_time, cur_size, tot_size, ncols=None, prog_char='━', desc=None, num_errors=0):
     """Display progress bar of current progress.
 
     :param start_time: (float) start time
     :param cur_size: (int) current progress.
-    :param tot_size: (int) total size the tasks.
+    :param tot_size: (int or None) total size the tasks, None if the total is not known yet.
     :param ncols: optional (int) width of progress message, including bar column and other columns,
         such as status column, time column, etc. 
         Default value is None, which uses the width of the terminal.
     :param prog_char: optional (char) progress character. Default is '━'.
     :param desc: optional (str or None) string displayed in front of the progress bar.
+    :param num_errors: optional (int) the number of times tasks went wrong, displayed
+        after the rate if it is positive. Default is 0.
 
     Example:
         >>> display_progress(time.time(), 100, 100, desc='[ ✔ ]')
@@ -57,24 +59,40 @@ def display_progress(start_time, cur_size, tot_size, ncols=None, prog_char='━'
     # unprog_char = ' ' if os.name == 'nt' else prog_char
     unprog_char = prog_char
 
-    perc = cur_size / tot_size
     desc_str = '%s ' % desc if desc else ''
     cur_time = time.time()
     rate = cur_size/(cur_time-start_time) if (cur_time != start_time) else 0
+    cost_time_str = '%.1f' % (time.time() - start_time)
+    errors_str = ', %s' % colored('%d errors' % num_errors, 'red') if num_errors else ''
+
+    if tot_size is None:
+        # The total is unknown while tasks are still being read from the source.
+        ratio_column = colored('%s/?' % cur_size, "blue")
+        time_column = '[%ss, %sit/s%s] ' % (
+            colored(cost_time_str, "yellow"),
+            colored("%.1f" % rate, "yellow"),
+            errors_str
+        )
+        msg = f"{desc_str} {ratio_column} {time_column}"
+        print('\r' + msg, end='', flush=True)
+        return
+
+    perc = cur_size / tot_size if tot_size else 1
     left_time = (tot_size - cur_size) // rate if rate > 0 else 0
     left_time_str = str(datetime.timedelta(seconds=left_time))
-    cost_time_str = '%.1f' % (time.time() - start_time)
 
     # format progress msg
     status_column = desc_str
     percentage_column = colored('%3d%%' % (perc * 100), 'blue')
     ratio_column = colored('%s/%s' % (cur_size, tot_size), "blue")
-    time_column = '[eta-%s, %ss, %sit/s] ' % (
+    time_column = '[eta-%s, %ss, %sit/s%s] ' % (
         colored(left_time_str, "yellow"),
         colored(cost_time_str, "yellow"),
-        colored("%.1f" % rate, "yellow")
+        colored("%.1f" % rate, "yellow"),
+        errors_str
     )
-    bar_len = ncols - len(status_column + percentage_column + ratio_column + time_column) + 9 * 5
+    bar_len = ncols - len(status_column + percentage_column + ratio_column + time_column) + 9 * (
+        6 if num_errors else 5)
     bar_column = '%s%s' % (
         colored(prog_char * int(perc * bar_len), 'green'),
         colored(unprog_char * int(bar_len - perc * bar_len), 'white')
@@ -116,23 +134,43 @@ class Timer(Thread):
     Attributes
         :param task_queue: (subclass of BaseQueue) task queue contains task instances.
         :param fps: optional (float) refresh rate. Default value is 0.1s.
+
+    The total is displayed as unknown until the task queue is closed, i.e. all
+    the tasks have been read from the source, and grows afterwards as tasks put
+    follow-up tasks into the task queue. The counters of the task queue are
+    shared by all the workers, so one Timer shows the progress and the errors of
+    all the threads and processes. The timer runs until all the tasks are done,
+    or until stop is called, e.g. when the run is aborted.
     """
     def __init__(self, task_queue, fps=0.1, ncols=None):
         Thread.__init__(self)
         self.task_queue = task_queue
-        self.tot_size = task_queue.tot_size.value
+        self.tot_size = None
         self.fps = fps
         self.ncols = ncols
+        self.stopped = Event()
+
+    def stop(self):
+        """Stop the timer after displaying the progress once more."""
+        self.stopped.set()
 
     def run(self):
         """Run the timer"""
         start_time = time.time()
         for desc in itertools.cycle(PROGRESS_DESCS):
+            stopped = self.stopped.is_set()
+            closed = self.task_queue.closed.is_set()
             cur_size = self.task_queue.num_task_done.value
-            desc = desc if cur_size < self.tot_size else DONE_DESC
+            self.tot_size = self.task_queue.tot_size.value if closed else None
+            desc = desc if self.tot_size is None or cur_size < self.tot_size else DONE_DESC
             # prog_char = '#' if os.name == 'nt' else '━'  # ━ █
             prog_char = '━'  # ━ █
-            display_progress(start_time, cur_size, self.tot_size, ncols=self.ncols, prog_char=prog_char, desc=desc)
-            if cur_size == self.tot_size:
+            display_progress(start_time, cur_size, self.tot_size, ncols=self.ncols, prog_char=prog_char, desc=desc,
+                             num_errors=self.task_queue.num_failed.value)
+            if self.tot_size is not None and cur_size >= self.tot_size:
+                break
+            if stopped:
+                # End the line of the unfinished progress bar.
+                print()
                 break
-            time.sleep(self.fps)
+            self.stopped.wait(self.fps)
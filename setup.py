@@ -42,7 +42,8 @@ setuptools.setup(
     ],
     entry_points={
         'console_scripts': [
-            'genqspider=qspider.core:genqspider'
+            'genqspider=qspider.core:genqspider',
+            'qspider=qspider.distributed:main'
         ],
     },
     classifiers=(
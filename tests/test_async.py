@@ -0,0 +1,69 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import asyncio
+import threading as td
+
+from qspider import AsyncManager, RetryPolicy
+from qspider.core import AsyncWorker
+
+
+async def wait_double(x):
+    await asyncio.sleep(0.05)
+    return x * 2
+
+
+async def fail_first(x, tried=set()):
+    await asyncio.sleep(0)
+    if x not in tried:
+        tried.add(x)
+        raise ValueError(x)
+    return x * 2
+
+
+def test_async_manager_runs_coroutines_concurrently():
+    manager = AsyncManager(range(200), wait_double, has_result=True, num_workers=200)
+    start = time.time()
+    assert sorted(manager.run(silent=True)) == [2 * i for i in range(200)]
+    assert time.time() - start < 2
+
+
+def test_async_manager_retries_failed_coroutines():
+    manager = AsyncManager(range(50), fail_first, has_result=True, num_workers=10,
+                           retry=RetryPolicy(max_attempts=2, backoff=0.01))
+    assert sorted(manager.run(silent=True)) == [2 * i for i in range(50)]
+    assert manager.task_queue.num_failed.value == 50
+
+
+def test_async_worker_takes_no_new_tasks_after_a_break():
+    manager = AsyncManager(range(100000), wait_double, has_result=True, num_workers=10)
+    results = manager.run_iter(silent=True)
+    for res in results:
+        break
+    results.close()
+    # The worker quits once the tasks in flight are done.
+    for worker in td.enumerate():
+        if isinstance(worker, AsyncWorker):
+            worker.join(1)
+            assert not worker.is_alive()
+    assert manager.task_queue.num_task_done.value < 100
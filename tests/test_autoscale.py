@@ -0,0 +1,113 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading as td
+
+from qspider import ThreadManager
+from qspider.autoscale import Autoscaler
+
+
+class FakeWorker(object):
+    """A worker which only records whether it is started and retired."""
+
+    def __init__(self):
+        self.started = False
+        self.stopping = td.Event()
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.stopping.set()
+
+
+class FakeManager(object):
+
+    def _make_worker(self):
+        return FakeWorker()
+
+
+def double(x):
+    return x * 2
+
+
+def make_autoscaler(**kwargs):
+    autoscaler = Autoscaler(FakeManager(), **kwargs)
+    autoscaler.scale_to(autoscaler.min_workers)
+    return autoscaler
+
+
+def test_autoscaler_scales_to_the_number_of_workers():
+    autoscaler = make_autoscaler(min_workers=2)
+    assert autoscaler.num_workers == 2
+    autoscaler.scale_to(5)
+    assert autoscaler.num_workers == 5
+    assert all(worker.started for worker in autoscaler.workers)
+    autoscaler.scale_to(1)
+    assert autoscaler.num_workers == 1
+    # The first workers are kept, and the last ones are retired.
+    assert not autoscaler.workers[0].stopping.is_set()
+    assert all(worker.stopping.is_set() for worker in autoscaler.workers[1:])
+
+
+def test_autoscaler_doubles_workers_in_slow_start():
+    autoscaler = make_autoscaler(min_workers=2, max_workers=64)
+    autoscaler.step(10, 0)
+    assert autoscaler.num_workers == 4
+    autoscaler.step(20, 0)
+    assert autoscaler.num_workers == 8
+    # Throughput stops growing: slow start ends and workers are retired by a step.
+    autoscaler.step(20, 0)
+    assert autoscaler.num_workers == 7
+    assert not autoscaler.slow_start
+
+
+def test_autoscaler_keeps_workers_within_bounds():
+    autoscaler = make_autoscaler(min_workers=2, max_workers=6)
+    for throughput in (10, 20, 40):
+        autoscaler.step(throughput, 0)
+    assert autoscaler.num_workers == 6
+    for error_rate in (0.5, 0.6, 0.7, 0.8):
+        autoscaler.step(1, error_rate)
+    assert autoscaler.num_workers == 2
+
+
+def test_autoscaler_cuts_workers_when_the_error_rate_climbs():
+    autoscaler = make_autoscaler(min_workers=8)
+    autoscaler.min_workers = 1
+    autoscaler.step(10, 0.05)
+    autoscaler.step(10, 0.5)
+    assert autoscaler.num_workers == 12
+    assert not autoscaler.slow_start
+
+
+def test_autoscaler_waits_while_workers_are_starving():
+    autoscaler = make_autoscaler(min_workers=4)
+    autoscaler.step(10, 0, starving=True)
+    assert autoscaler.num_workers == 4
+
+
+def test_thread_manager_runs_with_auto_workers():
+    manager = ThreadManager(range(1000), double, has_result=True, num_workers='auto', max_workers=8)
+    res = manager.run(silent=True)
+    assert sorted(res) == [2 * i for i in range(1000)]
+    assert 1 <= manager.autoscaler.num_workers <= 8
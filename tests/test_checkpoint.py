@@ -0,0 +1,74 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+
+from qspider import ThreadManager, ProcessManager, Checkpoint
+
+
+def double(x):
+    return x * 2
+
+
+def fail_over_50(x):
+    if x >= 50:
+        raise ValueError(x)
+    return x * 2
+
+
+def test_checkpoint_loads_the_recorded_indices(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint'))
+    for index in (0, 3, 3, 1000):
+        checkpoint.record(index)
+    checkpoint.close()
+    reloaded = Checkpoint(str(tmp_path / 'checkpoint'))
+    assert reloaded.load() == 3
+    assert [index for index in range(1001) if reloaded.is_done(index)] == [0, 3, 1000]
+
+
+def test_checkpoint_ignores_a_torn_record(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint'))
+    checkpoint.record(7)
+    checkpoint.close()
+    # A crash in the middle of a write leaves part of a record.
+    with open(os.path.join(checkpoint.path, 'done.1.log'), 'wb') as f:
+        f.write(b'\x05\x00\x00')
+    assert checkpoint.load() == 1
+    assert checkpoint.is_done(7)
+
+
+def test_checkpoint_clear_starts_over(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint'))
+    checkpoint.record(1)
+    checkpoint.close()
+    checkpoint.clear()
+    assert checkpoint.load() == 0
+
+
+def test_resumed_run_skips_the_succeeded_tasks(tmp_path):
+    path = str(tmp_path / 'checkpoint')
+    manager = ThreadManager(range(100), fail_over_50, has_result=True, num_workers=4, add_failed=False,
+                            checkpoint=path)
+    assert sorted(manager.run(silent=True)) == [2 * i for i in range(50)]
+    manager = ProcessManager(range(100), double, has_result=True, num_workers=2, checkpoint=path)
+    assert sorted(manager.run(silent=True, resume=True)) == [2 * i for i in range(50, 100)]
+    assert Checkpoint(path).load() == 100
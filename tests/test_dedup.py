@@ -0,0 +1,68 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pytest
+
+from qspider import ThreadManager, ProcessManager, SetFilter, BloomFilter, canonicalize_url
+
+
+def echo(x):
+    return x
+
+
+@pytest.mark.parametrize('url, canonical', [
+    ('HTTP://Example.COM:80/a/./b/../c?b=2&a=1#top', 'http://example.com/a/c?a=1&b=2'),
+    ('https://example.com', 'https://example.com/'),
+    ('https://example.com:8443/x%20y', 'https://example.com:8443/x%20y'),
+    ('not a url', 'not a url'),
+])
+def test_canonicalize_url(url, canonical):
+    assert canonicalize_url(url) == canonical
+
+
+@pytest.mark.parametrize('make_filter', [SetFilter, lambda path=None: BloomFilter(1000, 0.001, path)])
+def test_filter_is_persisted_between_runs(tmp_path, make_filter):
+    path = str(tmp_path / 'seen')
+    seen = make_filter(path)
+    assert [seen.add(key) for key in ('a', 'b', 'a', 1)] == [True, True, False, True]
+    seen.save()
+    reloaded = make_filter(path)
+    assert len(reloaded) == 3
+    assert not reloaded.add('b')
+    assert reloaded.add('c')
+
+
+def test_bloom_filter_keeps_the_error_rate():
+    seen = BloomFilter(10000, 0.01)
+    for i in range(10000):
+        seen.add(i)
+    assert seen.estimated_error_rate() < 0.02
+    # New keys are taken as seen ones at about the error rate.
+    assert sum(not seen.add('new %d' % i) for i in range(1000)) < 40
+
+
+@pytest.mark.parametrize('manager_cls', [ThreadManager, ProcessManager])
+def test_manager_skips_duplicate_sources(manager_cls):
+    urls = ['http://example.com/%d' % (i % 50) for i in range(200)] + ['HTTP://EXAMPLE.com:80/7#x']
+    manager = manager_cls(urls, echo, has_result=True, num_workers=2, dedup=True)
+    assert list(manager.run_iter(ordered=True, silent=True)) == urls[:50]
+    assert manager.stats()['tasks_duplicate'] == 151
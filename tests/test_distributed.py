@@ -0,0 +1,141 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import time
+import functools
+import threading as td
+
+from qspider import distributed
+from qspider.core import make_task
+from qspider.distributed import Broker, DistributedManager, RemoteTaskQueue, run_worker
+
+
+def double(x):
+    return x * 2
+
+
+def nap_double(x):
+    time.sleep(1)
+    return x * 2
+
+
+def make_broker(num_tasks, **kwargs):
+    manager = DistributedManager(range(num_tasks), double, has_result=True, authkey='secret')
+    manager.task_queue.put_many([make_task(double, i, i) for i in range(num_tasks)])
+    return manager, Broker(manager, authkey='secret', chunksize=4, **kwargs)
+
+
+def ack(tasks):
+    return {'results': [(task['meta']['index'], True, task['source'] * 2) for task in tasks],
+            'failed': [], 'retries': [], 'follow': [], 'num_done': len(tasks), 'num_failed': 0}
+
+
+def test_broker_puts_back_the_lease_of_a_broken_connection():
+    manager, broker = make_broker(6)
+    try:
+        leases = set()
+        kind, lease_id, tasks = broker._lease('lost', 4, leases)
+        # The connection breaks before the lease is acknowledged.
+        broker._expire(lease_id)
+        assert broker.num_lost == 4
+        assert manager.task_queue.qsize.value == 6
+        # The late acknowledgement of the lost worker is ignored.
+        broker._ack(lease_id, ack(tasks))
+        assert manager.task_queue.num_task_done.value == 0
+        sources = []
+        while True:
+            reply = broker._lease('alive', 4, set())
+            if reply[0] != 'tasks':
+                break
+            sources.extend(task['source'] for task in reply[2])
+            broker._ack(reply[1], ack(reply[2]))
+        assert sorted(sources) == list(range(6))
+        assert manager.task_queue.num_task_done.value == 6
+    finally:
+        broker.close()
+
+
+def test_broker_puts_back_the_leases_of_a_worker_missing_heartbeats():
+    manager, broker = make_broker(3, lease_timeout=0.05)
+    try:
+        broker._handle(('get', 'silent', 4), set())
+        broker._handle(('heartbeat', 'alive'), set())
+        time.sleep(0.1)
+        broker._handle(('heartbeat', 'alive'), set())
+        broker._reap()
+        assert broker.leases == {}
+        assert broker.num_lost == 3
+        assert manager.task_queue.qsize.value == 3
+    finally:
+        broker.close()
+
+
+def test_distributed_manager_reruns_the_lease_of_a_lost_worker():
+    manager = DistributedManager(range(50), double, has_result=True, num_workers=0, authkey='secret', chunksize=5)
+
+    def lose_a_lease():
+        while manager.broker is None:
+            time.sleep(0.01)
+        lost = RemoteTaskQueue(manager.broker.connect_address, 'secret', 'lost')
+        lost.connect()
+        assert lost.get_chunk()
+        lost.local.conn.close()
+        # A worker runs the rest, including the lease put back.
+        remote = td.Thread(target=run_worker, args=(manager.broker.connect_address, 'secret', 2), daemon=True)
+        remote.start()
+
+    td.Thread(target=lose_a_lease, daemon=True).start()
+    res = manager.run(silent=True)
+    assert sorted(res) == [2 * i for i in range(50)]
+    assert manager.broker.num_lost == 5
+
+
+def test_worker_keeps_its_leases_after_a_failed_heartbeat(monkeypatch):
+    monkeypatch.setattr(distributed, 'Broker', functools.partial(Broker, heartbeat=0.1))
+    heartbeat = RemoteTaskQueue.heartbeat
+    beats = []
+
+    def flaky_heartbeat(self):
+        # The first heartbeat fails, e.g. while reconnecting.
+        beats.append(len(beats))
+        return heartbeat(self) if len(beats) > 1 else False
+
+    monkeypatch.setattr(RemoteTaskQueue, 'heartbeat', flaky_heartbeat)
+    manager = DistributedManager(range(4), nap_double, has_result=True, num_workers=0, authkey='secret',
+                                 chunksize=1, lease_timeout=0.5)
+
+    def start_worker():
+        while manager.broker is None:
+            time.sleep(0.01)
+        td.Thread(target=run_worker, args=(manager.broker.connect_address, 'secret', 4), daemon=True).start()
+
+    td.Thread(target=start_worker, daemon=True).start()
+    res = []
+    # Leases put back run again and again, as the worker stays silent while running them.
+    runner = td.Thread(target=lambda: res.extend(manager.run(silent=True)), daemon=True)
+    runner.start()
+    runner.join(30)
+    assert not runner.is_alive()
+    assert sorted(res) == [0, 2, 4, 6]
+    # The tasks outlive lease_timeout, but their leases are kept by the heartbeats.
+    assert manager.broker.num_lost == 0
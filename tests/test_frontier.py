@@ -0,0 +1,70 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pytest
+
+from qspider import ThreadManager, ProcessManager, Follow
+from qspider.dedup import BloomFilter
+
+
+def links(n):
+    # Pages 1 to 63 form a binary tree.
+    return [i for i in (2 * n, 2 * n + 1) if i < 64]
+
+
+def crawl(n):
+    return Follow(links(n), result=n)
+
+
+def crawl_gen(n):
+    for link in links(n):
+        yield link
+    return n
+
+
+def crawl_loop(n):
+    # Pages 0 to 29 link to each other in a loop and to their doubles.
+    return Follow([(n + 1) % 30, 2 * n % 30], result=n)
+
+
+@pytest.mark.parametrize('manager_cls', [ThreadManager, ProcessManager])
+@pytest.mark.parametrize('task', [crawl, crawl_gen])
+def test_manager_runs_follow_up_tasks(manager_cls, task):
+    res = manager_cls([1], task, has_result=True, num_workers=3).run(silent=True)
+    assert sorted(res) == list(range(1, 64))
+
+
+def test_follow_up_tasks_stop_at_max_depth():
+    res = ThreadManager([1], crawl, has_result=True, num_workers=3, max_depth=2).run(silent=True)
+    assert sorted(res) == list(range(1, 8))
+
+
+# A SetFilter is copied into each worker process, while a BloomFilter is shared by them.
+@pytest.mark.parametrize('manager_cls, make_filter', [(ThreadManager, lambda: True),
+                                                      (ProcessManager, lambda: BloomFilter(1000, 0.0001))])
+def test_follow_up_tasks_are_deduplicated(manager_cls, make_filter):
+    res = manager_cls([0], crawl_loop, has_result=True, num_workers=3, dedup=make_filter()).run(silent=True)
+    assert sorted(res) == list(range(30))
+
+
+def test_follow_wraps_a_single_source():
+    assert Follow('http://a.com', result=1).sources == ['http://a.com']
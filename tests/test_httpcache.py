@@ -0,0 +1,109 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading as td
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from qspider import ThreadManager, SessionPool, HTTPCache
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves /etag with an ETag, /fresh with max-age and /nostore with no-store,
+    counting the requests and the bodies sent by path."""
+
+    def do_GET(self):
+        counts = self.server.counts
+        counts[self.path] = counts.get(self.path, 0) + 1
+        if self.path == '/etag' and self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            return
+        headers = {'/etag': ('ETag', '"v1"'), '/fresh': ('Cache-Control', 'max-age=60'),
+                   '/nostore': ('Cache-Control', 'no-store')}[self.path]
+        body = ('body of %s' % self.path).encode('utf-8')
+        self.send_response(200)
+        self.send_header(*headers)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.bodies[self.path] = self.server.bodies.get(self.path, 0) + 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.counts = {}
+    server.bodies = {}
+    td.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url_of(server, path):
+    return 'http://127.0.0.1:%d%s' % (server.server_address[1], path)
+
+
+def fetch(url, session):
+    response = session.get(url)
+    return response.text, response.from_cache
+
+
+def test_cache_revalidates_by_etag(tmp_path, server):
+    session = SessionPool(cache=HTTPCache(str(tmp_path))).create()
+    url = url_of(server, '/etag')
+    assert fetch(url, session) == ('body of /etag', False)
+    assert fetch(url, session) == ('body of /etag', True)
+    assert server.counts['/etag'] == 2
+    assert server.bodies['/etag'] == 1
+
+
+def test_cache_serves_fresh_responses_without_requests(tmp_path, server):
+    session = SessionPool(cache=HTTPCache(str(tmp_path))).create()
+    url = url_of(server, '/fresh')
+    assert [fetch(url, session) for i in range(3)] == [('body of /fresh', False)] + [('body of /fresh', True)] * 2
+    assert server.counts['/fresh'] == 1
+    # A new process or a later run reads the cache from disk.
+    session = SessionPool(cache=HTTPCache(str(tmp_path), revalidate=True)).create()
+    assert fetch(url, session) == ('body of /fresh', False)
+    assert server.counts['/fresh'] == 2
+
+
+def test_cache_does_not_store_no_store_responses(tmp_path, server):
+    session = SessionPool(cache=HTTPCache(str(tmp_path))).create()
+    url = url_of(server, '/nostore')
+    assert [fetch(url, session) for i in range(2)] == [('body of /nostore', False)] * 2
+
+
+def test_pooled_sessions_of_a_run_share_the_cache(tmp_path, server):
+    urls = [url_of(server, '/etag')] * 20
+    for i in range(2):
+        manager = ThreadManager(urls, fetch, has_result=True, num_workers=4, session=SessionPool(cache=str(tmp_path)))
+        assert all(text == 'body of /etag' for text, from_cache in manager.run(silent=True))
+    # Bodies are sent to the workers racing for the first response only.
+    assert server.bodies['/etag'] <= 4
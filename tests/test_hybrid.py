@@ -0,0 +1,65 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import time
+import threading as td
+
+from qspider import HybridManager, RetryPolicy
+
+
+def double(x):
+    return x * 2
+
+
+def where(x):
+    time.sleep(0.05)
+    return os.getpid(), td.get_ident()
+
+
+def fail_odd(x):
+    if x % 2:
+        raise ValueError(x)
+    return x
+
+
+def test_hybrid_manager_returns_every_result():
+    res = HybridManager(range(500), double, has_result=True, num_workers=2, num_threads=4,
+                        chunksize=8).run(silent=True)
+    assert sorted(res) == [2 * i for i in range(500)]
+
+
+def test_hybrid_manager_runs_threads_in_each_process():
+    res = HybridManager(range(40), where, has_result=True, num_workers=2, num_threads=4).run(silent=True)
+    pids = {pid for pid, thread in res}
+    assert os.getpid() not in pids
+    assert 1 <= len(pids) <= 2
+    # Tasks are spread over the threads of the processes.
+    assert len(set(res)) > len(pids)
+
+
+def test_hybrid_manager_collects_failed_tasks():
+    retry = RetryPolicy(max_attempts=2, backoff=0.01)
+    manager = HybridManager(range(20), fail_odd, has_result=True, num_workers=2, num_threads=3, retry=retry)
+    res = manager.run(silent=True)
+    assert sorted(res) == list(range(0, 20, 2))
+    assert sorted(task['source'] for task in manager.failed_tasks) == list(range(1, 20, 2))
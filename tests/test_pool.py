@@ -0,0 +1,76 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pytest
+
+from qspider import WorkerPool, RetryPolicy
+
+
+def double(x):
+    return x * 2
+
+
+def fail_odd(x):
+    if x % 2:
+        raise ValueError(x)
+    return x
+
+
+def explode():
+    raise ValueError("cannot load the result")
+
+
+class Unloadable(object):
+    """A result which fails to be unpickled by the manager."""
+
+    def __reduce__(self):
+        return explode, ()
+
+
+def unloadable(x):
+    return Unloadable() if x == 7 else x
+
+
+def test_worker_pool_runs_batches_with_warm_workers():
+    with WorkerPool(num_workers=2) as pool:
+        workers = list(pool.workers)
+        assert pool.run(range(100), double) == [2 * i for i in range(100)]
+        batches = [pool.submit(range(i, i + 50), double) for i in range(0, 200, 50)]
+        assert [batch.result(30) for batch in batches] == [[2 * i for i in range(j, j + 50)]
+                                                           for j in range(0, 200, 50)]
+        assert pool.workers == workers and all(worker.is_alive() for worker in workers)
+
+
+def test_worker_pool_keeps_failed_tasks_in_their_batch():
+    with WorkerPool(num_workers=2, retry=RetryPolicy(max_attempts=1)) as pool:
+        batch = pool.submit(range(20), fail_odd)
+        assert batch.result(30) == list(range(0, 20, 2))
+        assert sorted(task['source'] for task in batch.failed_tasks) == list(range(1, 20, 2))
+
+
+def test_batch_fails_if_its_results_cannot_be_got():
+    with WorkerPool(num_workers=2) as pool:
+        batch = pool.submit(range(20), unloadable)
+        with pytest.raises(ValueError):
+            batch.result(30)
+        # The dispatcher keeps routing the results of the next batches.
+        assert pool.run(range(10), double, timeout=30) == [2 * i for i in range(10)]
@@ -0,0 +1,86 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import time
+import functools
+import threading as td
+
+import pytest
+
+from qspider import ThreadManager, ProcessManager
+from qspider.priority import PriorityTaskQueue, ProcessPriorityTaskQueue
+from qspider.core import make_task
+
+
+def double(x):
+    return x * 2
+
+
+def rank(x):
+    if x == 13:
+        raise ValueError("no rank")
+    return -x
+
+
+def test_priority_task_queue_serves_smallest_priority_first():
+    queue = PriorityTaskQueue([make_task(double, i, i) for i in range(100)], priority=lambda x: -x)
+    assert [queue.get()['source'] for i in range(100)] == list(range(99, -1, -1))
+
+
+def test_edf_serves_earliest_deadline_first_and_drops_expired_tasks():
+    now = time.time()
+    deadlines = {0: now + 30, 1: now + 10, 2: None, 3: now - 1, 4: now + 20}
+    queue = PriorityTaskQueue([make_task(double, i, i) for i in deadlines], deadline=deadlines.get, edf=True)
+    assert [queue.get()['source'] for i in range(4)] == [1, 4, 0, 2]
+    assert [task['source'] for task in queue.take_dropped()] == [3]
+    assert queue.num_task_done.value == 1
+
+
+@pytest.mark.parametrize('manager_cls, queue_cls', [
+    (ThreadManager, PriorityTaskQueue),
+    (ProcessManager, ProcessPriorityTaskQueue),
+])
+def test_tasks_whose_priority_raises_are_failed(manager_cls, queue_cls):
+    manager = manager_cls(range(50), double, has_result=True, num_workers=2,
+                          task_queue_cls=functools.partial(queue_cls, priority=rank))
+    res = manager.run(silent=True)
+    assert sorted(res) == [2 * i for i in range(50) if i != 13]
+    assert [task['source'] for task in manager.failed_tasks] == [13]
+    assert 'ValueError: no rank' in manager.failed_tasks[0]['meta']['error']
+
+
+@pytest.mark.parametrize('manager_cls, queue_cls', [
+    (ThreadManager, PriorityTaskQueue),
+    (ProcessManager, ProcessPriorityTaskQueue),
+])
+def test_ordered_results_skip_expired_tasks(manager_cls, queue_cls):
+    # The window of ordered results is full of tasks after the expired one.
+    manager = manager_cls(range(200), double, has_result=True, num_workers=2, queue_size=50,
+                          task_queue_cls=functools.partial(queue_cls, deadline=lambda x: 0 if x == 3 else None))
+    res = []
+    runner = td.Thread(target=lambda: res.extend(manager.run_iter(ordered=True, silent=True)), daemon=True)
+    runner.start()
+    runner.join(60)
+    assert not runner.is_alive()
+    assert res == [2 * i for i in range(200) if i != 3]
+    assert [task['source'] for task in manager.failed_tasks] == [3]
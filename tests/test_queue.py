@@ -0,0 +1,215 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import threading as td
+import multiprocessing as mp
+
+from qspider import ThreadManager, ProcessManager, ThreadTaskQueue, ProcessTaskQueue, SharedCounter, RetryPolicy
+from qspider.core import ShardedCounter, make_task
+
+
+def double(x):
+    return x * 2
+
+
+def run_threads(target, num_threads=16):
+    threads = [td.Thread(target=target) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def fail_first(x, tried=set(), lock=td.Lock()):
+    with lock:
+        if x not in tried:
+            tried.add(x)
+            raise ValueError(x)
+    return x * 2
+
+
+class RacyHeap(list):
+    """A heap of delayed tasks whose tasks are popped by another thread right
+    after it is checked for tasks without the lock."""
+
+    def __init__(self, tasks, lock):
+        list.__init__(self, tasks)
+        self.lock = lock
+
+    def __bool__(self):
+        has_tasks = len(self) > 0
+        if not self.lock.locked():
+            del self[:]
+        return has_tasks
+
+
+def increment_shared(counter, times):
+    for i in range(times):
+        counter.increment(1)
+
+
+def test_sharded_counter_sums_concurrent_increments():
+    counter = ShardedCounter(5)
+    run_threads(lambda: [counter.increment(1) for i in range(10000)])
+    assert counter.value == 5 + 16 * 10000
+
+
+def test_thread_shared_counter_sums_concurrent_increments():
+    counter = SharedCounter(0, 'thread')
+    run_threads(lambda: increment_shared(counter, 10000))
+    assert counter.value == 16 * 10000
+
+
+def test_process_shared_counter_sums_concurrent_increments():
+    counter = SharedCounter(0, 'process')
+    processes = [mp.Process(target=increment_shared, args=(counter, 2000)) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert counter.value == 4 * 2000
+
+
+def test_thread_task_queue_gives_each_task_once():
+    tasks = [make_task(double, i, i) for i in range(20000)]
+    queue = ThreadTaskQueue(tasks)
+    got = []
+    lock = td.Lock()
+
+    def work():
+        mine = []
+        while True:
+            task = queue.get()
+            if task is None:
+                break
+            mine.append(task['source'])
+            queue.task_done()
+        with lock:
+            got.extend(mine)
+
+    run_threads(work)
+    assert sorted(got) == list(range(20000))
+    assert queue.tot_size.value == 20000
+    assert queue.num_task_done.value == 20000
+    assert queue.qsize.value == 0
+    assert queue.finished()
+
+
+def test_thread_task_queue_counts_tasks_put_while_running():
+    queue = ThreadTaskQueue([make_task(double, i, i) for i in range(100)], streaming=True)
+    queue.close()
+    num_run = [0]
+    lock = td.Lock()
+
+    def work():
+        while True:
+            task = queue.get()
+            if task is None:
+                break
+            if task['source'] < 1000:
+                # A follow-up task is put before its parent is done.
+                queue.put(make_task(double, task['source'] + 100))
+            with lock:
+                num_run[0] += 1
+            queue.task_done()
+
+    run_threads(work, 8)
+    assert num_run[0] == 1100
+    assert queue.tot_size.value == queue.num_task_done.value == 1100
+
+
+def test_process_task_queue_counters():
+    queue = ProcessTaskQueue([make_task(double, i, i) for i in range(50)], chunksize=7)
+    got = []
+    while True:
+        chunk = queue.get_chunk()
+        if not chunk:
+            break
+        got.extend(task['source'] for task in chunk)
+        queue.task_done(len(chunk))
+    assert sorted(got) == list(range(50))
+    assert queue.tot_size.value == queue.num_task_done.value == 50
+    assert queue.finished()
+
+
+def test_thread_manager_returns_every_result():
+    res = ThreadManager(range(5000), double, has_result=True, num_workers=64).run(silent=True)
+    assert sorted(res) == [2 * i for i in range(5000)]
+
+
+def test_process_manager_returns_every_result():
+    res = ProcessManager(range(500), double, has_result=True, num_workers=3, chunksize=8).run(silent=True)
+    assert sorted(res) == [2 * i for i in range(500)]
+
+
+def test_thread_task_queue_reads_delayed_tasks_popped_by_other_threads():
+    queue = ThreadTaskQueue()
+    queue.delayed = RacyHeap([(0, 1, make_task(double, 0, 0))], queue.lock)
+    assert queue._wait_time() == 0.001
+    assert queue.get_nowait()['source'] == 0
+    queue.delayed = RacyHeap([(0, 1, make_task(double, 0, 0))], queue.lock)
+    assert queue._poll_time() == 0.001
+
+
+def test_thread_manager_retries_delayed_tasks_with_many_workers():
+    # The workers race over the heap of delayed tasks while they poll it.
+    retry = RetryPolicy(max_attempts=2, backoff=0.01, jitter=0.5)
+    res = ThreadManager(range(2000), fail_first, has_result=True, num_workers=64, retry=retry).run(silent=True)
+    assert sorted(res) == [2 * i for i in range(2000)]
+
+
+def test_process_manager_keeps_delayed_tasks_of_retired_workers():
+    retry = RetryPolicy(max_attempts=4, backoff=1, jitter=0)
+    manager = ProcessManager(range(200), fail_first, has_result=True, num_workers='auto',
+                             min_workers=3, max_workers=3, retry=retry)
+    res = []
+
+    def scale_down():
+        # Retire two workers while they hold retries delayed.
+        while manager.autoscaler is None or manager.task_queue.num_failed.value < 100:
+            time.sleep(0.01)
+        manager.autoscaler.scale_to(1)
+
+    scaler = td.Thread(target=scale_down, daemon=True)
+    scaler.start()
+    runner = td.Thread(target=lambda: res.extend(manager.run(silent=True)), daemon=True)
+    runner.start()
+    runner.join(60)
+    hung = runner.is_alive()
+    if hung:
+        for worker in manager.autoscaler.workers:
+            worker.terminate()
+    assert not hung
+    assert sorted(res) == [2 * i for i in range(200)]
+
+
+def nap(x):
+    time.sleep(0.01)
+    return x
+
+
+def test_thread_task_queue_counts_wait_time_from_refill():
+    manager = ThreadManager(range(40), nap, num_workers=2, metrics=True)
+    manager.run(silent=True)
+    # The last tasks wait for about 19 tasks of each worker to be done.
+    assert manager.stats()['wait_time']['max'] > 0.1
@@ -0,0 +1,64 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from qspider import ThreadManager, RetryPolicy
+
+
+def fail_twice(x, attempts={}):
+    attempts[x] = attempts.get(x, 0) + 1
+    if attempts[x] <= 2:
+        raise IOError(x)
+    return x
+
+
+def test_delay_grows_exponentially_up_to_max_backoff():
+    retry = RetryPolicy(backoff=0.5, factor=2, max_backoff=10, jitter=0)
+    assert [retry.delay(attempts) for attempts in range(1, 7)] == [0.5, 1, 2, 4, 8, 10]
+
+
+def test_delay_does_not_overflow_after_many_attempts():
+    retry = RetryPolicy(max_attempts=None, backoff=0.5, jitter=0)
+    assert retry.delay(2000) == retry.delay(10 ** 9) == 60
+
+
+def test_jitter_scales_the_delay():
+    retry = RetryPolicy(backoff=1, jitter=0.5)
+    assert all(0.5 <= retry.delay(1) <= 1.5 for i in range(100))
+
+
+def test_should_retry_until_max_attempts_on_retry_on_errors():
+    retry = RetryPolicy(max_attempts=3, retry_on=IOError)
+    assert retry.should_retry(IOError(), 2)
+    assert not retry.should_retry(IOError(), 3)
+    assert not retry.should_retry(ValueError(), 1)
+    assert RetryPolicy(max_attempts=None).should_retry(ValueError(), 10 ** 6)
+
+
+def test_manager_retries_tasks_by_the_policy():
+    manager = ThreadManager(range(20), fail_twice, has_result=True, num_workers=4,
+                            retry=RetryPolicy(max_attempts=3, backoff=0.01))
+    assert sorted(manager.run(silent=True)) == list(range(20))
+    manager = ThreadManager(range(20, 40), fail_twice, has_result=True, num_workers=4,
+                            retry=RetryPolicy(max_attempts=2, backoff=0.01))
+    assert manager.run(silent=True) == []
+    assert len(manager.failed_tasks) == 20
+    assert all(task['meta']['attempts'] == 2 for task in manager.failed_tasks)
@@ -0,0 +1,111 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import time
+import subprocess
+import threading as td
+
+import pytest
+
+from qspider import ThreadManager, Timer
+
+
+def double(x):
+    return x * 2
+
+
+def nap(x):
+    time.sleep(0.001)
+    return x
+
+
+# Breaks out of run_iter in a fresh interpreter, which has to exit afterwards.
+EARLY_EXIT = """
+import qspider
+
+def double(x):
+    return x * 2
+
+manager = qspider.%s(range(1000000), double, has_result=True, num_workers=2)
+for i, res in enumerate(manager.run_iter(silent=%s)):
+    if i == 10:
+        break
+"""
+
+
+def timers():
+    return [thread for thread in td.enumerate() if isinstance(thread, Timer)]
+
+
+def test_run_iter_yields_results_in_order():
+    manager = ThreadManager(range(1000), nap, has_result=True, num_workers=8, queue_size=50)
+    assert list(manager.run_iter(ordered=True, silent=True)) == list(range(1000))
+
+
+def test_run_iter_yields_results_as_they_arrive():
+    manager = ThreadManager(iter(range(1000)), double, has_result=True, num_workers=8)
+    assert sorted(manager.run_iter(silent=True)) == [2 * i for i in range(1000)]
+
+
+def test_break_stops_the_workers_and_the_timer(capsys):
+    manager = ThreadManager(range(100000), nap, has_result=True, num_workers=4)
+    results = manager.run_iter()
+    for i, res in enumerate(results):
+        if i == 10:
+            break
+    results.close()
+    assert not timers()
+    assert manager.task_queue.num_task_done.value < 1000
+
+
+@pytest.mark.parametrize('error', [ValueError, KeyboardInterrupt])
+def test_error_of_the_caller_stops_the_run(error):
+    manager = ThreadManager(range(100000), nap, has_result=True, num_workers=4)
+    with pytest.raises(error):
+        for res in manager.run_iter():
+            raise error()
+    assert not timers()
+    time.sleep(0.1)
+    num_done = manager.task_queue.num_task_done.value
+    time.sleep(0.1)
+    assert manager.task_queue.num_task_done.value == num_done
+
+
+def test_timer_stops_before_the_tasks_are_done(capsys):
+    manager = ThreadManager(range(10), double)
+    timer = Timer(manager.task_queue, fps=0.01)
+    timer.start()
+    timer.stop()
+    timer.join(5)
+    assert not timer.is_alive()
+
+
+@pytest.mark.parametrize('manager_cls', ['ProcessManager', 'HybridManager'])
+@pytest.mark.parametrize('silent', [True, False])
+def test_process_managers_exit_after_a_break(manager_cls, silent):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    process = subprocess.run([sys.executable, '-c', EARLY_EXIT % (manager_cls, silent)], env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+    assert process.returncode == 0
@@ -0,0 +1,91 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import functools
+import threading as td
+
+from qspider import ThreadManager, PoliteTaskQueue, TokenBucket
+from qspider.core import make_task
+
+
+def echo(url):
+    return url
+
+
+def visit(url, running={}, peak={}, lock=td.Lock()):
+    host = url.split('/')[2]
+    with lock:
+        running[host] = running.get(host, 0) + 1
+        peak[host] = max(peak.get(host, 0), running[host])
+    time.sleep(0.01)
+    with lock:
+        running[host] -= 1
+    return peak[host]
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    bucket = TokenBucket(rate=10, burst=2)
+    now = bucket.last
+    assert bucket.take(now) == 0
+    assert bucket.take(now) == 0
+    assert abs(bucket.take(now) - 0.1) < 1e-9
+    assert bucket.take(now + 0.1) == 0
+
+
+def test_polite_task_queue_serves_keys_round_robin():
+    urls = ['http://a.com/%d' % i for i in range(3)] + ['http://b.com/%d' % i for i in range(3)]
+    queue = PoliteTaskQueue([make_task(echo, url) for url in urls])
+    hosts = [queue.get()['source'].split('/')[2] for i in range(6)]
+    assert hosts == ['a.com', 'b.com'] * 3
+
+
+def test_polite_task_queue_limits_the_rate_of_each_key():
+    urls = ['http://a.com/%d' % i for i in range(6)] + ['http://b.com/%d' % i for i in range(6)]
+    manager = ThreadManager(urls, echo, has_result=True, num_workers=4,
+                            task_queue_cls=functools.partial(PoliteTaskQueue, rate=20))
+    start = time.time()
+    assert sorted(manager.run(silent=True)) == sorted(urls)
+    # The 5 tasks of a host after the first one wait 0.05s each.
+    assert time.time() - start >= 0.2
+
+
+def test_polite_task_queue_limits_the_concurrency_of_each_key():
+    urls = ['http://c.com/%d' % i for i in range(20)]
+    manager = ThreadManager(urls, visit, has_result=True, num_workers=8,
+                            task_queue_cls=functools.partial(PoliteTaskQueue, max_concurrency=2))
+    assert max(manager.run(silent=True)) <= 2
+
+
+def test_tasks_whose_key_raises_are_failed():
+    urls = ['http://d.com/%d' % i for i in range(100)]
+    urls[50] = 'http://[abc'
+    manager = ThreadManager(urls, echo, has_result=True, num_workers=4, queue_size=20,
+                            task_queue_cls=PoliteTaskQueue)
+    res = []
+    runner = td.Thread(target=lambda: res.extend(manager.run_iter(ordered=True, silent=True)), daemon=True)
+    runner.start()
+    runner.join(60)
+    assert not runner.is_alive()
+    assert res == urls[:50] + urls[51:]
+    assert [task['source'] for task in manager.failed_tasks] == ['http://[abc']
+    assert 'ValueError' in manager.failed_tasks[0]['meta']['error']
@@ -0,0 +1,102 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import time
+
+import pytest
+
+from qspider import ThreadManager, ProcessManager, Checkpoint, CallbackSink, JSONLSink
+from qspider.sinks import SinkWriter
+
+
+def double(x):
+    return x * 2
+
+
+class LoggedSink(JSONLSink):
+    """A JSONLSink logging its writes and syncs into events."""
+
+    def __init__(self, path, events):
+        JSONLSink.__init__(self, path)
+        self.events = events
+
+    def write(self, results):
+        JSONLSink.write(self, results)
+        self.events.extend(('write', res // 2) for res in results)
+
+    def flush(self, sync=False):
+        JSONLSink.flush(self, sync)
+        if sync:
+            self.events.append(('sync', None))
+
+
+class LoggedCheckpoint(Checkpoint):
+    """A Checkpoint logging its records into events."""
+
+    def __init__(self, path, events):
+        Checkpoint.__init__(self, path)
+        self.events = events
+
+    def record(self, index):
+        self.events.append(('record', index))
+        Checkpoint.record(self, index)
+
+
+def reject(res):
+    raise IOError("disk full")
+
+
+def test_checkpoint_skips_results_the_sink_failed_to_write(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint'))
+    manager = ThreadManager(range(100), double, sink=CallbackSink(reject), checkpoint=checkpoint)
+    with pytest.raises(IOError):
+        manager.run(silent=True)
+    assert checkpoint.load() == 0
+
+
+@pytest.mark.parametrize('manager_cls', [ThreadManager, ProcessManager])
+def test_checkpoint_records_results_written_into_the_sink(tmp_path, manager_cls):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint'))
+    sink = JSONLSink(str(tmp_path / 'results.jsonl'))
+    manager_cls(range(100), double, sink=sink, checkpoint=checkpoint, num_workers=2).run(silent=True)
+    assert checkpoint.load() == 100
+
+
+def test_sink_writer_records_results_once_they_are_synced(tmp_path):
+    events = []
+    checkpoint = LoggedCheckpoint(str(tmp_path / 'checkpoint'), events)
+    writer = SinkWriter(LoggedSink(str(tmp_path / 'results.jsonl'), events), checkpoint=checkpoint)
+    writer.flush_interval = 0.01
+    writer.start()
+    for i in range(0, 100, 10):
+        writer.put([(index, True, 2 * index) for index in range(i, i + 10)])
+        time.sleep(0.02)
+    writer.close()
+    written = {index: i for i, (event, index) in enumerate(events) if event == 'write'}
+    syncs = [i for i, (event, index) in enumerate(events) if event == 'sync']
+    records = {index: i for i, (event, index) in enumerate(events) if event == 'record'}
+    assert sorted(records) == list(range(100))
+    for index, i in records.items():
+        # A sync comes between the write of the result and the record of its task.
+        assert any(written[index] < sync < i for sync in syncs)
+    assert checkpoint.load() == 100
@@ -0,0 +1,116 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import time
+import functools
+import threading as td
+
+from qspider import ThreadManager
+from qspider.core import make_task
+from qspider.spill import SpillTaskQueue
+
+
+def double(x):
+    return x * 2
+
+
+def drain(queue):
+    sources = []
+    while True:
+        task = queue.get()
+        if task is None:
+            return sources
+        sources.append(task['source'])
+        queue.release(task)
+        queue.task_done()
+
+
+def test_spill_task_queue_gives_spilled_tasks_in_order():
+    queue = SpillTaskQueue([make_task(double, i, i) for i in range(5000)], memsize=100, batch_size=50)
+    directory = queue.queue.directory
+    assert queue.queue.num_spilled > 0
+    assert drain(queue) == list(range(5000))
+    assert queue.finished()
+    queue.queue.close()
+    assert not os.path.exists(directory)
+
+
+def test_spill_task_queue_runs_unfinished_tasks_after_restart(tmp_path):
+    directory = str(tmp_path / 'frontier')
+    queue = SpillTaskQueue(memsize=10, batch_size=20, streaming=True, directory=directory)
+    queue.put_many([make_task(double, i, i) for i in range(300)])
+    for i in range(100):
+        task = queue.get()
+        queue.release(task)
+        queue.task_done()
+    # The process stops here, the tasks in memory are written when the queue is closed.
+    queue.queue.close()
+    queue = SpillTaskQueue(memsize=10, batch_size=20, streaming=True, directory=directory)
+    queue.close()
+    sources = drain(queue)
+    # Tasks done of a record with unfinished tasks run again too.
+    assert set(sources) >= set(range(100, 300))
+    assert len(sources) == len(set(sources)) < 220
+
+
+def test_spill_task_queue_is_closed_once_by_concurrent_workers(tmp_path):
+    queue = SpillTaskQueue(memsize=10, batch_size=20, streaming=True, directory=str(tmp_path / 'frontier'))
+    queue.put_many([make_task(double, i, i) for i in range(100)])
+    queue.close()
+    for i in range(100):
+        queue.release(queue.get())
+        queue.task_done()
+    spill = queue.queue._spill
+
+    def slow_spill():
+        # Let the other workers find the queue finished while it is being closed.
+        time.sleep(0.05)
+        spill()
+
+    queue.queue._spill = slow_spill
+    barrier = td.Barrier(16)
+    errors = []
+
+    def finish():
+        barrier.wait()
+        try:
+            for i in range(100):
+                assert queue.finished()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [td.Thread(target=finish) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert queue.queue.lock_fd is None
+
+
+def test_thread_manager_with_spill_task_queue(tmp_path):
+    queue_cls = functools.partial(SpillTaskQueue, directory=str(tmp_path / 'frontier'), memsize=50, batch_size=10)
+    res = ThreadManager(range(1000), double, has_result=True, num_workers=8, task_queue_cls=queue_cls).run(silent=True)
+    assert sorted(res) == [2 * i for i in range(1000)]
+    assert sorted(os.listdir(str(tmp_path / 'frontier'))) == ['lock']
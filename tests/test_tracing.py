@@ -0,0 +1,40 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+
+from qspider.tracing import Tracer
+
+
+def test_trace_starts_at_the_earliest_task_of_all_rings(tmp_path):
+    tracer = Tracer(str(tmp_path / 'trace.json'))
+    tracer.begin()
+    ring = tracer.ring()
+    # A long task ends after a short one started later.
+    ring.append((12.0, 13.0, 'short', 1, 1, 'ok', None))
+    ring.append((10.0, 14.0, 'long', 0, 1, 'ok', None))
+    tracer.dump(ring, 'worker')
+    assert tracer.end() == 2
+    with open(str(tmp_path / 'trace.json')) as f:
+        events = [event for event in json.load(f)['traceEvents'] if event['ph'] == 'X']
+    assert sorted(event['ts'] for event in events) == [0, 2e6]
@@ -0,0 +1,82 @@
+# MIT License
+#
+# Copyright (c) 2020 tishacy
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import gc
+import os
+import sys
+import subprocess
+
+from qspider import ProcessManager, SharedMemoryTransport
+from qspider import transport as transport_module
+
+
+def block(i):
+    return bytes([i]) * (1 << 18)
+
+
+def close_blocks(transport):
+    # Close the blocks of the results of the other tests.
+    gc.collect()
+    transport.close()
+    assert transport_module._mapped_blocks == []
+
+
+def test_shared_memory_results_are_mapped_back():
+    transport = SharedMemoryTransport()
+    close_blocks(transport)
+    res = ProcessManager(range(20), block, has_result=True, num_workers=2, shared_memory=transport).run(silent=True)
+    assert sorted(bytes(view[:1])[0] for view in res) == list(range(20))
+    assert all(len(view) == 1 << 18 for view in res)
+    assert len(transport_module._mapped_blocks) == 20
+    del res
+    close_blocks(transport)
+
+
+def test_shared_memory_results_beyond_max_mapped_are_copied():
+    transport = SharedMemoryTransport(max_mapped=4)
+    close_blocks(transport)
+    res = ProcessManager(range(20), block, has_result=True, num_workers=2, shared_memory=transport).run(silent=True)
+    assert sorted(bytes(view[:1])[0] for view in res) == list(range(20))
+    assert len(transport_module._mapped_blocks) == 4
+
+
+# Imports qspider as if multiprocessing.shared_memory did not exist, like on Python < 3.8.
+WITHOUT_SHARED_MEMORY = """
+import sys
+sys.modules['multiprocessing.shared_memory'] = None
+import qspider
+
+def block(i):
+    return bytes([i]) * (1 << 18)
+
+manager = qspider.ProcessManager(range(4), block, has_result=True, num_workers=2, shared_memory=True)
+assert not manager.transport.enabled
+assert sorted(res[0] for res in manager.run(silent=True)) == list(range(4))
+"""
+
+
+def test_results_are_pickled_without_shared_memory():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.run([sys.executable, '-c', WITHOUT_SHARED_MEMORY], env=dict(os.environ, PYTHONPATH=root),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=60)
+    assert process.returncode == 0, process.stderr.decode()